@@ -0,0 +1,364 @@
+'''
+@author Reina
+@desc 超大人脸库的近似最近邻(ANN)索引
+描述 :
+纯numpy实现的IVF索引: k-means粗量化器将人脸库分成n_lists个列表,
+查询时只在最近的n_probe个列表里精确计算距离并重排
+索引保存在二进制人脸库旁边, 随人脸库的追加/删除/压缩增量更新
+- IVFIndex类: 质心和每一行所属的列表, 可以训练, 增量同步, 保存和加载
+- IVFSearcher类: 在FaceMatcher的行上查询候选行
+- update_index函数: 生成或增量更新人脸库旁边的索引文件
+- recall_report函数: 不同n_probe下相对于精确搜索的召回率与耗时报告
+
+description:
+approximate nearest-neighbour (ANN) index for very large galleries
+a pure numpy IVF index: a k-means coarse quantizer splits the gallery into n_lists lists,
+a query only computes exact distances (re-ranking) inside its n_probe nearest lists
+the index is saved next to the binary gallery store and follows its append/delete/compaction incrementally
+- class: IVFIndex: centroids and the list of every row, can be trained, synced, saved and loaded
+- class: IVFSearcher: find candidate rows in the rows of a FaceMatcher
+- function: update_index: generate or incrementally update the index file next to the gallery store
+- function: recall_report: recall and latency against exact search for several n_probe
+'''
+
+#coding=utf-8
+
+import gallery_reina
+
+import os
+import time
+import numpy
+
+
+###------------------预定义变量 predefinition------------------###
+
+# filename of the index, saved next to the binary gallery store
+# 索引的文件名, 保存在二进制人脸库旁边
+ann_index_file = 'ann_index.npz'
+
+# number of lists searched for each query
+# 每次查询搜索的列表数
+default_n_probe = 8
+
+# k-means iterations when training
+# 训练时k-means的迭代次数
+kmeans_iterations = 10
+
+# at most this number of samples per list are used to train k-means
+# 训练k-means时每个列表最多使用的样本数
+samples_per_list = 256
+
+# train again when the gallery grows to this multiple of the trained size
+# 人脸库增长到训练时大小的这个倍数时重新训练
+retrain_growth = 4.0
+
+# rows per block when assigning rows to lists (bounds the memory)
+# 将行分配到列表时每块的行数 (限制内存)
+assign_block = 65536
+
+
+###------------------索引模块 index module------------------###
+
+#==============================================================
+# number of lists for a gallery of this size (4 * sqrt(N))
+# 该大小的人脸库应有的列表数 (4 * sqrt(N))
+# @parameter:
+# - row_count:  size of the gallery
+#               人脸库大小
+# @return: int
+def default_n_lists(row_count: int) -> int:
+    return max(1, min(row_count, int(4 * numpy.sqrt(row_count))))
+
+
+# squared distances between every row of a and every row of b
+# a的每一行与b的每一行之间的平方距离
+def _squared_distances(a: numpy.ndarray, b: numpy.ndarray) -> numpy.ndarray:
+    squared = (numpy.einsum('ij,ij->i', a, a)[:, None] + numpy.einsum('ij,ij->i', b, b)[None, :]
+               - 2.0 * (a @ b.T))
+    return numpy.maximum(squared, 0.0, out=squared)
+
+
+#==============================================================
+# IVF index on the rows of an EncodingStore
+# - centroids:      k-means centroids | float32 ndarray (n_lists x 128)
+# - assignments:    list of every store row (deleted rows included) | int32 ndarray
+# - generation:     the store generation the assignments belong to (rows change after a compaction)
+# - store_id:       the store the assignments belong to (a store built again at the same path starts at generation 0)
+# EncodingStore各行上的IVF索引
+# - centroids:      k-means质心 | float32 ndarray (n_lists x 128)
+# - assignments:    人脸库每一行所属的列表(包括被删除的行) | int32 ndarray
+# - generation:     assignments对应的人脸库generation (压缩后行号改变)
+# - store_id:       assignments对应的人脸库 (在同一路径重建的人脸库从第0代开始)
+class IVFIndex:
+
+    def __init__(self, centroids: numpy.ndarray, assignments: numpy.ndarray = None, generation: int = 0,
+                 trained_rows: int = 0, store_id: str = ''):
+        self.centroids = numpy.ascontiguousarray(centroids, dtype=numpy.float32)
+        if assignments is None:
+            assignments = numpy.empty(0, dtype=numpy.int32)
+        self.assignments = numpy.asarray(assignments, dtype=numpy.int32)
+        self.generation = generation
+        self.trained_rows = trained_rows
+        self.store_id = store_id
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    #==============================================================
+    # train the coarse quantizer with k-means
+    # 用k-means训练粗量化器
+    # @parameter:
+    # - encodings:  training encodings | ndarray (N x 128)
+    #               训练用的编码 | ndarray (N x 128)
+    # - n_lists:    number of lists, None for default_n_lists(N)
+    #               列表数, None则为default_n_lists(N)
+    # - seed:       random seed, the same seed gives the same index
+    #               随机种子, 相同的种子得到相同的索引
+    # @return:
+    # - index:  IVFIndex without assignments
+    #           没有assignments的IVFIndex
+    @classmethod
+    def train(cls, encodings: numpy.ndarray, n_lists: int = None, seed: int = 0):
+        encodings = numpy.asarray(encodings, dtype=numpy.float32)
+        row_count = len(encodings)
+        if row_count == 0:
+            return cls(numpy.empty((0, gallery_reina.encoding_dim), dtype=numpy.float32))
+        if n_lists is None:
+            n_lists = default_n_lists(row_count)
+        n_lists = max(1, min(n_lists, row_count))
+
+        # train on a sample, samples_per_list rows per list is enough for the centroids
+        # 在样本上训练, 每个列表samples_per_list行对质心来说已经足够
+        random = numpy.random.default_rng(seed)
+        sample_count = min(row_count, n_lists * samples_per_list)
+        samples = encodings[numpy.sort(random.choice(row_count, sample_count, replace=False))]
+        centroids = gallery_reina.kmeans(samples, n_lists, kmeans_iterations, seed)
+        return cls(centroids, trained_rows=row_count)
+
+    #==============================================================
+    # nearest list of every encoding, computed block by block
+    # 每个编码最近的列表, 分块计算
+    # @parameter:
+    # - encodings:  ndarray (N x 128)
+    # @return:
+    # - lists:  int32 ndarray (N)
+    def assign(self, encodings: numpy.ndarray) -> numpy.ndarray:
+        lists = numpy.empty(len(encodings), dtype=numpy.int32)
+        for start in range(0, len(encodings), assign_block):
+            block = numpy.asarray(encodings[start:start + assign_block], dtype=numpy.float32)
+            lists[start:start + len(block)] = numpy.argmin(_squared_distances(block, self.centroids), axis=1)
+        return lists
+
+    #==============================================================
+    # follow the changes of the store incrementally
+    # - appended rows are assigned to their nearest lists
+    # - deleted rows need nothing, searches skip them
+    # - after a compaction every row is assigned again with the same centroids
+    # 增量跟随人脸库的变化
+    # - 追加的行被分配到最近的列表
+    # - 被删除的行不需要处理, 搜索时跳过
+    # - 压缩之后用相同的质心重新分配每一行
+    # @parameter:
+    # - store:  gallery_reina.EncodingStore
+    # @return:
+    # - is_changed: whether the assignments are changed
+    #               assignments是否改变
+    def sync(self, store) -> bool:
+        is_changed = False
+        if (self.store_id != store.store_id or self.generation != store.generation
+                or len(self.assignments) > len(store.keys)):
+            self.assignments = numpy.empty(0, dtype=numpy.int32)
+            self.generation = store.generation
+            self.store_id = store.store_id
+            is_changed = True
+        new_rows = store.matrix[len(self.assignments):]
+        if len(new_rows) != 0:
+            self.assignments = numpy.concatenate([self.assignments, self.assign(new_rows)])
+            is_changed = True
+        return is_changed
+
+    #==============================================================
+    # searcher on the alive rows of the store (the rows of FaceMatcher.from_store)
+    # 人脸库未删除行上的搜索器 (即FaceMatcher.from_store的行)
+    # @parameter:
+    # - store:      gallery_reina.EncodingStore, synced with this index
+    #               与本索引同步过的gallery_reina.EncodingStore
+    # - n_probe:    number of lists searched for each query
+    #               每次查询搜索的列表数
+    # @return: IVFSearcher
+    def searcher(self, store, n_probe: int = default_n_probe):
+        alive_assignments = self.assignments[store.alive_mask()]
+        return IVFSearcher(self.centroids, alive_assignments, n_probe)
+
+    #==============================================================
+    # save the index atomically
+    # 原子地保存索引
+    # @parameter:
+    # - filename_withpath:  e.g. 'src/known/.json/ann_index.npz'
+    # @return: (no return)
+    def save(self, filename_withpath: str):
+        temp_filename = filename_withpath + '.tmp'
+        with open(temp_filename, 'wb') as temp_file:
+            numpy.savez(temp_file, centroids=self.centroids, assignments=self.assignments,
+                        generation=self.generation, trained_rows=self.trained_rows, store_id=self.store_id)
+        os.replace(temp_filename, filename_withpath)
+
+    #==============================================================
+    # load a saved index
+    # 加载保存的索引
+    # @parameter:
+    # - filename_withpath:  e.g. 'src/known/.json/ann_index.npz'
+    # @return: IVFIndex
+    @classmethod
+    def load(cls, filename_withpath: str):
+        with numpy.load(filename_withpath) as saved:
+            # indexes saved before store_id existed belong to the stores of the same age (empty store_id)
+            # store_id出现之前保存的索引属于同一时期的人脸库 (store_id为空)
+            store_id = str(saved['store_id']) if 'store_id' in saved.files else ''
+            return cls(saved['centroids'], saved['assignments'], int(saved['generation']), int(saved['trained_rows']),
+                       store_id)
+
+
+#==============================================================
+# candidate search on the rows of a FaceMatcher
+# 在FaceMatcher的行上搜索候选行
+# @parameter:
+# - centroids:      float32 ndarray (n_lists x 128)
+# - assignments:    list of every matcher row | int ndarray
+#                   匹配器每一行所属的列表 | int ndarray
+# - n_probe:        number of lists searched for each query
+#                   每次查询搜索的列表数
+class IVFSearcher:
+
+    def __init__(self, centroids: numpy.ndarray, assignments: numpy.ndarray, n_probe: int = default_n_probe):
+        self.centroids = centroids
+        self.n_probe = n_probe
+
+        # rows of every list, in one array sorted by list
+        # 每个列表的行, 按列表排序保存在一个数组中
+        self.rows = numpy.argsort(assignments, kind='stable')
+        self.starts = numpy.searchsorted(assignments[self.rows], numpy.arange(len(centroids) + 1))
+
+    #==============================================================
+    # candidate rows of every probe
+    # 每个查询的候选行
+    # @parameter:
+    # - probes: ndarray (M x 128)
+    # @return:
+    # - candidates: list of M int ndarray
+    #               M个int ndarray的列表
+    def candidates(self, probes: numpy.ndarray) -> list:
+        if len(self.centroids) == 0:
+            return [numpy.empty(0, dtype=numpy.intp) for _ in range(len(probes))]
+        n_probe = min(self.n_probe, len(self.centroids))
+        centroid_distances = _squared_distances(numpy.asarray(probes, dtype=numpy.float32), self.centroids)
+        nearest_lists = numpy.argpartition(centroid_distances, n_probe - 1, axis=1)[:, :n_probe]
+        candidates = []
+        for lists in nearest_lists:
+            candidates.append(numpy.concatenate([self.rows[self.starts[i]:self.starts[i + 1]] for i in lists]))
+        return candidates
+
+
+###------------------流程模块 flow module------------------###
+
+#==============================================================
+# generate the index next to the store, or update it incrementally
+# the index is trained again when the gallery grew retrain_growth times since the last training
+# 在人脸库旁边生成索引, 或增量更新它
+# 人脸库比上次训练时增长了retrain_growth倍时重新训练
+# @parameter:
+# - store:      gallery_reina.EncodingStore
+# - store_path: directory of the store files (e.g. 'src/known/.json/')
+#               人脸库文件的目录 (例: 'src/known/.json/')
+# @return:
+# - index:  IVFIndex synced with the store
+#           与人脸库同步的IVFIndex
+def update_index(store, store_path: str) -> IVFIndex:
+    filename_withpath = os.path.join(store_path, ann_index_file)
+    index = None
+    if os.path.exists(filename_withpath):
+        index = IVFIndex.load(filename_withpath)
+
+    if index is None or index.n_lists == 0 or len(store) > index.trained_rows * retrain_growth:
+        _, encodings = store.alive()
+        index = IVFIndex.train(encodings)
+        index.sync(store)
+    elif not index.sync(store):
+        return index
+
+    index.save(filename_withpath)
+    return index
+
+
+#==============================================================
+# load the index next to the store if it exists
+# 如果存在, 加载人脸库旁边的索引
+# @parameter:
+# - store_path: directory of the store files
+#               人脸库文件的目录
+# @return:
+# - index:  IVFIndex or None
+#           IVFIndex或None
+def load_index(store_path: str):
+    filename_withpath = os.path.join(store_path, ann_index_file)
+    if not os.path.exists(filename_withpath):
+        return None
+    return IVFIndex.load(filename_withpath)
+
+
+#==============================================================
+# recall and latency of the index against exact search, to choose n_probe
+# 索引相对于精确搜索的召回率与耗时, 用于选择n_probe
+# @parameter:
+# - encodings:  gallery | ndarray (N x 128)
+#               人脸库 | ndarray (N x 128)
+# - probes:     queries, None for noisy copies of random gallery rows | ndarray (M x 128)
+#               查询, None则使用随机人脸库行加噪声 | ndarray (M x 128)
+# - n_probes:   the n_probe values to test
+#               要测试的n_probe值
+# - index:      IVFIndex trained on the gallery, None to train one
+#               在人脸库上训练过的IVFIndex, None则训练一个
+# - probe_count:    number of generated queries when probes is None
+#                   probes为None时生成的查询数
+# - noise:      standard deviation of the noise of generated queries
+#               生成查询时噪声的标准差
+# @return:
+# - report: [{'n_probe': int, 'recall': float, 'ms_per_query': float, 'exact_ms_per_query': float,
+#             'candidates_per_query': float}]
+def recall_report(encodings: numpy.ndarray, probes: numpy.ndarray = None, n_probes=(1, 2, 4, 8, 16, 32),
+                  index: IVFIndex = None, probe_count: int = 200, noise: float = 0.02) -> list:
+    encodings = numpy.asarray(encodings, dtype=numpy.float32)
+    names = list(range(len(encodings)))
+    if probes is None:
+        random = numpy.random.default_rng(1)
+        picked = random.choice(len(encodings), min(probe_count, len(encodings)), replace=False)
+        probes = encodings[picked] + random.normal(0, noise, (len(picked), encodings.shape[1])).astype(numpy.float32)
+    if index is None:
+        index = IVFIndex.train(encodings)
+    assignments = index.assign(encodings)
+
+    # exact search is the ground truth
+    # 精确搜索作为标准答案
+    exact_matcher = gallery_reina.FaceMatcher.from_arrays(names, encodings)
+    start_time = time.perf_counter()
+    exact = [result['nearest'] for result in exact_matcher.match(probes)]
+    exact_ms = (time.perf_counter() - start_time) * 1000 / len(probes)
+
+    report = []
+    for n_probe in n_probes:
+        searcher = IVFSearcher(index.centroids, assignments, n_probe)
+        matcher = gallery_reina.FaceMatcher.from_arrays(names, encodings, searcher=searcher)
+        start_time = time.perf_counter()
+        approximate = [result['nearest'] for result in matcher.match(probes)]
+        elapsed_ms = (time.perf_counter() - start_time) * 1000 / len(probes)
+        candidate_count = numpy.mean([len(rows) for rows in searcher.candidates(probes)])
+        report.append({
+            'n_probe': n_probe,
+            'recall': float(numpy.mean([a == b for a, b in zip(approximate, exact)])),
+            'ms_per_query': elapsed_ms,
+            'exact_ms_per_query': exact_ms,
+            'candidates_per_query': float(candidate_count),
+        })
+    return report
+
@@ -0,0 +1,277 @@
+'''
+@author Reina
+@desc 人脸库自查: 重复录入与容易混淆的身份
+描述 :
+按块计算人脸库内所有编码两两之间的距离, 内存只与块大小和编码数成正比, 可以处理十万以上的身份
+- 重复录入: 距离小于duplicate_distance的编码对, 用并查集合并为簇 (跨身份的簇通常是同一个人被录入为两个名字)
+- 容易混淆的身份: 不同身份的编码距离小于容错率, 它们会互相误识别
+- 建议阈值: 每个编码到最近的其他身份的距离的分布中, confusion_rate分位数 (不计跨身份重复录入簇中的编码)
+- audit_gallery函数: 自查一组编码
+- audit_store函数: 自查二进制人脸库
+- format_report函数: 将自查结果整理为可读的文本
+
+description:
+self audit of the gallery: duplicate enrollments and lookalike identities
+all-pairs distances of the gallery are computed block by block, the memory only grows with the block size and
+the number of encodings, so galleries of 100k+ identities can be audited
+- duplicates: pairs of encodings closer than duplicate_distance, merged into clusters with union-find
+  (a cluster across identities is usually one person enrolled under two names)
+- lookalikes: encodings of different identities closer than the tolerance, they are matched as each other
+- suggested threshold: the confusion_rate quantile of the distance from every encoding to its nearest other identity
+  (the encodings in duplicate clusters across identities are left out)
+- function: audit_gallery: audit a set of encodings
+- function: audit_store: audit the binary gallery store
+- function: format_report: the audit result as readable text
+'''
+
+#coding=utf-8
+
+import gallery_reina
+
+import time
+import numpy
+
+
+###------------------预定义变量 predefinition------------------###
+
+# rows per block, a block of distances is block x block float32
+# 每块的行数, 一块距离为 block x block 的float32
+audit_block = 2048
+
+# pairs closer than this are duplicate enrollments (the same photo, or nearly the same, enrolled twice)
+# 距离小于此值的编码对视为重复录入 (同一张或几乎相同的照片被录入两次)
+duplicate_distance = 0.25
+
+# the suggested threshold lets this share of the encodings have another identity within it
+# 在建议阈值下, 有这么多比例的编码在阈值内存在其他身份
+confusion_rate = 0.01
+
+# at most this number of lookalike pairs are listed (all of them are counted)
+# 最多列出这么多对容易混淆的编码 (全部都会被计数)
+max_listed_pairs = 1000
+
+
+###------------------自查模块 audit module------------------###
+
+#==============================================================
+# audit a set of encodings against itself, block by block
+# 按块自查一组编码
+# @parameter:
+# - keys:               key of every encoding, the identity is gallery_reina.identity_of(key) | list of str
+#                       每个编码的键, 身份为gallery_reina.identity_of(key) | str的列表
+# - encodings:          ndarray (N x 128), a memory-map is read block by block
+#                       ndarray (N x 128), 内存映射会被逐块读取
+# - tolerance:          recognition tolerance, pairs of different identities closer than it are lookalikes
+#                       识别容错率, 距离小于它的不同身份编码对即为容易混淆的编码
+# - duplicate_distance: pairs closer than it are duplicates
+#                       距离小于它的编码对即为重复录入
+# - block:              rows per block
+#                       每块的行数
+# @return:
+# - report: {'encodings': int, 'identities': int, 'tolerance': float, 'duplicate_distance': float,
+#            'duplicate_clusters': [{'keys': [str], 'identities': [str], 'max_distance': float}],
+#            'lookalike_pairs': [{'a': str, 'b': str, 'distance': float}] (closest first, at most max_listed_pairs),
+#            'lookalike_count': int, 'nearest_other_identity': {'p01': float, 'p05': float, 'p50': float},
+#            'suggested_threshold': float or None, 'seconds': float}
+def audit_gallery(keys: list, encodings: numpy.ndarray, tolerance: float = gallery_reina.default_tolerance,
+                  duplicate_distance: float = duplicate_distance, block: int = audit_block) -> dict:
+    start_time = time.perf_counter()
+    row_count = len(keys)
+    identities = [gallery_reina.identity_of(key) for key in keys]
+    identity_names, identity_ids = numpy.unique(numpy.array(identities, dtype=str), return_inverse=True)
+
+    # squared norms once, every block of squared distances is |a|^2 + |b|^2 - 2ab
+    # 平方范数只计算一次, 每块的平方距离为 |a|^2 + |b|^2 - 2ab
+    norms = numpy.empty(row_count, dtype=numpy.float32)
+    for start in range(0, row_count, block):
+        rows = numpy.asarray(encodings[start:start + block], dtype=numpy.float32)
+        norms[start:start + block] = numpy.einsum('ij,ij->i', rows, rows)
+
+    # the float32 limits are a little wider, the candidates are checked again in float64
+    # float32的界限稍宽一些, 候选编码对会用float64再检查一次
+    nearest_other = numpy.full(row_count, numpy.inf, dtype=numpy.float32)
+    duplicate_limit = (duplicate_distance + 1e-3) ** 2
+    lookalike_limit = (tolerance + 1e-3) ** 2
+    pairs_a, pairs_b = [], []
+
+    # only the blocks on and above the diagonal, every pair is visited once
+    # 只计算对角线及其上方的块, 每对只访问一次
+    for i_start in range(0, row_count, block):
+        i_rows = numpy.asarray(encodings[i_start:i_start + block], dtype=numpy.float32)
+        i_end = i_start + len(i_rows)
+        for j_start in range(i_start, row_count, block):
+            j_rows = i_rows if j_start == i_start else numpy.asarray(encodings[j_start:j_start + block],
+                                                                     dtype=numpy.float32)
+            j_end = j_start + len(j_rows)
+            squared = norms[i_start:i_end, None] + norms[None, j_start:j_end] - 2 * (i_rows @ j_rows.T)
+            numpy.maximum(squared, 0, out=squared)
+
+            # nearest other identity of the rows on both sides of the block
+            # 块两侧的行到最近的其他身份的距离
+            same = identity_ids[i_start:i_end, None] == identity_ids[None, j_start:j_end]
+            others = numpy.where(same, numpy.inf, squared)
+            numpy.minimum(nearest_other[i_start:i_end], others.min(axis=1), out=nearest_other[i_start:i_end])
+            numpy.minimum(nearest_other[j_start:j_end], others.min(axis=0), out=nearest_other[j_start:j_end])
+
+            # candidate pairs: duplicates of any identity and lookalikes of different identities,
+            # the diagonal block keeps its upper triangle only
+            # 候选编码对: 任何身份的重复录入与不同身份的容易混淆的编码, 对角线上的块只保留上三角
+            is_close = (squared < duplicate_limit) | (others < lookalike_limit)
+            if j_start == i_start:
+                is_close &= numpy.triu(numpy.ones(is_close.shape, dtype=bool), 1)
+            a, b = numpy.nonzero(is_close)
+            pairs_a.append(a + i_start)
+            pairs_b.append(b + j_start)
+
+    pairs_a = numpy.concatenate(pairs_a) if len(pairs_a) != 0 else numpy.empty(0, dtype=numpy.intp)
+    pairs_b = numpy.concatenate(pairs_b) if len(pairs_b) != 0 else numpy.empty(0, dtype=numpy.intp)
+
+    # the distances of the candidate pairs again, exactly in float64
+    # 候选编码对的距离用float64重新精确计算
+    distances = numpy.empty(len(pairs_a), dtype=numpy.float64)
+    for start in range(0, len(pairs_a), block):
+        a_rows = _rows(encodings, pairs_a[start:start + block])
+        b_rows = _rows(encodings, pairs_b[start:start + block])
+        distances[start:start + block] = numpy.linalg.norm(a_rows - b_rows, axis=1)
+
+    # duplicates: union-find over the pairs closer than duplicate_distance
+    # 重复录入: 对距离小于duplicate_distance的编码对做并查集
+    is_duplicate = distances < duplicate_distance
+    clusters = _clusters(pairs_a[is_duplicate], pairs_b[is_duplicate], distances[is_duplicate])
+    duplicate_clusters = []
+    is_mislabeled = numpy.zeros(row_count, dtype=bool)
+    for members, max_distance in clusters:
+        if len({identity_ids[row] for row in members}) > 1:
+            is_mislabeled[members] = True
+        duplicate_clusters.append({'keys': [keys[row] for row in members],
+                                   'identities': sorted({identities[row] for row in members}),
+                                   'max_distance': max_distance})
+    duplicate_clusters.sort(key=lambda cluster: (-len(cluster['identities']), -len(cluster['keys'])))
+
+    # lookalikes: different identities closer than the tolerance
+    # 容易混淆: 距离小于容错率的不同身份
+    is_lookalike = (distances <= tolerance) & (identity_ids[pairs_a] != identity_ids[pairs_b])
+    order = numpy.argsort(distances[is_lookalike], kind='stable')[:max_listed_pairs]
+    lookalike_pairs = [{'a': keys[a], 'b': keys[b], 'distance': float(distance)} for a, b, distance in
+                       zip(pairs_a[is_lookalike][order], pairs_b[is_lookalike][order], distances[is_lookalike][order])]
+
+    # threshold from the distribution of the nearest other identity (only rows which have another identity),
+    # rows in duplicate clusters across identities are left out, they are to be cleaned up rather than tolerated
+    # 由到最近的其他身份的距离分布得到阈值 (只考虑存在其他身份的行),
+    # 跨身份重复录入簇中的行不计入, 它们应被清理而不是被容忍
+    nearest_other = nearest_other[numpy.isfinite(nearest_other) & ~is_mislabeled]
+    nearest_other = numpy.sqrt(nearest_other.astype(numpy.float64))
+    quantiles = {'p01': None, 'p05': None, 'p50': None}
+    suggested_threshold = None
+    if len(nearest_other) != 0:
+        quantiles = {name: float(numpy.quantile(nearest_other, q))
+                     for name, q in (('p01', 0.01), ('p05', 0.05), ('p50', 0.5))}
+        suggested_threshold = float(numpy.floor(numpy.quantile(nearest_other, confusion_rate) * 100) / 100)
+
+    return {
+        'encodings': row_count,
+        'identities': len(identity_names),
+        'tolerance': tolerance,
+        'duplicate_distance': duplicate_distance,
+        'duplicate_clusters': duplicate_clusters,
+        'lookalike_pairs': lookalike_pairs,
+        'lookalike_count': int(is_lookalike.sum()),
+        'nearest_other_identity': quantiles,
+        'suggested_threshold': suggested_threshold,
+        'seconds': time.perf_counter() - start_time,
+    }
+
+
+# rows in float64, read in sorted order so that a memory-map is read front to back
+# 以float64读取行, 按排序后的顺序读取, 使内存映射从前往后读取
+def _rows(encodings, rows):
+    order = numpy.argsort(rows)
+    result = numpy.empty((len(rows), encodings.shape[1]), dtype=numpy.float64)
+    result[order] = encodings[rows[order]]
+    return result
+
+# union-find over the pairs, returns [(rows of the cluster, max pair distance)] of the clusters with 2+ rows
+# 对编码对做并查集, 返回有2行以上的簇 [(簇中的行, 最大的编码对距离)]
+def _clusters(pairs_a, pairs_b, distances):
+    parent = {}
+
+    def find(row):
+        root = row
+        while parent.get(root, root) != root:
+            root = parent[root]
+        # path compression
+        # 路径压缩
+        while parent.get(row, row) != root:
+            parent[row], row = root, parent[row]
+        return root
+
+    for a, b in zip(pairs_a.tolist(), pairs_b.tolist()):
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    members = {}
+    max_distance = {}
+    for a, b, distance in zip(pairs_a.tolist(), pairs_b.tolist(), distances.tolist()):
+        root = find(a)
+        members.setdefault(root, set()).update((a, b))
+        max_distance[root] = max(max_distance.get(root, 0.0), distance)
+    return [(sorted(rows), max_distance[root]) for root, rows in sorted(members.items())]
+
+
+#==============================================================
+# audit the binary gallery store, rows are read block by block from the memory-map
+# 自查二进制人脸库, 从内存映射中逐块读取行
+# @parameter:
+# - store:              gallery_reina.EncodingStore
+# - tolerance:          recognition tolerance
+#                       识别容错率
+# - duplicate_distance: pairs closer than it are duplicates
+#                       距离小于它的编码对即为重复录入
+# @return:
+# - report: same as audit_gallery, plus 'version' of the store
+#           与audit_gallery相同, 另有人脸库的'version'
+def audit_store(store, tolerance: float = gallery_reina.default_tolerance,
+                duplicate_distance: float = duplicate_distance) -> dict:
+    keys, encodings = store.alive()
+    report = audit_gallery(keys, encodings, tolerance, duplicate_distance)
+    report['version'] = store.version
+    return report
+
+
+#==============================================================
+# the audit result as readable text
+# 将自查结果整理为可读的文本
+# @parameter:
+# - report: return value of audit_gallery or audit_store
+#           audit_gallery或audit_store的返回值
+# - limit:  max number of clusters and pairs listed
+#           最多列出的簇与编码对的数量
+# @return: str
+def format_report(report: dict, limit: int = 20) -> str:
+    lines = ['{} encodings, {} identities, audited in {:.2f}s'.format(report['encodings'], report['identities'],
+                                                                      report['seconds'])]
+
+    clusters = report['duplicate_clusters']
+    lines.append('')
+    lines.append('duplicate clusters (distance < {}): {}'.format(report['duplicate_distance'], len(clusters)))
+    for cluster in clusters[:limit]:
+        across = '  <- {} identities'.format(len(cluster['identities'])) if len(cluster['identities']) > 1 else ''
+        lines.append('  {:.3f}  {}{}'.format(cluster['max_distance'], ', '.join(cluster['keys']), across))
+
+    lines.append('')
+    lines.append('lookalike pairs (different identities, distance <= {}): {}'.format(report['tolerance'],
+                                                                                    report['lookalike_count']))
+    for pair in report['lookalike_pairs'][:limit]:
+        lines.append('  {:.3f}  {}  {}'.format(pair['distance'], pair['a'], pair['b']))
+
+    quantiles = report['nearest_other_identity']
+    lines.append('')
+    if report['suggested_threshold'] is None:
+        lines.append('only one identity, no threshold can be suggested')
+    else:
+        lines.append('nearest other identity: p01 {p01:.3f}, p05 {p05:.3f}, p50 {p50:.3f}'.format(**quantiles))
+        lines.append('suggested threshold: {:.2f} ({:.0%} of the encodings have another identity within it, '
+                     'current tolerance {})'.format(report['suggested_threshold'], confusion_rate,
+                                                    report['tolerance']))
+    return '\n'.join(lines)
@@ -0,0 +1,629 @@
+'''
+@author Reina
+@desc 离线可复现的检测/编码/匹配性能测试
+描述 :
+使用随机的128维编码生成任意大小的人脸库与探测集, 固定随机种子, 结果写入json文件以便在不同提交之间比较
+- bench_gallery_load函数: 从encoding.json加载人脸库与从二进制人脸库加载(内存映射)的耗时
+- bench_incremental_update函数: 人脸库增量更新的耗时 (文件夹变化检测, 追加, 标记删除, 压缩)
+- bench_match函数: 批量匹配与逐张匹配的耗时, 以及旧的逐人循环(参考)
+- bench_quantized函数: int8量化第一遍搜索加精确重排的耗时, 以及与精确扫描结果的一致性
+- bench_memory函数: 人脸库各种表示的内存, 每个人与每百万人
+- bench_folder_throughput函数: 在生成的小图片上运行recognize_a_folder的吞吐量 (需要face_recognition)
+- bench_startup函数: 轻量命令行命令(整个进程)的启动时间与预算, 以及是否导入了重量级依赖
+- run_benchmarks函数: 运行所有测试并返回结果字典
+- 命令行: python benchmark_reina.py --sizes 100,10000,100000 --output benchmark_results.json
+
+description:
+reproducible offline benchmarks of the detection/encoding/matching pipeline
+galleries and probe sets of any size are generated from random 128-d encodings with a fixed seed,
+results are written to a json file so that runs can be compared across commits
+- function: bench_gallery_load: time to load the gallery from encoding.json and from the binary store (memory-map)
+- function: bench_incremental_update: time of incremental gallery updates (folder change detection, append,
+                                      tombstone-delete, compaction)
+- function: bench_match: time of batched and one-by-one matching, plus the old per-identity loop (reference)
+- function: bench_quantized: time of the int8 quantized first pass plus exact re-ranking,
+                             and its agreement with the exact scan
+- function: bench_memory: memory of the gallery representations, per identity and per million identities
+- function: bench_folder_throughput: throughput of recognize_a_folder on generated small images
+                                     (needs face_recognition)
+- function: bench_startup: startup time (whole process) of the lightweight cli commands against their budget,
+                           and whether a heavy dependency was imported
+- function: run_benchmarks: run every benchmark and return the results dictionary
+- command line: python benchmark_reina.py --sizes 100,10000,100000 --output benchmark_results.json
+'''
+
+#coding=utf-8
+
+import gallery_reina
+import folder_manager_reina
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+import numpy
+
+
+###------------------预定义变量 predefinition------------------###
+
+# gallery sizes (number of identities)
+# 人脸库大小 (人数)
+default_sizes = [100, 10000, 100000]
+
+# number of probe faces matched in each size
+# 每种大小匹配的探测人脸数
+default_probe_count = 100
+
+# every measurement is repeated this many times, the best (minimum) and the median are reported
+# 每项测量重复的次数, 报告最好(最小)值与中位数
+default_repeats = 3
+
+# number of generated images for the folder throughput
+# 文件夹吞吐量测试中生成的图片数
+default_image_count = 50
+
+# size (width, height) of the generated images
+# 生成图片的大小 (宽, 高)
+image_size = (320, 240)
+
+# the old per-identity loop is only timed up to this gallery size (it is slow)
+# 旧的逐人循环只在不超过这个人脸库大小时计时 (它很慢)
+legacy_loop_max_size = 10000
+
+# ratio of the gallery changed in the incremental update benchmark
+# 增量更新测试中改变的人脸库比例
+update_ratio = 0.01
+
+# gallery size of the startup benchmark
+# 启动时间测试的人脸库大小
+startup_gallery_size = 1000
+
+# gallery size whose memory is measured, reported per identity and per million identities
+# 测量内存的人脸库大小, 按每人与每百万人报告
+memory_gallery_size = 20000
+
+# default output file
+# 默认的输出文件
+default_output = 'benchmark_results.json'
+
+# random seed, the same seed gives the same galleries, probes and images
+# 随机种子, 相同的种子得到相同的人脸库, 探测集与图片
+default_seed = 0
+
+
+###------------------数据模块 data module------------------###
+
+#==============================================================
+# synthetic gallery: random unit-scale 128-d encodings (real encodings have a norm close to 1)
+# 合成的人脸库: 随机的128维编码 (真实编码的模长接近1)
+# @parameter:
+# - size:   number of identities
+#           人数
+# - seed:   random seed
+#           随机种子
+# @return:
+# - names:      ['person000000', ...]
+# - encodings:  float64 ndarray (size x 128)
+def synthetic_gallery(size: int, seed: int = default_seed):
+    random = numpy.random.default_rng(seed)
+    encodings = random.normal(size=(size, gallery_reina.encoding_dim))
+    encodings /= numpy.linalg.norm(encodings, axis=1, keepdims=True)
+    names = ['person{:0>6d}'.format(i) for i in range(size)]
+    return names, encodings
+
+
+#==============================================================
+# synthetic probes: half are noisy copies of gallery rows (should match), half are new faces (should not)
+# 合成的探测集: 一半是人脸库行加噪声 (应该匹配), 一半是新的人脸 (不应该匹配)
+# @parameter:
+# - encodings:      gallery encodings | ndarray (N x 128)
+#                   人脸库编码 | ndarray (N x 128)
+# - probe_count:    number of probes
+#                   探测人脸数
+# - seed:           random seed
+#                   随机种子
+# @return:
+# - probes: float64 ndarray (probe_count x 128)
+def synthetic_probes(encodings: numpy.ndarray, probe_count: int, seed: int = default_seed) -> numpy.ndarray:
+    random = numpy.random.default_rng(seed + 1)
+    known_count = probe_count // 2
+    rows = random.integers(0, len(encodings), known_count)
+    known = encodings[rows] + random.normal(scale=0.02, size=(known_count, gallery_reina.encoding_dim))
+    new = random.normal(size=(probe_count - known_count, gallery_reina.encoding_dim))
+    new /= numpy.linalg.norm(new, axis=1, keepdims=True)
+    return numpy.vstack([known, new])
+
+
+# time a function, returns {'best': seconds, 'median': seconds, 'repeats': int}
+# 计时一个函数, 返回 {'best': 秒, 'median': 秒, 'repeats': int}
+def _time_it(function, repeats: int) -> dict:
+    times = []
+    for _ in range(max(1, repeats)):
+        start_time = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start_time)
+    return {'best': min(times), 'median': float(numpy.median(times)), 'repeats': len(times)}
+
+
+###------------------测试模块 benchmark module------------------###
+
+#==============================================================
+# time to load the gallery: encoding.json (parse every float) versus the binary store (memory-map), both to a matcher
+# 加载人脸库的耗时: encoding.json (解析每个浮点数) 与二进制人脸库 (内存映射), 都生成匹配器
+# @parameter:
+# - size:       number of identities
+#               人数
+# - work_path:  temporary directory for the files
+#               存放文件的临时目录
+# - repeats:    number of repeats
+#               重复次数
+# - seed:       random seed
+#               随机种子
+# @return: list of result dictionaries
+#          结果字典的列表
+def bench_gallery_load(size: int, work_path: str, repeats: int = default_repeats, seed: int = default_seed) -> list:
+    names, encodings = synthetic_gallery(size, seed)
+    store_path = os.path.join(work_path, 'load_{}'.format(size)) + '/'
+    os.makedirs(store_path, exist_ok=True)
+
+    json_file = os.path.join(store_path, 'encoding.json')
+    with open(json_file, 'w', encoding='utf-8') as encoding_file:
+        json.dump({name: encoding.tolist() for name, encoding in zip(names, encodings)}, encoding_file)
+    gallery_reina.EncodingStore(store_path).append(names, encodings)
+
+    def load_json():
+        with open(json_file, 'r', encoding='utf-8') as encoding_file:
+            encoding_dict = json.load(encoding_file)
+        gallery_reina.FaceMatcher({name: numpy.array(value) for name, value in encoding_dict.items()})
+
+    def load_store():
+        gallery_reina.FaceMatcher.from_store(gallery_reina.EncodingStore(store_path))
+
+    return [
+        dict(name='gallery_load_json', size=size, **_time_it(load_json, repeats)),
+        dict(name='gallery_load_store', size=size, **_time_it(load_store, repeats)),
+    ]
+
+
+#==============================================================
+# time of incremental gallery updates, the bookkeeping of update_encoding_store without encoding faces:
+# change detection of a known folder with one file per identity, appending, deleting and compacting update_ratio rows
+# 人脸库增量更新的耗时, 即update_encoding_store中除编码人脸外的部分:
+# 每人一个文件的已知文件夹的变化检测, 追加, 删除与压缩update_ratio比例的行
+# @parameter: same as bench_gallery_load
+#             与bench_gallery_load相同
+# @return: list of result dictionaries
+#          结果字典的列表
+def bench_incremental_update(size: int, work_path: str, repeats: int = default_repeats,
+                             seed: int = default_seed) -> list:
+    names, encodings = synthetic_gallery(size, seed)
+    changed = max(1, int(size * update_ratio))
+    results = []
+
+    # change detection: scan the known folder and diff it with the saved state, after touching some files
+    # 变化检测: 修改部分文件后, 扫描已知文件夹并与保存的状态比较
+    known_path = os.path.join(work_path, 'known_{}'.format(size)) + '/'
+    os.makedirs(known_path, exist_ok=True)
+    for name in names:
+        with open(known_path + name + '.jpg', 'wb') as image_file:
+            image_file.write(name.encode('utf-8'))
+    state_file = os.path.join(work_path, 'modate_{}.json'.format(size))
+    folder_manager_reina.save_dict(folder_manager_reina.scan_folder(known_path, use_hash=True), state_file)
+    for name in names[:changed]:
+        os.utime(known_path + name + '.jpg', (time.time() + 10, time.time() + 10))
+
+    for use_hash in (False, True):
+        detect = lambda: folder_manager_reina.get_change(known_path, state_file, use_hash=use_hash)
+        results.append(dict(name='change_detection' + ('_hash' if use_hash else ''), size=size, changed=changed,
+                            **_time_it(detect, repeats)))
+
+    # store operations, on a fresh copy of the store for every repeat
+    # 人脸库操作, 每次重复都使用新的人脸库副本
+    base_path = os.path.join(work_path, 'update_{}'.format(size)) + '/'
+    os.makedirs(base_path, exist_ok=True)
+    gallery_reina.EncodingStore(base_path).append(names, encodings)
+    new_names = ['new{:0>6d}'.format(i) for i in range(changed)]
+    new_encodings = synthetic_gallery(changed, seed + 2)[1]
+
+    def fresh_store():
+        copy_path = os.path.join(work_path, 'update_copy') + '/'
+        shutil.rmtree(copy_path, ignore_errors=True)
+        shutil.copytree(base_path, copy_path)
+        return gallery_reina.EncodingStore(copy_path)
+
+    for operation in ('append', 'delete', 'compact'):
+        times = []
+        for _ in range(max(1, repeats)):
+            store = fresh_store()
+            if operation == 'compact':
+                store.delete(names[:changed])
+            start_time = time.perf_counter()
+            if operation == 'append':
+                store.append(new_names, new_encodings)
+            elif operation == 'delete':
+                store.delete(names[:changed])
+            else:
+                store.compact()
+            times.append(time.perf_counter() - start_time)
+        results.append({'name': 'store_' + operation, 'size': size, 'changed': changed, 'best': min(times),
+                        'median': float(numpy.median(times)), 'repeats': len(times)})
+    return results
+
+
+#==============================================================
+# time of matching probes against the gallery
+# - match_batch: all probes in one FaceMatcher.match call
+# - match_single: one FaceMatcher.match call per probe (like face_people_match)
+# - match_legacy_loop: the old loop over every identity (reference, only up to legacy_loop_max_size)
+# face_people_match itself is not timed on purpose: it encodes the image with face_recognition first, and the suite
+# runs offline without it; match_single is its matching step on already encoded probes
+# 将探测人脸与人脸库匹配的耗时
+# - match_batch: 一次FaceMatcher.match调用匹配所有探测人脸
+# - match_single: 每张探测人脸一次FaceMatcher.match调用 (与face_people_match相同)
+# - match_legacy_loop: 旧的逐人循环 (参考, 只到legacy_loop_max_size)
+# 有意不直接测量face_people_match: 它先用face_recognition编码图片, 而基准测试不依赖它离线运行;
+# match_single即为它对已编码探测人脸的匹配步骤
+# @parameter:
+# - size:           number of identities
+#                   人数
+# - probe_count:    number of probes
+#                   探测人脸数
+# - repeats:        number of repeats
+#                   重复次数
+# - seed:           random seed
+#                   随机种子
+# @return: list of result dictionaries, with 'per_probe' seconds
+#          结果字典的列表, 包括每张探测人脸的秒数'per_probe'
+def bench_match(size: int, probe_count: int = default_probe_count, repeats: int = default_repeats,
+                seed: int = default_seed) -> list:
+    names, encodings = synthetic_gallery(size, seed)
+    probes = synthetic_probes(encodings, probe_count, seed)
+    matcher = gallery_reina.FaceMatcher.from_arrays(names, encodings)
+
+    def match_single():
+        for probe in probes:
+            matcher.match(probe[None, :])
+
+    def match_legacy_loop():
+        matched = []
+        for probe in probes:
+            best_name, best_distance = None, float('inf')
+            for name, encoding in zip(names, encodings):
+                distance = numpy.linalg.norm(encoding - probe)
+                if distance < best_distance:
+                    best_name, best_distance = name, distance
+            matched.append(best_name)
+        return matched
+
+    benchmarks = [('match_batch', lambda: matcher.match(probes)), ('match_single', match_single)]
+    if size <= legacy_loop_max_size:
+        benchmarks.append(('match_legacy_loop', match_legacy_loop))
+
+    results = []
+    for name, function in benchmarks:
+        result = dict(name=name, size=size, probes=probe_count, **_time_it(function, repeats))
+        result['per_probe'] = result['best'] / probe_count
+        results.append(result)
+    return results
+
+
+#==============================================================
+# time of the int8 quantized first pass with exact re-ranking, against the exact scan of the same float32 rows
+# agreement: share of probes whose name, nearest and runner_up are the same, and the largest distance difference
+# 使用int8量化第一遍搜索加精确重排的耗时, 与相同float32行上的精确扫描比较
+# 一致性: name, nearest与runner_up都相同的探测人脸比例, 以及最大的距离差
+# @parameter: same as bench_match
+#             与bench_match相同
+# @return: list of result dictionaries, with 'per_probe' seconds, 'agreement' and 'max_distance_difference'
+#          结果字典的列表, 包括每张探测人脸的秒数'per_probe', 一致性'agreement'与最大距离差'max_distance_difference'
+def bench_quantized(size: int, probe_count: int = default_probe_count, repeats: int = default_repeats,
+                    seed: int = default_seed) -> list:
+    names, encodings = synthetic_gallery(size, seed)
+    probes = synthetic_probes(encodings, probe_count, seed)
+    encodings = encodings.astype(numpy.float32)
+    exact_matcher = gallery_reina.FaceMatcher.from_arrays(names, encodings)
+    searcher = gallery_reina.QuantizedSearcher(encodings)
+    quantized_matcher = gallery_reina.FaceMatcher.from_arrays(names, encodings, searcher=searcher)
+
+    exact = exact_matcher.match(probes)
+    quantized = quantized_matcher.match(probes)
+    agreement = numpy.mean([all(a[key] == b[key] for key in ('name', 'nearest', 'runner_up'))
+                            for a, b in zip(exact, quantized)])
+    difference = max(abs(a['distance'] - b['distance']) for a, b in zip(exact, quantized))
+
+    results = []
+    for name, matcher in (('match_exact_float32', exact_matcher), ('match_int8_rerank', quantized_matcher)):
+        result = dict(name=name, size=size, probes=probe_count, **_time_it(lambda: matcher.match(probes), repeats))
+        result['per_probe'] = result['best'] / probe_count
+        results.append(result)
+    results[1]['rerank'] = searcher.rerank
+    results[1]['agreement'] = float(agreement)
+    results[1]['max_distance_difference'] = float(difference)
+    return results
+
+
+# bytes allocated while building a representation (numpy buffers are traced too)
+# 生成一种表示时分配的字节数 (numpy的缓冲区也被跟踪)
+def _allocated_bytes(build) -> int:
+    tracemalloc.start()
+    try:
+        kept = build()
+        allocated = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del kept
+    return allocated
+
+#==============================================================
+# resident memory of the gallery representations, measured on size identities with tracemalloc:
+# - encoding_dict_float64:  {name: float64 ndarray}, one python object per person (gen_sav_encodings_dict)
+# - matcher_float32:        one float32 matrix, its squared norms and one name array (FaceMatcher)
+# - quantized_int8:         int8 codes, their squared norms and one name array (QuantizedSearcher);
+#                           the float32 rows for re-ranking stay memory-mapped in the store, only candidates are read
+# 人脸库各种表示的常驻内存, 用tracemalloc在size个人上测量:
+# - encoding_dict_float64:  {name: float64 ndarray}, 每人一个python对象 (gen_sav_encodings_dict)
+# - matcher_float32:        一个float32矩阵, 其平方范数与一个名字数组 (FaceMatcher)
+# - quantized_int8:         int8编码, 其平方范数与一个名字数组 (QuantizedSearcher);
+#                           用于重排的float32行保持在人脸库中内存映射, 只读取候选行
+# @parameter:
+# - size:   number of identities
+#           人数
+# - seed:   random seed
+#           随机种子
+# @return: list of result dictionaries, with 'bytes_per_identity' and 'mb_per_million'
+#          结果字典的列表, 包括每人字节数'bytes_per_identity'与每百万人的MB数'mb_per_million'
+def bench_memory(size: int = memory_gallery_size, seed: int = default_seed) -> list:
+    names, encodings = synthetic_gallery(size, seed)
+    encodings32 = encodings.astype(numpy.float32)
+
+    def build_dict():
+        return {str(name): numpy.array(encoding) for name, encoding in zip(names, encodings)}
+
+    def build_matcher():
+        return gallery_reina.FaceMatcher.from_arrays(names, encodings32.copy())
+
+    def build_quantized():
+        return numpy.array(names), gallery_reina.QuantizedSearcher(encodings32)
+
+    results = []
+    for name, build in (('encoding_dict_float64', build_dict), ('matcher_float32', build_matcher),
+                        ('quantized_int8', build_quantized)):
+        per_identity = _allocated_bytes(build) / size
+        results.append({'name': 'memory_' + name, 'size': size, 'bytes_per_identity': per_identity,
+                        'mb_per_million': per_identity * 1000000 / 2 ** 20})
+    return results
+
+
+#==============================================================
+# throughput of recognize_a_folder on generated small images (random shapes, mostly without faces,
+# so it measures decoding, detection and the folder flow) with one worker and with all cpu cores
+# skipped when face_recognition is not installed
+# 在生成的小图片上运行recognize_a_folder的吞吐量 (随机图形, 大多没有人脸, 因此测量的是解码, 检测与文件夹流程)
+# 分别使用一个工作进程与全部cpu核心
+# 没有安装face_recognition时跳过
+# @parameter:
+# - image_count:    number of generated images
+#                   生成的图片数
+# - work_path:      temporary directory for the files
+#                   存放文件的临时目录
+# - seed:           random seed
+#                   随机种子
+# @return: list of result dictionaries, with 'images_per_second'
+#          结果字典的列表, 包括每秒图片数'images_per_second'
+def bench_folder_throughput(image_count: int, work_path: str, seed: int = default_seed) -> list:
+    try:
+        import facekit_reina
+        from lazy_reina import face_recognition, cv2
+        face_recognition.load()
+        cv2.load()
+    except ImportError as error:
+        return [{'name': 'folder_throughput', 'skipped': repr(error)}]
+
+    random = numpy.random.default_rng(seed)
+    unknown_path = os.path.join(work_path, 'unknown') + '/'
+    known_path = os.path.join(work_path, 'known_empty') + '/'
+    os.makedirs(unknown_path, exist_ok=True)
+    os.makedirs(known_path, exist_ok=True)
+    width, height = image_size
+    for i in range(image_count):
+        image = random.integers(0, 256, (height, width, 3), dtype=numpy.uint8)
+        center = (int(random.integers(0, width)), int(random.integers(0, height)))
+        cv2.circle(image, center, int(random.integers(10, 60)), (255, 220, 200), -1)
+        cv2.imwrite(unknown_path + 'image{:0>4d}.jpg'.format(i), image)
+
+    # the gallery files of facekit_reina go to the temporary directory
+    # facekit_reina的人脸库文件写到临时目录
+    old_json_path = facekit_reina.json_path
+    facekit_reina.json_path = os.path.join(work_path, 'known_json') + '/'
+    results = []
+    try:
+        for workers in sorted({1, os.cpu_count() or 1}):
+            start_time = time.perf_counter()
+            facekit_reina.recognize_a_folder(unknown_path, None, known_path, workers=workers,
+                                             output_format='jsonl', output_file=os.devnull)
+            elapsed = time.perf_counter() - start_time
+            results.append({'name': 'folder_throughput', 'images': image_count, 'workers': workers,
+                            'seconds': elapsed, 'images_per_second': image_count / elapsed if elapsed > 0 else 0.0})
+    finally:
+        facekit_reina.json_path = old_json_path
+    return results
+
+
+# run in a fresh interpreter: one cli command, then print the heavy modules it imported
+# 在新的解释器中运行: 一条命令行命令, 然后打印它导入的重量级模块
+_startup_code = '''
+import io, sys, json, contextlib
+import cli_reina
+with contextlib.redirect_stdout(io.StringIO()):
+    cli_reina.main(sys.argv[1:])
+print(json.dumps(sorted(name for name in ('face_recognition', 'dlib', 'cv2') if name in sys.modules)))
+'''
+
+#==============================================================
+# startup time of the lightweight cli commands, each in a fresh interpreter (the whole process is timed)
+# 轻量命令行命令的启动时间, 每次在新的解释器中运行 (对整个进程计时)
+# @parameter:
+# - work_path:  temporary directory for the files
+#               存放文件的临时目录
+# - repeats:    number of repeats
+#               重复次数
+# - seed:       random seed
+#               随机种子
+# @return: list of result dictionaries, with 'budget', 'within_budget' and 'heavy_modules'
+#          结果字典的列表, 包括预算'budget', 是否在预算内'within_budget'与导入的重量级模块'heavy_modules'
+def bench_startup(work_path: str, repeats: int = default_repeats, seed: int = default_seed) -> list:
+    import cli_reina
+
+    names, encodings = synthetic_gallery(startup_gallery_size, seed)
+    json_path = os.path.join(work_path, 'startup_json') + '/'
+    known_path = os.path.join(work_path, 'startup_known') + '/'
+    os.makedirs(json_path, exist_ok=True)
+    os.makedirs(known_path, exist_ok=True)
+    gallery_reina.EncodingStore(json_path).append(names, encodings)
+    for name in names:
+        with open(known_path + name + '.jpg', 'wb') as image_file:
+            image_file.write(name.encode('utf-8'))
+    folder_manager_reina.save_dict(folder_manager_reina.scan_folder(known_path, recursive=True),
+                                   json_path + 'modate.json')
+
+    arguments = {'gallery': ['--json-path', json_path, 'gallery'],
+                 'diff': ['--json-path', json_path, 'diff', '--known', known_path]}
+    results = []
+    for command in cli_reina.lightweight_commands:
+        heavy_modules = []
+
+        def run():
+            heavy_modules[:] = json.loads(subprocess.run(
+                [sys.executable, '-c', _startup_code] + arguments[command], capture_output=True, text=True,
+                check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout)
+
+        timing = _time_it(run, repeats)
+        results.append(dict(name='startup_' + command, size=startup_gallery_size, budget=cli_reina.startup_budget,
+                            within_budget=timing['median'] <= cli_reina.startup_budget,
+                            heavy_modules=heavy_modules, **timing))
+    return results
+
+
+###------------------运行模块 run module------------------###
+
+# environment of this run, so that results of different machines and commits are not mixed up
+# 本次运行的环境, 避免混淆不同机器与提交的结果
+def _environment() -> dict:
+    commit = None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, timeout=10,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        pass
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+#==============================================================
+# run every benchmark
+# 运行所有测试
+# @parameter:
+# - sizes:          gallery sizes
+#                   人脸库大小
+# - probe_count:    number of probes matched in each size
+#                   每种大小匹配的探测人脸数
+# - repeats:        number of repeats of every measurement
+#                   每项测量的重复次数
+# - image_count:    number of generated images for the folder throughput, 0 to skip it
+#                   文件夹吞吐量测试生成的图片数, 0则跳过
+# - seed:           random seed
+#                   随机种子
+# @return:
+# - report: {'environment': dict, 'settings': dict, 'results': [dict]}
+def run_benchmarks(sizes=None, probe_count=default_probe_count, repeats=default_repeats,
+                   image_count=default_image_count, seed=default_seed) -> dict:
+    if sizes is None:
+        sizes = default_sizes
+    report = {
+        'environment': _environment(),
+        'settings': {'sizes': list(sizes), 'probe_count': probe_count, 'repeats': repeats,
+                     'image_count': image_count, 'seed': seed},
+        'results': [],
+    }
+
+    work_path = tempfile.mkdtemp(prefix='face_reina_benchmark_')
+    try:
+        for size in sizes:
+            for bench in (bench_gallery_load, bench_incremental_update):
+                for result in bench(size, work_path, repeats, seed):
+                    print(_format_result(result))
+                    report['results'].append(result)
+            for bench in (bench_match, bench_quantized):
+                for result in bench(size, probe_count, repeats, seed):
+                    print(_format_result(result))
+                    report['results'].append(result)
+        for result in bench_memory(memory_gallery_size, seed):
+            print(_format_result(result))
+            report['results'].append(result)
+        for result in bench_startup(work_path, repeats, seed):
+            print(_format_result(result))
+            report['results'].append(result)
+        if image_count > 0:
+            for result in bench_folder_throughput(image_count, work_path, seed):
+                print(_format_result(result))
+                report['results'].append(result)
+    finally:
+        shutil.rmtree(work_path, ignore_errors=True)
+    return report
+
+
+# one line of a result for the console
+# 控制台上一个结果的一行
+def _format_result(result: dict) -> str:
+    if 'skipped' in result:
+        return '{:<24} skipped: {}'.format(result['name'], result['skipped'])
+    if 'images_per_second' in result:
+        return '{:<24} {:>4} images, {} worker(s): {:.2f} images/s'.format(
+            result['name'], result['images'], result['workers'], result['images_per_second'])
+    if 'bytes_per_identity' in result:
+        return '{:<24} {:.0f} bytes per identity, {:.1f} MB per million identities'.format(
+            result['name'], result['bytes_per_identity'], result['mb_per_million'])
+    if 'agreement' in result:
+        return '{:<24} size {:>7}: best {:.6f}s, median {:.6f}s, agreement {:.4f}, max distance difference {:.2g}'.format(
+            result['name'], result['size'], result['best'], result['median'], result['agreement'],
+            result['max_distance_difference'])
+    if 'budget' in result:
+        return '{:<24} median {:.3f}s, budget {:.3f}s ({}), heavy modules imported: {}'.format(
+            result['name'], result['median'], result['budget'],
+            'ok' if result['within_budget'] else 'OVER BUDGET', ', '.join(result['heavy_modules']) or 'none')
+    return '{:<24} size {:>7}: best {:.6f}s, median {:.6f}s'.format(
+        result['name'], result['size'], result['best'], result['median'])
+
+
+def _parse_arguments(argv):
+    parser = argparse.ArgumentParser(description='offline benchmarks of face_reina')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in default_sizes),
+                        help='comma separated gallery sizes')
+    parser.add_argument('--probes', type=int, default=default_probe_count, help='probes matched in each size')
+    parser.add_argument('--repeats', type=int, default=default_repeats, help='repeats of every measurement')
+    parser.add_argument('--images', type=int, default=default_image_count,
+                        help='generated images for the folder throughput, 0 to skip')
+    parser.add_argument('--seed', type=int, default=default_seed, help='random seed')
+    parser.add_argument('--output', default=default_output, help='json file of the results')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    arguments = _parse_arguments(sys.argv[1:])
+    report = run_benchmarks([int(size) for size in arguments.sizes.split(',') if size != ''], arguments.probes,
+                            arguments.repeats, arguments.images, arguments.seed)
+    with open(arguments.output, 'w', encoding='utf-8') as output_file:
+        json.dump(report, output_file, indent=2)
+    print('results saved to ' + arguments.output)
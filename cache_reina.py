@@ -0,0 +1,224 @@
+'''
+@author Reina
+@desc 以图片内容为键的识别结果缓存
+描述 :
+同一张图片(内容相同)在相同的检测/编码设置下只检测和编码一次
+- 人脸位置与编码以 图片内容哈希 + 检测/编码设置 为键保存
+- 匹配结果单独保存, 以 人脸键 + 人脸库版本 为键, 人脸库改变后只重新运行便宜的匹配
+- 两张表都按最近使用时间(LRU)限制大小, 并统计命中/未命中次数
+- RecognitionCache类: 基于sqlite的持久缓存
+
+description:
+recognition result cache keyed by the image content
+an image (same content) is detected and encoded only once with the same detector/encoder settings
+- face locations and encodings are keyed by the content hash of the image plus the detector/encoder settings
+- match results are kept separately, keyed by the face key plus the gallery version,
+  when the gallery changes only the cheap matching runs again
+- both tables are bounded with least-recently-used eviction, hits and misses are counted
+- class: RecognitionCache: persistent cache based on sqlite
+'''
+
+#coding=utf-8
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import numpy
+
+
+###------------------预定义变量 predefinition------------------###
+
+# settings of the encoder, part of every face key (change it when the encoder model changes)
+# 编码器的设置, 是每个人脸键的一部分 (编码模型改变时修改它)
+encoder_settings = {'encoder': 'dlib_face_recognition_resnet_model_v1', 'num_jitters': 1}
+
+# default max number of entries in each table
+# 每张表默认最多的条目数
+default_max_entries = 100000
+
+# evict the least recently used entries every evict_interval writes
+# 每写入evict_interval次淘汰一次最久未使用的条目
+evict_interval = 100
+
+# dimension of a face encoding
+# 人脸编码的维数
+encoding_dim = 128
+
+
+###------------------缓存模块 cache module------------------###
+
+#==============================================================
+# persistent recognition cache based on sqlite
+# every process opens its own connection (a forked worker never uses the connection of its parent)
+# 基于sqlite的持久识别缓存
+# 每个进程打开自己的连接 (fork出的工作进程不会使用父进程的连接)
+# @parameter:
+# - cache_file:     sqlite file with path (e.g. 'src/.cache/recognition.sqlite')
+#                   带路径的sqlite文件名 (例: 'src/.cache/recognition.sqlite')
+# - max_entries:    max number of entries in each table, the least recently used ones are evicted
+#                   每张表最多的条目数, 淘汰最久未使用的条目
+class RecognitionCache:
+
+    def __init__(self, cache_file: str, max_entries: int = default_max_entries):
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self._connection = None
+        self._pid = None
+        self._writes = 0
+
+        # counters of this process
+        # 本进程的计数
+        self.face_hits = 0
+        self.face_misses = 0
+        self.match_hits = 0
+        self.match_misses = 0
+
+        cache_path = os.path.dirname(cache_file)
+        if cache_path != '' and not os.path.exists(cache_path):
+            os.makedirs(cache_path)
+
+    # the connection of this process, opened on first use
+    # 本进程的连接, 第一次使用时打开
+    def _db(self) -> sqlite3.Connection:
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.cache_file, timeout=30, isolation_level=None)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS faces '
+                                     '(key TEXT PRIMARY KEY, locations TEXT, encodings BLOB, last_used REAL)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS matches '
+                                     '(key TEXT PRIMARY KEY, results TEXT, last_used REAL)')
+            self._pid = os.getpid()
+        return self._connection
+
+    #==============================================================
+    # key of the faces of an image: content hash plus detector/encoder settings
+    # 一张图片的人脸键: 内容哈希加检测/编码设置
+    # @parameter:
+    # - content:    bytes of the image file
+    #               图片文件的字节
+    # - config:     complete detection config | dict
+    #               完整的检测配置 | dict
+    # @return: str
+    def face_key(self, content: bytes, config: dict) -> str:
+        settings = json.dumps([config, encoder_settings], sort_keys=True)
+        return hashlib.sha1(content).hexdigest() + '-' + hashlib.sha1(settings.encode('utf-8')).hexdigest()[:16]
+
+    #==============================================================
+    # cached face locations and encodings of a face key
+    # 人脸键缓存的人脸位置与编码
+    # @parameter:
+    # - key:                face key | str
+    # - need_encodings:     an entry saved without encodings is a miss
+    #                       没有保存编码的条目视为未命中
+    # @return:
+    # - None on a miss, or (face_locations, encodings)
+    #   未命中为None, 或(face_locations, encodings)
+    #   face_locations: [(top, right, bottom, left)], encodings: ndarray (N x 128) or None
+    def get_faces(self, key: str, need_encodings: bool = True):
+        row = self._db().execute('SELECT locations, encodings FROM faces WHERE key = ?', (key,)).fetchone()
+        if row is None or (need_encodings and row[1] is None):
+            self.face_misses += 1
+            return None
+        self.face_hits += 1
+        self._touch('faces', key)
+        face_locations = [tuple(location) for location in json.loads(row[0])]
+        encodings = None
+        if row[1] is not None:
+            encodings = numpy.frombuffer(row[1], dtype=numpy.float64).reshape(-1, encoding_dim)
+        return face_locations, encodings
+
+    #==============================================================
+    # save face locations (and encodings) of a face key
+    # 保存人脸键的人脸位置 (与编码)
+    # @parameter:
+    # - key:                face key | str
+    # - face_locations:     [(top, right, bottom, left)]
+    # - encodings:          list of ndarray or ndarray (N x 128), None to save the locations only
+    #                       ndarray的列表或ndarray (N x 128), None则只保存位置
+    # @return: (no return)
+    def put_faces(self, key: str, face_locations: list, encodings=None):
+        blob = None
+        if encodings is not None:
+            blob = numpy.asarray(encodings, dtype=numpy.float64).reshape(-1, encoding_dim).tobytes()
+        self._db().execute('INSERT OR REPLACE INTO faces VALUES (?, ?, ?, ?)',
+                           (key, json.dumps([list(location) for location in face_locations]), blob, time.time()))
+        self._written()
+
+    #==============================================================
+    # cached match results of a face key against a gallery version
+    # 人脸键在某个人脸库版本下缓存的匹配结果
+    # @parameter:
+    # - key:                face key | str
+    # - gallery_version:    version of the gallery and matching settings | str
+    #                       人脸库与匹配设置的版本 | str
+    # @return:
+    # - None on a miss, or the results of the matcher (one dict for each face)
+    #   未命中为None, 或匹配器的结果 (每张人脸一个字典)
+    def get_matches(self, key: str, gallery_version: str):
+        match_key = key + '@' + gallery_version
+        row = self._db().execute('SELECT results FROM matches WHERE key = ?', (match_key,)).fetchone()
+        if row is None:
+            self.match_misses += 1
+            return None
+        self.match_hits += 1
+        self._touch('matches', match_key)
+        return json.loads(row[0])
+
+    #==============================================================
+    # save match results of a face key against a gallery version
+    # 保存人脸键在某个人脸库版本下的匹配结果
+    # @parameter:
+    # - key:                face key | str
+    # - gallery_version:    version of the gallery and matching settings | str
+    #                       人脸库与匹配设置的版本 | str
+    # - results:            results of the matcher | list of dict
+    #                       匹配器的结果 | dict的列表
+    # @return: (no return)
+    def put_matches(self, key: str, gallery_version: str, results: list):
+        self._db().execute('INSERT OR REPLACE INTO matches VALUES (?, ?, ?)',
+                           (key + '@' + gallery_version, json.dumps(results), time.time()))
+        self._written()
+
+    #==============================================================
+    # hit/miss counters of this process and the number of entries
+    # 本进程的命中/未命中计数与条目数
+    # @return: dict
+    def stats(self) -> dict:
+        db = self._db()
+        return {
+            'face_hits': self.face_hits,
+            'face_misses': self.face_misses,
+            'match_hits': self.match_hits,
+            'match_misses': self.match_misses,
+            'face_entries': db.execute('SELECT COUNT(*) FROM faces').fetchone()[0],
+            'match_entries': db.execute('SELECT COUNT(*) FROM matches').fetchone()[0],
+        }
+
+    #==============================================================
+    # delete the least recently used entries beyond max_entries in each table
+    # 删除每张表中超过max_entries的最久未使用的条目
+    # @return: (no return)
+    def evict(self):
+        db = self._db()
+        for table in ('faces', 'matches'):
+            db.execute('DELETE FROM {0} WHERE key IN (SELECT key FROM {0} ORDER BY last_used DESC LIMIT -1 OFFSET ?)'
+                       .format(table), (self.max_entries,))
+
+    #==============================================================
+    # delete every entry
+    # 删除所有条目
+    # @return: (no return)
+    def clear(self):
+        db = self._db()
+        db.execute('DELETE FROM faces')
+        db.execute('DELETE FROM matches')
+
+    def _touch(self, table, key):
+        self._db().execute('UPDATE {} SET last_used = ? WHERE key = ?'.format(table), (time.time(), key))
+
+    def _written(self):
+        self._writes += 1
+        if self._writes % evict_interval == 0:
+            self.evict()
@@ -0,0 +1,272 @@
+'''
+@author Reina
+@desc face_reina的命令行
+描述 :
+轻量的命令(gallery, diff)只读取人脸库与文件夹记录, 不导入face_recognition/dlib/cv2,
+它们的启动时间预算为startup_budget, 由benchmark_reina.bench_startup测量
+- gallery:      显示二进制人脸库 (编码数, 人数, 版本)
+- diff:         显示已知人脸文件夹相对modate.json的变化, 不保存
+- audit:        自查二进制人脸库: 重复录入的簇, 容易混淆的身份, 建议的阈值 (也不导入face_recognition/dlib/cv2)
+- update:       生成(或增量更新)二进制人脸库
+- position:     定位一个文件夹中的人脸 (无人值守, 按覆写策略处理已存在的输出)
+- recognize:    识别一个文件夹 (绘制, 或输出JSONL/CSV)
+- video:        并行识别一个录制好的视频文件, 输出JSONL时间线
+- watch:        持续监视未知人脸文件夹
+- serve:        启动本地HTTP识别服务
+- main函数: 运行一条命令, 返回退出码
+
+description:
+command line of face_reina
+the lightweight commands (gallery, diff) only read the gallery store and the folder records,
+face_recognition/dlib/cv2 are never imported, their startup budget is startup_budget,
+measured by benchmark_reina.bench_startup
+- gallery:      show the binary gallery store (encodings, identities, version)
+- diff:         show the changes of the known folder against modate.json, nothing is saved
+- audit:        audit the binary gallery store: duplicate clusters, lookalike identities and a suggested threshold
+                (face_recognition/dlib/cv2 are not imported either)
+- update:       generate (or incrementally update) the binary gallery store
+- position:     position the faces of a folder (unattended, existing outputs follow an overwrite policy)
+- recognize:    recognize a folder (drawn, or streamed as JSONL/CSV)
+- video:        recognize a recorded video file in parallel into a JSONL timeline
+- watch:        watch the unknown folder continuously
+- serve:        run the local HTTP recognition service
+- function: main: run one command, return the exit code
+
+example:
+    python cli_reina.py gallery
+    python cli_reina.py diff --known src/known/
+    python cli_reina.py audit --tolerance 0.5
+    python cli_reina.py recognize src/unknown/ --format jsonl --workers 4
+'''
+
+#coding=utf-8
+
+import facekit_reina
+import folder_manager_reina
+import gallery_reina
+import audit_reina
+
+import os
+import sys
+import json
+import argparse
+
+
+###------------------预定义变量 predefinition------------------###
+
+# commands that never import face_recognition/dlib/cv2
+# 从不导入face_recognition/dlib/cv2的命令
+lightweight_commands = ['gallery', 'diff']
+
+# startup budget (seconds, whole process) of the lightweight commands
+# 轻量命令的启动时间预算 (秒, 整个进程)
+startup_budget = 0.5
+
+# default known folder
+# 默认的已知人脸文件夹
+default_known_path = 'src/known/'
+
+
+###------------------命令模块 command module------------------###
+
+# show the binary gallery store
+# 显示二进制人脸库
+def _command_gallery(arguments) -> int:
+    store = gallery_reina.EncodingStore(facekit_reina.json_path)
+    if not store.exists():
+        print("no gallery store in " + facekit_reina.json_path + ", run 'update' first")
+        return 1
+    keys = store.alive()[0]
+    identities = {gallery_reina.identity_of(key) for key in keys}
+    print("store:       " + facekit_reina.json_path)
+    print("encodings:   {}".format(len(store)))
+    print("identities:  {}".format(len(identities)))
+    print("version:     {}".format(store.version))
+    print("deleted:     {} rows waiting for compaction".format(len(store.deleted)))
+    if arguments.list:
+        for identity in sorted(identities):
+            print(identity)
+    return 0
+
+# show the changes of the known folder, nothing is saved
+# 显示已知人脸文件夹的变化, 不保存
+def _command_diff(arguments) -> int:
+    if not os.path.isdir(arguments.known):
+        print("no known folder " + arguments.known)
+        return 1
+    is_changed, change, _ = folder_manager_reina.get_change(
+        arguments.known, facekit_reina.json_path + facekit_reina.modate_json, recursive=True,
+        use_hash=arguments.hash)
+    if not is_changed:
+        print("no change")
+        return 0
+    for filename in change['new']:
+        print("new      " + filename)
+    for filename in change['deleted']:
+        print("deleted  " + filename)
+    for old_filename, new_filename in change['renamed']:
+        print("renamed  " + old_filename + " -> " + new_filename)
+    return 0
+
+# audit the binary gallery store against itself
+# 自查二进制人脸库
+def _command_audit(arguments) -> int:
+    store = gallery_reina.EncodingStore(facekit_reina.json_path)
+    if not store.exists():
+        print("no gallery store in " + facekit_reina.json_path + ", run 'update' first")
+        return 1
+    tolerance = arguments.tolerance if arguments.tolerance is not None else facekit_reina.fault_tolerance
+    report = audit_reina.audit_store(store, tolerance, arguments.duplicate_distance)
+    if arguments.json:
+        print(json.dumps(report))
+    else:
+        print(audit_reina.format_report(report, arguments.limit))
+    return 0
+
+# generate (or incrementally update) the binary gallery store
+# 生成(或增量更新)二进制人脸库
+def _command_update(arguments) -> int:
+    store = facekit_reina.update_encoding_store(arguments.known, workers=arguments.workers)
+    print("{} encodings, version {}".format(len(store), store.version))
+    return 0
+
+# position the faces of a folder
+# 定位一个文件夹中的人脸
+def _command_position(arguments) -> int:
+    config = {'model': arguments.model} if arguments.model is not None else None
+    summary = facekit_reina.position_a_folder(arguments.raw, arguments.output_path, arguments.overwrite,
+                                              workers=arguments.workers, config=config)
+    return 1 if summary['failed'] != 0 else 0
+
+# recognize a folder
+# 识别一个文件夹
+def _command_recognize(arguments) -> int:
+    config = {'model': arguments.model} if arguments.model is not None else None
+    recog_path = arguments.output_path if arguments.format is None else None
+    facekit_reina.recognize_a_folder(arguments.unknown, recog_path, arguments.known, workers=arguments.workers,
+                                     config=config, output_format=arguments.format,
+                                     output_file=arguments.output_file)
+    return 0
+
+# recognize a recorded video file, the tracker is only imported by this command
+# 识别一个录制好的视频文件, 只有这个命令导入跟踪模块
+def _command_video(arguments) -> int:
+    import tracker_reina
+    config = {'model': arguments.model} if arguments.model is not None else None
+    stats = tracker_reina.process_a_video_file(arguments.video, arguments.timeline, arguments.known,
+                                               output_filename=arguments.output_file, workers=arguments.workers,
+                                               chunk_frames=arguments.chunk_frames,
+                                               detect_interval=arguments.detect_interval, config=config)
+    return 1 if stats['failed_chunks'] != 0 else 0
+
+# watch the unknown folder, the watcher is only imported by this command
+# 监视未知人脸文件夹, 只有这个命令导入监视模块
+def _command_watch(arguments) -> int:
+    import watch_reina
+    config = {'model': arguments.model} if arguments.model is not None else None
+    watch_reina.watch_a_folder(arguments.unknown, arguments.output_path, arguments.known, config=config)
+    return 0
+
+# run the HTTP service, the server is only imported by this command
+# 启动HTTP服务, 只有这个命令导入服务模块
+def _command_serve(arguments) -> int:
+    import server_reina
+    config = {'model': arguments.model} if arguments.model is not None else None
+    server_reina.serve(arguments.known, arguments.host, arguments.port, arguments.workers, config=config)
+    return 0
+
+
+def _parse_arguments(argv):
+    parser = argparse.ArgumentParser(description='command line of face_reina')
+    parser.add_argument('--json-path', default=None,
+                        help='directory of the gallery files (default: facekit_reina.json_path)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('gallery', help='show the binary gallery store')
+    command.add_argument('--list', action='store_true', help='list the identities')
+    command.set_defaults(run=_command_gallery)
+
+    command = commands.add_parser('diff', help='show the changes of the known folder, nothing is saved')
+    command.add_argument('--known', default=default_known_path)
+    command.add_argument('--hash', action='store_true', help='compare content hashes (finds touches and renames)')
+    command.set_defaults(run=_command_diff)
+
+    command = commands.add_parser('audit', help='find duplicate enrollments and lookalike identities in the gallery')
+    command.add_argument('--tolerance', type=float, default=None,
+                         help='lookalike distance (default: facekit_reina.fault_tolerance)')
+    command.add_argument('--duplicate-distance', type=float, default=audit_reina.duplicate_distance)
+    command.add_argument('--limit', type=int, default=20, help='clusters and pairs listed in the text report')
+    command.add_argument('--json', action='store_true', help='print the whole report as JSON')
+    command.set_defaults(run=_command_audit)
+
+    command = commands.add_parser('update', help='generate or update the binary gallery store')
+    command.add_argument('--known', default=default_known_path)
+    command.add_argument('--workers', type=int, default=None, help='encoding processes (default: the cpus)')
+    command.set_defaults(run=_command_update)
+
+    command = commands.add_parser('position', help='position the faces of a folder')
+    command.add_argument('raw', help='path which stores the source images')
+    command.add_argument('--output-path', default='src/positioned/', help='path to store positioned images')
+    command.add_argument('--overwrite', choices=facekit_reina.overwrite_policies, default='skip',
+                         help='what to do when a positioned image already exists')
+    command.add_argument('--workers', type=int, default=1)
+    command.add_argument('--model', default=None, help="detection model, 'hog' or 'cnn'")
+    command.set_defaults(run=_command_position)
+
+    command = commands.add_parser('recognize', help='recognize a folder')
+    command.add_argument('unknown', help='path which stores unknown images')
+    command.add_argument('--known', default=default_known_path)
+    command.add_argument('--output-path', default='src/recognized/', help='path to store recognized images')
+    command.add_argument('--format', choices=facekit_reina.result_formats, default=None,
+                         help='stream results instead of drawing')
+    command.add_argument('--output-file', default=None, help='file of the streamed results (default: stdout)')
+    command.add_argument('--workers', type=int, default=1)
+    command.add_argument('--model', default=None, help="detection model, 'hog' or 'cnn'")
+    command.set_defaults(run=_command_recognize)
+
+    command = commands.add_parser('video', help='recognize a recorded video file in parallel')
+    command.add_argument('video', help='video file')
+    command.add_argument('--timeline', default='src/video/timeline.jsonl', help='JSONL timeline file')
+    command.add_argument('--known', default=default_known_path)
+    command.add_argument('--output-file', default=None, help='annotated video file (default: none)')
+    command.add_argument('--workers', type=int, default=None)
+    command.add_argument('--chunk-frames', type=int, default=300)
+    command.add_argument('--detect-interval', type=int, default=10)
+    command.add_argument('--model', default=None, help="detection model, 'hog' or 'cnn'")
+    command.set_defaults(run=_command_video)
+
+    command = commands.add_parser('watch', help='watch the unknown folder')
+    command.add_argument('unknown', help='path which stores unknown images')
+    command.add_argument('--known', default=default_known_path)
+    command.add_argument('--output-path', default='src/recognized/', help='path to store recognized images')
+    command.add_argument('--model', default=None, help="detection model, 'hog' or 'cnn'")
+    command.set_defaults(run=_command_watch)
+
+    command = commands.add_parser('serve', help='run the local HTTP recognition service')
+    command.add_argument('--known', default=default_known_path)
+    command.add_argument('--host', default='127.0.0.1')
+    command.add_argument('--port', type=int, default=8000)
+    command.add_argument('--workers', type=int, default=None)
+    command.add_argument('--model', default=None, help="detection model, 'hog' or 'cnn'")
+    command.set_defaults(run=_command_serve)
+    return parser.parse_args(argv)
+
+
+#==============================================================
+# run one command
+# 运行一条命令
+# @parameter:
+# - argv:   command line arguments without the program name | list of str
+#           不含程序名的命令行参数 | str的列表
+# @return:
+# - exit code | int
+#   退出码 | int
+def main(argv) -> int:
+    arguments = _parse_arguments(argv)
+    if arguments.json_path is not None:
+        facekit_reina.json_path = arguments.json_path
+    return arguments.run(arguments)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,10 +1,13 @@
-import face_recognition
 import facekit_reina
-from cv2 import cv2
+import stream_reina
+import tracker_reina
+from lazy_reina import cv2
 import os
 
 '''
 快速开始, 请修改ip_camera_url(必要)
+streaming = True: 捕获 -> 识别 -> 写入视频, 全部在内存中实时完成
+streaming = False: 先捕获total_frame帧到磁盘, 再批量识别并编码成视频
 '''
 
 
@@ -25,53 +28,92 @@ framesize=(640, 480)
 #根据视频参数新建VideoWriter
 out = cv2.VideoWriter('output.avi', codec, fps, framesize)
 
-#设置捕获总帧数
+#设置捕获总帧数 (实时模式下None表示一直运行, 直到ctrl+c或视频流结束)
 total_frame = 200
 
+#实时模式: 是否使用实时流水线, 队列大小与丢帧策略('block', 'drop_oldest', 'drop_newest')
+streaming = True
+queue_size = 4
+drop_policy = 'drop_oldest'
+
+#实时模式: 每detect_interval帧完整检测一次, 中间的帧用光流跟踪 (1则每帧都检测)
+detect_interval = 5
+
+#实时模式: 识别进程数, 大于1时帧被捕获到共享内存的环形缓冲区中, 由多个进程每帧完整检测 (不使用跟踪), 进程之间只传递槽号
+workers = 1
+
 # 设置人脸定位相关参数
 raw_img_path = 'src/webcam/'
 #positioned_img_path = 'imgs/posotioned/'
 recognized_img_path = 'src/webcam/recognized/'
 known_img_path = 'src/known/'
 
-if not os.path.exists(raw_img_path):
-    os.mkdir(raw_img_path)
-
-if not os.path.exists(recognized_img_path):
-    os.mkdir(recognized_img_path)
-
-#-------------开始捕获-------------#
-
-for i in range(total_frame):
-    
-    #截获一帧
-    ret, frame = video_capture.read()
-    
-    #设置保存文件名
-    file_name = 'imgs/test' + "{:0>4d}".format(i) + '.jpg'
-    cv2.imwrite(file_name, frame)
-#捕获帧完毕, 释放摄像头
-video_capture.release()
-
-#-------------后期处理-------------#
-
-# 人脸识别(reina自定义模块)
-print("Start positioning...")
-facekit_reina.start_recognition(raw_img_path, recognized_img_path, known_img_path)
-print("Positioned.")
-
-# 读入处理后的图片
-print("Start reading...")
-imgs = []
-for i in range(total_frame):
-    imgs.append(cv2.imread(recognized_img_path + 'test' + "{:0>4d}".format(i) + '.jpg'))
-print("Read.")
-
-# 编码成视频
-print("Start encoding...")
-for img in imgs:
-    out.write(img)
-print("Encoded.")
+if streaming:
+
+    #-------------实时识别-------------#
+
+    # 加载人脸库, 整个视频流只加载一次
+    known_store = facekit_reina.update_encoding_store(known_img_path)
+
+    # 隔帧检测, 中间的帧跟踪 (多进程时每帧都在工作进程中检测)
+    tracker = tracker_reina.FaceTracker(known_store, detect_interval) if workers <= 1 else None
+
+    # 捕获 -> 识别 -> 写入, 不经过磁盘
+    print("Start streaming...")
+    pipeline = stream_reina.StreamPipeline(video_capture, out, known_store, frame_size=framesize,
+                                           max_frames=total_frame, queue_size=queue_size, drop_policy=drop_policy,
+                                           process_frame=tracker.annotate if tracker is not None else None,
+                                           workers=workers)
+    stats = pipeline.run()
+    print("Streamed. captured: {captured}, recognized: {recognized}, written: {written}, dropped: {dropped}, "
+          "{seconds:.2f}s".format(**stats))
+    if tracker is not None:
+        print("detections: {} of {} frames".format(tracker.detections, tracker.frames))
+
+    # 释放资源
+    video_capture.release()
+    out.release()
+
+else:
+    if not os.path.exists(raw_img_path):
+        os.mkdir(raw_img_path)
+
+    if not os.path.exists(recognized_img_path):
+        os.mkdir(recognized_img_path)
+
+    #-------------开始捕获-------------#
+
+    for i in range(total_frame):
+
+        #截获一帧
+        ret, frame = video_capture.read()
+
+        #设置保存文件名
+        file_name = raw_img_path + 'test' + "{:0>4d}".format(i) + '.jpg'
+        cv2.imwrite(file_name, frame)
+    #捕获帧完毕, 释放摄像头
+    video_capture.release()
+
+    #-------------后期处理-------------#
+
+    # 人脸识别(reina自定义模块)
+    print("Start positioning...")
+    facekit_reina.recognize_a_folder(raw_img_path, recognized_img_path, known_img_path)
+    print("Positioned.")
+
+    # 读入处理后的图片
+    print("Start reading...")
+    imgs = []
+    for i in range(total_frame):
+        imgs.append(cv2.imread(recognized_img_path + 'test' + "{:0>4d}".format(i) + '.jpg'))
+    print("Read.")
+
+    # 编码成视频
+    print("Start encoding...")
+    for img in imgs:
+        out.write(img)
+    out.release()
+    print("Encoded.")
 
 # 释放资源
-cv2.destroyAllWindows()
\ No newline at end of file
+cv2.destroyAllWindows()
@@ -4,41 +4,88 @@
 @date 2020/7/20
 描述 :
 包含两个子模块: 人脸定位模块和人脸识别模块
+启动:
+- warm_up函数: 立即导入face_recognition与cv2并运行一次检测与编码, 用于长时间运行的进程
+人脸检测:
+- detect_faces函数: 按照检测配置(模型, 上采样次数, 缩放)检测人脸, 检测框总是原分辨率的坐标
+- encode_faces函数: 编码通过质量检查(大小, 清晰度, 姿态)的人脸, 未通过的人脸不编码
 人脸定位: 
 - position_an_image函数: 为单张图片进行定位和绘制
-- position_a_folder函数: 一个文件夹内批量生成定位图片的流程控制
+- position_a_folder函数: 一个文件夹内批量生成定位图片的流程控制, 可以使用多进程, 可以不询问而按覆写策略处理
 人脸识别:
+- known_key函数: 已知图片的人脸库键 ('alice.jpg' -> 'alice', 'alice/img1.jpg' -> 'alice/img1')
+- update_encoding_store函数: 生成(或增量更新)并保存二进制人脸库, 每个人可以有一个子文件夹存放多张图片,
+  大量图片由进程池编码, 定期写入检查点, 中断后从检查点继续, 没有或有多张人脸以及出错的图片被隔离
 - gen_sav_encodings_dict函数: 生成并保存已知'编码字典'
+- get_matcher函数: 根据'编码字典'生成矩阵化的匹配器FaceMatcher
+- match_encodings函数: 一次匹配一组编码, 未编码(质量过低)的人脸报告为low_quality_name
 - face_people_match函数: 根据'编码字典', 匹配一张人脸
+- locate_and_recognize函数: 在已解码的图片上检测一次并识别所有人脸, 返回每张人脸的结果
 - crop_and_recognize函数: 找到一张图片中的所有人脸, 依次裁剪后识别, 返回识别结果
+- draw_recognition函数: 根据识别结果在图片上绘制
 - recognize_an_imge函数: 对一张图片进行识别, 并根据结果绘制图像
-- recognize_a_folder函数: 一个文件夹内批量生成识别图片的流程控制
+- recognize_a_folder函数: 一个文件夹内批量生成识别图片的流程控制, 可以使用多进程, 可以不绘制而输出JSONL/CSV
+- result_json函数: 将结果序列化为严格的JSON, 非有限的浮点数(例如unknown人脸的inf距离)写为null
+批量识别:
+- recognize_images函数: 识别任意多张图片(路径或数组), 逐张返回结构化的结果, 不读写磁盘(除非要求)
 
 description:
 2 module included: face position and face recognition
+startup:
+- function: warm_up: import face_recognition and cv2 now and run one detection and encoding, for long-running processes
+face detection:
+- function: detect_faces: detect faces with a detection config (model, upsample, downscale), boxes are in full resolution
+- function: encode_faces: encode the faces passing the quality gate (size, sharpness, pose), the others are not encoded
 face position:
 - function: position_an_image: position and draw for a single image
-- function: position_a_folder: position and draw for a folder
+- function: position_a_folder: position and draw for a folder, optionally with a process pool,
+                               optionally unattended with an overwrite policy
 face recognition:
+- function: known_key: store key of a known image ('alice.jpg' -> 'alice', 'alice/img1.jpg' -> 'alice/img1')
+- function: update_encoding_store: generate (or incrementally update) and save the binary gallery store,
+                                   every person can have a subfolder with several images,
+                                   many images are encoded by a process pool with periodic checkpoints,
+                                   an interrupted build resumes from the last checkpoint,
+                                   images with no face, several faces or an error are quarantined
 - function: gen_sav_encodings_dict: generate and save the encoding dictionary
+- function: get_matcher: build the matrix based FaceMatcher from the encoding dictionary
+- function: match_encodings: match encodings in one operation, faces without an encoding (low quality) are reported
+                             as low_quality_name
 - function: face_people_match: match a face with data in encoding dictionary
+- function: locate_and_recognize: detect once on a decoded image and recognize all faces, return the result of each face
 - function: crop_and_recognize: find all faces in one image, crop and recognize for each, return the results
+- function: draw_recognition: draw the recognition results on an image
 - function: recognize_an_imge: recognize and draw results for one image
-- function: recognize_a_folder: recognition flow control in a single folder
+- function: recognize_a_folder: recognition flow control in a single folder, optionally with a process pool,
+                                optionally streaming JSONL/CSV instead of drawing
+- function: result_json: serialize results as strict JSON, non-finite floats (e.g. the inf distance of an unknown
+                         face) are written as null
+batch recognition:
+- function: recognize_images: recognize any number of images (paths or arrays), yield a structured result for each,
+                              nothing is read from or written to the disk unless asked
 '''
 
 #coding=utf-8
 
-import face_recognition
 import folder_manager_reina
+import gallery_reina
+import ann_index_reina
+import stats_reina
+import quality_reina
 
+import io
 import os
+import sys
+import csv
 import json
+import time
+import contextlib
 import numpy
+import multiprocessing
 
-# if you are not using a wsl, replace it with 'import cv2'
-# 如果你不使用WSL的话, 请用'import cv2'代替它
-from cv2 import cv2
+# face_recognition (it loads the dlib models) and cv2 are imported on their first use, see lazy_reina and warm_up
+# face_recognition(会加载dlib模型)与cv2在第一次使用时才导入, 见lazy_reina与warm_up
+from lazy_reina import face_recognition, cv2
 
 
 
@@ -57,10 +104,107 @@ json_path = 'src/known/.json/'
 encoding_json = 'encoding.json'
 modate_json = 'modate.json'
 
+# known images that are not enrolled: {filename: {'reason': one of quarantine_reasons, 'error': str or None,
+# 'state': scan state}}, an image leaves the quarantine when it is changed, deleted or renamed
+# 未录入的已知图片: {文件名: {'reason': quarantine_reasons之一, 'error': str或None, 'state': 扫描状态}},
+# 图片被修改, 删除或重命名时离开隔离列表
+quarantine_json = 'quarantine.json'
+quarantine_reasons = ['no_face', 'multiple_faces', 'failed']
+
+# worker processes encoding the known images (update_encoding_store), None for the number of cpus
+# fewer than parallel_enrollment_min images are encoded in this process (e.g. the small updates of a running service)
+# 编码已知图片的工作进程数 (update_encoding_store), None则为cpu数
+# 少于parallel_enrollment_min张的图片在本进程中编码 (例如运行中服务的小更新)
+enrollment_workers = None
+parallel_enrollment_min = 32
+
+# the encoded rows are appended to the store every checkpoint_interval images
+# 每编码checkpoint_interval张图片, 将编码好的行追加到人脸库
+checkpoint_interval = 200
+
 # face rocognition tolerance
 # 人脸识别容错率
 fault_tolerance = 0.5
 
+# use the approximate nearest-neighbour index (saved next to the store) for very large galleries
+# (one image per person only, galleries with several images per person use the templates of TemplateMatcher)
+# 对超大人脸库使用近似最近邻索引 (保存在人脸库旁边)
+# (仅限每人一张图片, 每人多张图片的人脸库使用TemplateMatcher的模板)
+use_ann_index = False
+
+# number of index lists searched for each face, see ann_index_reina.recall_report to choose it
+# 每张人脸搜索的索引列表数, 可参考ann_index_reina.recall_report来选择
+ann_n_probe = 8
+
+# int8 quantized first pass with exact float re-ranking of the quantized_rerank nearest rows
+# (when no ann index is used, one image per person only)
+# 使用int8量化的第一遍搜索, 再用float精确重排最近的quantized_rerank行 (不使用ann索引时, 仅限每人一张图片)
+use_quantized_search = False
+quantized_rerank = 32
+
+# compare the content hash of known images whose modification time changed, a touched image is not encoded again
+# and a renamed (or moved) image keeps its encoding
+# 比较修改时间改变的已知图片的内容哈希, 只被touch的图片不重新编码, 被重命名(或移动)的图片保留其编码
+hash_known_images = True
+
+# persistent recognition cache, e.g. cache_reina.RecognitionCache('src/.cache/recognition.sqlite'), None to disable
+# used by position_an_image, crop_and_recognize and recognize_an_imge
+# 持久的识别缓存, 例: cache_reina.RecognitionCache('src/.cache/recognition.sqlite'), None则不使用
+# 用于position_an_image, crop_and_recognize和recognize_an_imge
+recognition_cache = None
+
+# number of images sent to a worker process at once (recognize_a_folder with workers > 1)
+# 一次发送给一个工作进程的图片数 (recognize_a_folder中workers > 1时)
+recognition_chunksize = 8
+
+# number of images whose faces are matched together (recognize_images)
+# 人脸被一起匹配的图片数 (recognize_images)
+recognition_batch_size = 16
+
+# per-stage timings and counters: stats_reina.stats.enable() to turn them on (off by default, near zero overhead)
+# 每个阶段的耗时与计数: stats_reina.stats.enable()开启 (默认关闭, 几乎没有开销)
+
+# overwrite policies of position_a_folder when the positioned image already exists
+# position_a_folder中定位图片已存在时的覆写策略
+overwrite_policies = ['ask', 'skip', 'overwrite', 'newer']
+
+# streamed result formats of recognize_a_folder without drawing
+# recognize_a_folder不绘制时输出结果的格式
+result_formats = ['jsonl', 'csv']
+
+# print the progress every progress_interval images
+# 每处理progress_interval张图片打印一次进度
+progress_interval = 100
+
+# default face detection config, every call can override some of the keys
+# - model:      'hog' (fast, cpu) or 'cnn' (more accurate, slow without gpu)
+# - upsample:   number of times to upsample the image looking for smaller faces
+# - scale:      detect on the image resized by this factor (e.g. 0.25), boxes are mapped back to full resolution
+# - max_size:   automatic scale: the longest side of the detected image is at most this many pixels (None: no limit)
+#               the smaller one of scale and max_size wins
+# quality gate, a detected face failing one of them is reported as low_quality_name without being encoded
+# (None: no check), see quality_reina, e.g. {'min_face_size': 40, 'min_sharpness': 50.0, 'max_yaw': 0.6}
+# - min_face_size:  min pixels of the shorter side of the box
+# - min_sharpness:  min Laplacian variance of the face, see quality_reina.sharpness
+# - max_yaw:        max turn of the face, 0 (frontal) to 1 (profile), see quality_reina.yaw
+# 默认人脸检测配置, 每次调用可以覆盖其中的部分键
+# - model:      'hog' (快, cpu) 或 'cnn' (更准确, 没有gpu时很慢)
+# - upsample:   为寻找更小的人脸, 对图片上采样的次数
+# - scale:      在按此比例缩放后的图片上检测 (例: 0.25), 检测框映射回原分辨率
+# - max_size:   自动缩放: 检测用的图片最长边最多为这么多像素 (None: 不限制)
+#               scale与max_size中较小的那个生效
+# 质量检查, 未通过其中之一的人脸不被编码, 报告为low_quality_name (None: 不检查), 见quality_reina,
+# 例: {'min_face_size': 40, 'min_sharpness': 50.0, 'max_yaw': 0.6}
+# - min_face_size:  检测框较短边的最小像素数
+# - min_sharpness:  人脸的最小拉普拉斯方差, 见quality_reina.sharpness
+# - max_yaw:        人脸的最大转动程度, 0 (正脸) 到 1 (侧脸), 见quality_reina.yaw
+detection_config = {'model': 'hog', 'upsample': 1, 'scale': 1.0, 'max_size': None,
+                    'min_face_size': None, 'min_sharpness': None, 'max_yaw': None}
+
+# name for the faces rejected by the quality gate, their distances are inf
+# 未通过质量检查的人脸的名字, 其距离为inf
+low_quality_name = 'low_quality'
+
 
 # reference of coordinate(same as opencv)
 # 坐标系参考(同opevcv)
@@ -73,6 +217,198 @@ fault_tolerance = 0.5
 #   ↓
 #   y
 
+###------------------启动模块 startup module------------------###
+
+#==============================================================
+# import face_recognition and cv2 now and run one detection and encoding on a blank image,
+# so that the first real request of a long-running process does not pay for loading the models
+# call it in the parent before forking workers: they share the loaded models instead of loading them each
+# 立即导入face_recognition与cv2, 并在空白图片上运行一次检测与编码,
+# 长时间运行的进程的第一个真正请求不必为加载模型付出时间
+# 在fork工作进程之前在父进程中调用: 工作进程共享已加载的模型, 而不是各自加载
+# @parameter:
+# - config:     detection config, see detection_config (None for the default one)
+#               检测配置, 见detection_config (None则使用默认配置)
+# @return:
+# - seconds:    time spent | float
+#               耗费的时间 | float
+def warm_up(config: dict = None) -> float:
+    start_time = time.perf_counter()
+    face_recognition.load()
+    cv2.load()
+    blank_image = numpy.zeros((64, 64, 3), dtype=numpy.uint8)
+    detect_faces(blank_image, config)
+    face_recognition.face_encodings(blank_image, known_face_locations=[(8, 56, 56, 8)])
+    return time.perf_counter() - start_time
+
+
+###------------------检测模块 detection module------------------###
+
+#==============================================================
+# merge a (partial) detection config with the default one
+# 将(部分的)检测配置与默认配置合并
+# @parameter:
+# - config: some keys of detection_config, or None
+#           detection_config中的部分键, 或None
+# @return:
+# - config: complete detection config
+#           完整的检测配置
+def get_detection_config(config: dict = None) -> dict:
+    merged = dict(detection_config)
+    if config is not None:
+        merged.update(config)
+    return merged
+
+
+#==============================================================
+# detect faces, on a resized copy if the config asks for it
+# the boxes are always in the coordinates of the full resolution image
+# 检测人脸, 如果配置要求则在缩放后的副本上检测
+# 返回的检测框总是原分辨率图片的坐标
+# @parameter:
+# - image:  RGB image | ndarray
+#           RGB图片 | ndarray
+# - config: detection config, see detection_config (None for the default one)
+#           检测配置, 见detection_config (None则使用默认配置)
+# @return:
+# - face_locations: [(top, right, bottom, left)], same as face_recognition.face_locations
+#                   [(top, right, bottom, left)], 与face_recognition.face_locations相同
+def detect_faces(image: numpy.ndarray, config: dict = None) -> list:
+    config = get_detection_config(config)
+    height, width = image.shape[:2]
+
+    scale = config['scale']
+    if config['max_size'] is not None and max(height, width) * scale > config['max_size']:
+        scale = config['max_size'] / max(height, width)
+
+    if scale >= 1.0:
+        return face_recognition.face_locations(image, number_of_times_to_upsample=config['upsample'],
+                                               model=config['model'])
+
+    small_image = cv2.resize(image, (max(1, int(round(width * scale))), max(1, int(round(height * scale)))),
+                             interpolation=cv2.INTER_AREA)
+    small_locations = face_recognition.face_locations(small_image, number_of_times_to_upsample=config['upsample'],
+                                                      model=config['model'])
+
+    # map the boxes back to the full resolution
+    # 将检测框映射回原分辨率
+    face_locations = []
+    for top, right, bottom, left in small_locations:
+        face_locations.append((max(0, int(round(top / scale))), min(width, int(round(right / scale))),
+                               min(height, int(round(bottom / scale))), max(0, int(round(left / scale)))))
+    return face_locations
+
+
+#==============================================================
+# encode the detected faces passing the quality gate of the config, the others are never sent to the encoder
+# 编码通过配置中质量检查的人脸, 其余人脸不会交给编码器
+# @parameter:
+# - image:          RGB image | ndarray
+#                   RGB图片 | ndarray
+# - face_locations: [(top, right, bottom, left)], return value of detect_faces
+#                   [(top, right, bottom, left)], detect_faces的返回值
+# - config:         detection config, see detection_config (None for the default one)
+#                   检测配置, 见detection_config (None则使用默认配置)
+# @return:
+# - encodings:  one ndarray (128) for each face, None for a face rejected by the quality gate
+#               每张人脸一个ndarray (128), 未通过质量检查的人脸为None
+def encode_faces(image: numpy.ndarray, face_locations: list, config: dict = None) -> list:
+    if len(face_locations) == 0:
+        return []
+    config = get_detection_config(config)
+    stats = stats_reina.stats
+
+    failed = [None] * len(face_locations)
+    if any(config[key] is not None for key in ('min_face_size', 'min_sharpness', 'max_yaw')):
+        with stats.stage('quality'):
+            failed = quality_reina.assess_faces(image, face_locations, config)
+        for check in failed:
+            if check is not None:
+                stats.count('low_quality_' + check)
+
+    passed = [face for face, check in zip(face_locations, failed) if check is None]
+    passed_encodings = iter([])
+    if len(passed) != 0:
+        with stats.stage('encode'):
+            passed_encodings = iter(face_recognition.face_encodings(image, known_face_locations=passed))
+    return [next(passed_encodings) if check is None else None for check in failed]
+
+
+###------------------缓存模块 cache module------------------###
+
+# detect and encode one image file, through recognition_cache if it is set
+# the file is read once: its bytes are hashed and, only on a cache miss (or if need_image), decoded
+# returns (face key or None, face_locations, encodings or None, decoded RGB image or None)
+# 检测并编码一个图片文件, 如果设置了recognition_cache则经过缓存
+# 文件只读取一次: 计算其字节的哈希, 只在缓存未命中(或need_image)时解码
+# 返回 (人脸键或None, face_locations, 编码或None, 解码后的RGB图片或None)
+def _locate_and_encode_file(filename_withpath, config, need_encodings=True, need_image=False):
+    stats = stats_reina.stats
+    config = get_detection_config(config)
+    face_key = None
+    if recognition_cache is None:
+        with stats.stage('decode'):
+            image = face_recognition.load_image_file(filename_withpath)
+    else:
+        with stats.stage('read'):
+            with open(filename_withpath, 'rb') as image_file:
+                content = image_file.read()
+        face_key = recognition_cache.face_key(content, config)
+        cached = recognition_cache.get_faces(face_key, need_encodings)
+        stats.count('cache_face_hits' if cached is not None else 'cache_face_misses')
+
+        image = None
+        if cached is None or need_image:
+            with stats.stage('decode'):
+                image = face_recognition.load_image_file(io.BytesIO(content))
+        if cached is not None:
+            face_locations, encodings = cached
+            if encodings is not None:
+                encodings = [None if numpy.isnan(encoding[0]) else encoding for encoding in encodings]
+            return face_key, face_locations, encodings, image
+
+    with stats.stage('detect'):
+        face_locations = detect_faces(image, config)
+    encodings = None
+    if need_encodings:
+        encodings = encode_faces(image, face_locations, config)
+    if recognition_cache is not None:
+        # a face rejected by the quality gate is cached as a row of nan
+        # 未通过质量检查的人脸缓存为一行nan
+        recognition_cache.put_faces(face_key, face_locations, None if encodings is None else
+                                    [numpy.full(128, numpy.nan) if encoding is None else encoding
+                                     for encoding in encodings])
+    return face_key, face_locations, encodings, image
+
+
+# match located faces, the results are cached by face key and gallery version if both are known
+# returns the same faces as locate_and_recognize
+# 匹配已定位的人脸, 人脸键与人脸库版本都已知时按它们缓存结果
+# 返回与locate_and_recognize相同的人脸
+def _match_located_faces(face_key, face_locations, encodings, known_matcher):
+    if len(face_locations) == 0:
+        return []
+
+    stats = stats_reina.stats
+    gallery_version = known_matcher.gallery_version
+    with stats.stage('match'):
+        if recognition_cache is not None and face_key is not None and gallery_version is not None:
+            results = recognition_cache.get_matches(face_key, gallery_version)
+            stats.count('cache_match_hits' if results is not None else 'cache_match_misses')
+            if results is None:
+                results = match_encodings(known_matcher, encodings)
+                recognition_cache.put_matches(face_key, gallery_version, results)
+        else:
+            results = match_encodings(known_matcher, encodings)
+
+    faces = []
+    for face, result in zip(face_locations, results):
+        y1, x1, y2, x2 = face
+        result['box'] = [min(x1,x2), max(x1,x2), min(y1,y2), max(y1,y2)]
+        faces.append(result)
+    return faces
+
+
 ###------------------定位模块 position module------------------###
 
 #============================================================== 
@@ -83,8 +419,10 @@ fault_tolerance = 0.5
 #                       带目录的文件名 (例: 'src/unpositioned/img1.png')
 # - positioned_path:    the target path which will store the positioned image. (e.g. 'src/positioned/')
 #                       保存定位生成图片的目标路径 (例: 'src/positioned/')  
+# - config:             detection config, see detection_config (None for the default one)
+#                       检测配置, 见detection_config (None则使用默认配置)
 # @return: (no return)
-def position_an_image(filename_withpath:str, positioned_path:str):
+def position_an_image(filename_withpath:str, positioned_path:str, config:dict=None):
     
     # get filename
     # 得到文件名
@@ -92,25 +430,28 @@ def position_an_image(filename_withpath:str, positioned_path:str):
 
     if os.path.splitext(filename)[1] not in compatible_formats:
         return None
-    # load file
-    # 加载图片文件
-    image = face_recognition.load_image_file(filename_withpath)
-    
-    face_locations=face_recognition.face_locations(image)
+    # load file, the face locations may come from recognition_cache
+    # 加载图片文件, 人脸位置可能来自recognition_cache
+    _, face_locations, _, image = _locate_and_encode_file(filename_withpath, config, need_encodings=False,
+                                                          need_image=True)
+    stats = stats_reina.stats
+    stats.count('images')
+    stats.observe('faces_per_image', len(face_locations))
      # face_locations eg:(139,283,325,97) (y1,x1,y2,x2)
    
-    for face in face_locations:
-        y1=face[0]
-        x1=face[1]
-        y2=face[2]
-        x2=face[3]
-        xmin = min(x1,x2)
-        ymin = min(y1,y2)
-        xmax = max(x1,x2)
-        ymax = max(y1,y2)
-        # draw rectangle according to face position
-        # 根据人脸位置画矩形
-        cv2.rectangle(image,(xmin,ymin),(xmax,ymax),(255,0,0),3)
+    with stats.stage('draw'):
+        for face in face_locations:
+            y1=face[0]
+            x1=face[1]
+            y2=face[2]
+            x2=face[3]
+            xmin = min(x1,x2)
+            ymin = min(y1,y2)
+            xmax = max(x1,x2)
+            ymax = max(y1,y2)
+            # draw rectangle according to face position
+            # 根据人脸位置画矩形
+            cv2.rectangle(image,(xmin,ymin),(xmax,ymax),(255,0,0),3)
 
     # make the positioned_path directory if not exists
     # 如果没有, 则创建定位图片的路径
@@ -119,250 +460,512 @@ def position_an_image(filename_withpath:str, positioned_path:str):
 
     # save image
     # 保存图片
-    cv2.imwrite(positioned_path + 'p_' + filename, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+    with stats.stage('write'):
+        cv2.imwrite(positioned_path + 'p_' + filename, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
 
 
 #==============================================================
-# position flow control                                                                 
-# 单个文件夹内, 批量生成定位图片的流程控制 
+# position flow control
+# the source and target folders are listed once, the existence of every output is checked against that listing
+# the overwrite policy decides what happens to an image whose output ('p_' + filename) already exists:
+# - 'ask':          ask for every existing output (Y/n/all), the answers are collected before any work starts
+# - 'skip':         keep the existing output
+# - 'overwrite':    position the image again
+# - 'newer':        position the image again only if it is newer than its output
+# with workers > 1 the images are positioned by a process pool, so a whole camera dump needs no supervision
+# 单个文件夹内, 批量生成定位图片的流程控制
+# 源文件夹与目标文件夹只列出一次, 每个输出是否存在都与这次列出的结果比较
+# 覆写策略决定输出('p_' + 文件名)已存在的图片如何处理:
+# - 'ask':          每个已存在的输出都询问(Y/n/all), 在开始处理之前收集所有回答
+# - 'skip':         保留已存在的输出
+# - 'overwrite':    重新定位这张图片
+# - 'newer':        只有图片比其输出新时才重新定位
+# workers > 1时由进程池定位图片, 整个相机导出的文件夹无需人工值守
 # @parameter:
 # - raw_path: the path which stores the source image for positioning. (e.g. 'src/unpositioned/')
 #             保存待定位图片的路径 (例: 'src/unpositioned/')
 # - positioned_path:  the target path which will store the positioned image. (e.g. 'src/positioned/')
-#                     保存定位生成图片的目标路径 (例: 'src/positioned/')  
-# @return: (no return)
-def position_a_folder(raw_path, positioned_path):
-
-    # filename List under the path (all file and floder included)
-    # 文件名的列表 (包括所有的文件和文件夹)
-    image_name_list=os.listdir(raw_path)
+#                     保存定位生成图片的目标路径 (例: 'src/positioned/')
+# - overwrite:  overwrite policy, one of overwrite_policies
+#               覆写策略, overwrite_policies之一
+# - workers:    number of worker processes, 1 to run in this process
+#               工作进程数, 1则在本进程中运行
+# - chunksize:  number of images sent to a worker at once (default: recognition_chunksize)
+#               一次发送给一个工作进程的图片数 (默认: recognition_chunksize)
+# - config:     detection config, see detection_config (None for the default one)
+#               检测配置, 见detection_config (None则使用默认配置)
+# @return:
+# - summary:    {'positioned': int, 'skipped': int, 'failed': int, 'unsupported': int}
+def position_a_folder(raw_path, positioned_path, overwrite='ask', workers=1, chunksize=None, config=None) -> dict:
+    if overwrite not in overwrite_policies:
+        raise ValueError("overwrite must be one of " + ", ".join(overwrite_policies))
+    if chunksize is None:
+        chunksize = recognition_chunksize
 
     # make the positioned_path directory if not exists
     # 如果没有, 则创建定位图片的路径
     if not os.path.exists(positioned_path):
         os.makedirs(positioned_path)
 
-    # overwrite flag
-    # 覆写标志
-    all_overwrite = False
-
-    # process every image with this loop
-    # 使用这个循环处理每个图片
-    for filename in image_name_list:
+    # both folders are listed once: filename -> {'size', 'mtime'}
+    # 两个文件夹都只列出一次: 文件名 -> {'size', 'mtime'}
+    raw_state = folder_manager_reina.scan_folder(raw_path)
+    positioned_state = folder_manager_reina.scan_folder(positioned_path)
 
-        filename_withpath = raw_path + filename
+    summary = {'positioned': 0, 'skipped': 0, 'failed': 0, 'unsupported': 0}
+    tasks = []
+    all_overwrite = False
+    for filename in sorted(raw_state):
         # make sure that file is compatible
         # 确保文件格式支持
+        if os.path.splitext(filename)[1] not in compatible_formats:
+            print("Format not supported, skipped: " + filename)
+            summary['unsupported'] += 1
+            continue
 
-        # if compatible:
-        # 如果文件格式支持
-        if (os.path.splitext(filename)[1] in compatible_formats):
-            
-            # detect if the positioned file is already generated
-            # 检测是否已经生成定位图片
-
-            # if not generated
-            # 如果还没有生成
-            if (filename not in os.listdir(positioned_path)):
-                # generate positioned image
-                # 生成定位图片
-                position_an_image(filename_withpath, positioned_path)
-            
-            # if generated
-            # 如果已经被生成
+        output = positioned_state.get('p_' + filename)
+        if output is not None and not all_overwrite:
+            if overwrite == 'skip':
+                is_overwrite = False
+            elif overwrite == 'overwrite':
+                is_overwrite = True
+            elif overwrite == 'newer':
+                is_overwrite = raw_state[filename]['mtime'] > output['mtime']
             else:
-                # check the overwrite flag
-                # 检查覆写标志
-
-                # if overwrite flag is true
-                # 如果覆写为真
-                if all_overwrite == True:
-                    # overwrrite
-                    # 覆写
-                    position_an_image(filename_withpath, positioned_path)
-                # if overwrite is false
-                # 如果覆写为假
-                else:
-                    # wait for choice
-                    # 等待选择
-                    while True:
-                        is_overwrite = input(filename+" already exists, do you want to overwrite it? (Y/n/all): ")
-                        if str.lower(is_overwrite) == 'y':
-                            # overwrite for this time
-                            # 这一张图片覆写
-                            position_an_image(filename_withpath, positioned_path)
-                            break
-                        elif str.lower(is_overwrite) == 'n':
-                            # skip
-                            # 跳过
-                            break
-                        elif str.lower(is_overwrite) == 'all':
-                            # overwrite for this time and set the overwrite flag to True
-                            # 这一张图片覆写并将覆写标志置为真(即之后的所有图片全部覆写)
-                            position_an_image(filename_withpath, positioned_path)
-                            all_overwrite = True
-                            break
-                        # invalid input, ask again
-                        # 输入不合法, 重新输入
-                        else:
-                            pass
-        # if file is not compatible
-        # 如果文件格式不支持
-        else:
-            print("Format not supported!")
-            # show all supported formats
-            # 显示所有支持的格式
-            for one_format in compatible_formats:
-                print(one_format)
+                # wait for choice, invalid input asks again
+                # 等待选择, 输入不合法时重新输入
+                while True:
+                    answer = str.lower(input(filename + " already exists, do you want to overwrite it? (Y/n/all): "))
+                    if answer in ('y', 'n', 'all'):
+                        break
+                is_overwrite = answer != 'n'
+                all_overwrite = answer == 'all'
+            if not is_overwrite:
+                summary['skipped'] += 1
+                continue
+        tasks.append(raw_path + filename)
 
-    print("All completed!")
+    stats = stats_reina.stats
+    if workers <= 1:
+        results = (_position_task(filename_withpath, positioned_path, config) for filename_withpath in tasks)
+    else:
+        # forked workers share the models loaded once by the parent, imap keeps the order of the images
+        # fork出的工作进程共享父进程加载一次的模型, imap保持图片的顺序
+        if multiprocessing.get_start_method() == 'fork':
+            warm_up(config)
+        pool = multiprocessing.Pool(workers, initializer=_init_position_worker, initargs=(stats.enabled,))
+        results = pool.imap(_position_worker, [(filename_withpath, positioned_path, config)
+                                               for filename_withpath in tasks], chunksize=chunksize)
+    try:
+        for filename_withpath, error, snapshot in results:
+            if snapshot is not None:
+                stats.merge(snapshot)
+            if error is None:
+                summary['positioned'] += 1
+                print("positioned " + filename_withpath)
+            else:
+                summary['failed'] += 1
+                print("failed to position " + filename_withpath + ": " + error)
+    finally:
+        if workers > 1:
+            pool.close()
+            pool.join()
+
+    print("All completed! {positioned} positioned, {skipped} skipped, {failed} failed, "
+          "{unsupported} not supported".format(**summary))
+    return summary
+
+
+# pool initializer of position_a_folder
+# position_a_folder的进程池初始化函数
+def _init_position_worker(use_stats: bool):
+    stats_reina.stats.reset()
+    stats_reina.stats.enabled = use_stats
+
+# position one image, errors are returned instead of raised so that one bad image never stops the folder
+# 定位一张图片, 出错时返回错误而不是抛出, 一张坏图片不会终止整个文件夹
+def _position_task(filename_withpath, positioned_path, config) -> tuple:
+    try:
+        position_an_image(filename_withpath, positioned_path, config)
+        return filename_withpath, None, None
+    except Exception as error:
+        stats_reina.stats.count('errors')
+        return filename_withpath, repr(error), None
+
+# task of one worker, the stats of the worker (None when disabled) are sent back with the result
+# 一个工作进程的任务, 工作进程的统计 (关闭时为None) 随结果发回
+def _position_worker(task: tuple) -> tuple:
+    filename_withpath, error, _ = _position_task(*task)
+    snapshot = stats_reina.stats.collect() if stats_reina.stats.enabled else None
+    return filename_withpath, error, snapshot
 
 
 ###------------------识别模块 recognition module------------------###
 
 #==============================================================
-# generate and save the encoding dictionary                                                              
-# 生成和保存一个文件夹中人脸的'编码字典'
+# store key of a known image: relative path without extension, '/' separated
+# 'alice.jpg' -> 'alice', 'alice/img1.jpg' -> 'alice/img1' (both belong to 'alice')
+# 已知图片的人脸库键: 去掉扩展名的相对路径, 以'/'分隔
+# 'alice.jpg' -> 'alice', 'alice/img1.jpg' -> 'alice/img1' (都属于'alice')
+# @parameter:
+# - relative_filename:  filename relative to known_path | str
+#                       相对于known_path的文件名 | str
+# @return: str
+def known_key(relative_filename: str) -> str:
+    return os.path.splitext(relative_filename.replace(os.sep, '/'))[0]
+
+
+#==============================================================
+# generate (or update) and save the binary gallery store
+# 生成(或更新)并保存二进制人脸库
+# - known images are 'src/known/alice.jpg' (one image) or 'src/known/alice/*.jpg' (any number of images of alice)
+#   已知图片为'src/known/alice.jpg' (一张图片) 或 'src/known/alice/*.jpg' (alice的任意多张图片)
+# - first run: encode every known image
+#   第一次运行: 编码所有已知图片
+# - an old 'encoding.json' is imported once instead of encoding again
+#   已有的旧'encoding.json'只导入一次, 不重新编码
+# - later runs: only the 'new' and 'deleted' files of the modate diff are appended or tombstoned,
+#   'renamed' files keep their rows under the new key
+#   之后的运行: 只追加或标记删除'文件解析记录'中'new'和'deleted'的文件, 'renamed'的文件以新键保留原来的行
+# - the images are encoded by a process pool, the rows are appended every checkpoint_interval images;
+#   the modification record is only saved at the end, so an interrupted first run resumes from the last checkpoint
+#   (images whose key is in the store already are skipped), an interrupted update repeats the changes next time
+#   图片由进程池编码, 每checkpoint_interval张图片追加一次行; 文件解析记录只在最后保存, 因此被中断的第一次运行
+#   从最后一个检查点继续 (跳过键已在人脸库中的图片), 被中断的更新在下次运行时重复处理这些变化
+# - images with no face, several faces or an error are not enrolled but listed in quarantine_json with the reason
+#   没有人脸, 有多张人脸或出错的图片不被录入, 而是连同原因列在quarantine_json中
 # @parameter:
 # - known_path: the path which stores the known images for encoding. (e.g. 'src/known/')
 #               保存待编码人脸图片的路径 (例: 'src/known/')
+# - workers:    number of worker processes (None for enrollment_workers), 1 to encode in this process
+#               工作进程数 (None则为enrollment_workers), 1则在本进程中编码
 # @return: 
-# - new_dict:   generated encoding dictionary | name -> str: encoding ->ndarray
-#               生成的编码字典 | name -> str: encoding ->ndarray
-def gen_sav_encodings_dict(known_path : str) -> dict:
+# - store:      the binary gallery store | gallery_reina.EncodingStore
+#               二进制人脸库 | gallery_reina.EncodingStore
+def update_encoding_store(known_path : str, workers : int = None) -> gallery_reina.EncodingStore:
 
-    # if the encoding dictionary not exists
-    # 如果'编码字典'文件不存在
-    if not os.path.exists(json_path + encoding_json):
+    # if json_path not exists, new it
+    # 如果json_path不存在, 就创建它
+    if not os.path.exists(json_path):
+        os.makedirs(json_path)
+
+    store = gallery_reina.EncodingStore(json_path)
+
+    # if the store not exists but an old 'encoding.json' does, import it
+    # 如果人脸库不存在但有旧的'encoding.json', 则导入它
+    if not store.exists() and os.path.exists(json_path + encoding_json):
+        print("Importing " + encoding_json + " into the binary store...")
+        with open(json_path + encoding_json, 'r', encoding='utf-8') as encoding_file:
+            old_dict_save = json.load(encoding_file)
+        store.append(list(old_dict_save.keys()), list(old_dict_save.values()))
+
+    quarantine = folder_manager_reina.load_state(json_path + quarantine_json)
+
+    # if the encoding dictionary or the modification record not exists (first run, or an interrupted first run)
+    # 如果'编码字典'或'文件解析记录'不存在 (第一次运行, 或被中断的第一次运行)
+    if not store.exists() or not os.path.exists(json_path + modate_json):
         # generate the encoding dictionary and modification record file
         # 第一次生成'编码字典'文件和'文件解析记录'文件
 
-        # generate the encoding directory for the first time
-        # 第一次生成'编码字典'
+        # filename List under the path, files in the person subfolders included (e.g. 'alice/img1.jpg')
+        # 文件名的列表, 包括每个人的子文件夹中的文件 (例: 'alice/img1.jpg')
+        modate_dict = folder_manager_reina.scan_folder(known_path, recursive=True, use_hash=hash_known_images)
+        supported = [one_file for one_file in sorted(modate_dict)
+                     if os.path.splitext(one_file)[1] in compatible_formats]
+
+        # resume: rows of images deleted meanwhile are dropped, images already in the store are skipped,
+        # and so are quarantined images that did not change
+        # 继续: 删除期间被删掉的图片的行, 跳过已在人脸库中的图片, 以及没有变化的被隔离的图片
+        supported_keys = {known_key(one_file) for one_file in supported}
+        enrolled_keys = set(store.alive()[0]) if store.exists() else set()
+        store.delete([key for key in enrolled_keys if key not in supported_keys])
+        quarantine = {one_file: entry for one_file, entry in quarantine.items()
+                      if _is_unchanged(entry['state'], modate_dict.get(one_file))}
+        to_encode = [one_file for one_file in supported
+                     if known_key(one_file) not in enrolled_keys and one_file not in quarantine]
+        if len(to_encode) != len(supported):
+            print("Resuming: {} of {} images done".format(len(supported) - len(to_encode), len(supported)))
 
-        # filename List under the path (all file and floder included)
-        # 文件名的列表 (包括所有的文件和文件夹)
-        known_image_name_list=os.listdir(known_path)
-
-        # initialize the encoding dictionary
-        # 初始化编码字典
-        new_dict={}
         print("Generating known image encoding directory...")
-        for one_file in known_image_name_list:
-            if os.path.isdir(one_file) or (os.path.splitext(one_file)[1] not in compatible_formats):
-                continue
-            print("Generating encoding for " + one_file + " ...")
-            known_image = face_recognition.load_image_file(known_path + one_file)
-            new_dict[os.path.splitext(one_file)[0]] = (face_recognition.face_encodings(known_image)[0])
-        
-        # searialize ndarray (to save in the json file)
-        # 将ndarray序列化, 以保存进json文件
-        new_dict_save = {}
-        for name in new_dict:
-            new_dict_save[name] = new_dict[name].tolist()
-        
-        # save encoding dictionary to encoding dictionary file: json_path ('encoding.json' by default)
-        # 保存'编码字典'至'编码字典'文件: json_path (默认文件为'encoding.json')
-        # if json_path not exists, new it
-        # 如果json_path不存在, 就创建它
-        if not os.path.exists(json_path):
-            os.makedirs(json_path)
-
-        # write the serialized encoding dictionary into 'encoding.json'
-        # 将序列化后的'编码字典'写入encoding.json
-        with open(json_path + encoding_json, 'w', encoding='utf-8') as encoding_json_file:
-            encoding_json_s = json.dumps(new_dict_save)
-            encoding_json_file.write(encoding_json_s)
-
-        # initialize the modification record file('modate.json' by default)
-        # 初始化'文件解析记录'文件:modate_json(默认文件为'modate.json')
-        # write it to modate_json
-        # 写入mdate_json
-        modate_dict = folder_manager_reina.parse_modate(known_path)
-        folder_manager_reina.save_dict(modate_dict, json_path + modate_json)
+        _enroll_images(store, known_path, to_encode, modate_dict, quarantine, workers)
+
+        # an empty gallery is saved as well
+        # 空人脸库也会被保存
+        if not store.exists():
+            store.compact()
 
     else:
-        # read the modate_json and update, get the change dictionary
-        # 读取文件解析记录并更新, 得到'变化字典'
-        is_changed, change = folder_manager_reina.get_change_and_renew(known_path, json_path + modate_json)
-        
-        # read the old and serialized 'enoding dictionary'
-        # 读取旧'编码字典'(序列化后)
-        with open(json_path + encoding_json, 'r', encoding='utf-8') as encoding_file:
-            old_json_save_s = encoding_file.read()
-        old_dict_save = json.loads(old_json_save_s)
-
-        # undo serialization to get the original ndarray
-        # 反序列化, 获得原始ndarray
-        old_dict = {}
-        for name in old_dict_save:
-            old_dict[name] = numpy.array(old_dict_save[name])
+        # read the modate_json and compare, get the change dictionary
+        # 读取文件解析记录并比较, 得到'变化字典'
+        is_changed, change, modate_dict = folder_manager_reina.get_change(known_path, json_path + modate_json,
+                                                                          recursive=True, use_hash=hash_known_images)
         
-        # initialize new 'encoding dictionary' (inherit from the old one)
-        # 初始化新'编码字典'(继承旧'编码字典')
-        new_dict = old_dict
         # if file is not changed, there is no need for encoding dictionary to change.
         # 如果文件没有改变, 那么'编码字典'也无需改变
         if not is_changed:
             print("modate.json not changed, pass")
-            pass
         
-        # if file is changed, the 'encoding dictionary' should be changed according to it.
-        # 如果文件改变, 则'编码字典'对应改变
+        # if file is changed, only the changed rows are written
+        # 如果文件改变, 只写入变化的行
         else:
-            # load 'new' and 'deleted' from the change dictionary
-            # 从'变化字典'中加载'new'和'deleted'
-            new = change['new']
-            deleted = change['deleted']
+            # load 'new', 'deleted' and 'renamed' from the change dictionary
+            # 从'变化字典'中加载'new', 'deleted'和'renamed'
+            new = list(change['new'])
+            deleted = list(change['deleted'])
+
+            # a rename between two supported formats keeps the row, otherwise it is a deletion or a new file
+            # 两个支持的格式之间的重命名保留原来的行, 否则视为删除或新文件
+            renamed_keys = []
+            for old_filename, new_filename in change['renamed']:
+                is_old_supported = os.path.splitext(old_filename)[1] in compatible_formats
+                is_new_supported = os.path.splitext(new_filename)[1] in compatible_formats
+                if is_old_supported and is_new_supported:
+                    print("processing(rename) " + old_filename + " -> " + new_filename + " ...")
+                    renamed_keys.append([known_key(old_filename), known_key(new_filename)])
+                else:
+                    deleted.append(old_filename)
+                    new.append(new_filename)
+
+            # a quarantined image leaves the quarantine when it is deleted or changed, and moves when it is renamed
+            # 被隔离的图片被删除或修改时离开隔离列表, 被重命名时随之移动
+            for old_filename, new_filename in change['renamed']:
+                if old_filename in quarantine:
+                    quarantine[new_filename] = quarantine.pop(old_filename)
+                    quarantine[new_filename]['state'] = modate_dict[new_filename]
+            for changed_filename in deleted + new:
+                quarantine.pop(changed_filename, None)
+
+            # processing 'deleted' List
+            # 处理'deleted'列表
+            if len(deleted) != 0:
+                print("something deleted:")
+                deleted_names = []
+                for deleted_filename in deleted:
+                    # check the compatibility of the file format
+                    # 检测文件格式是否支持, 如果不支持则跳过
+                    if os.path.splitext(deleted_filename)[1] not in compatible_formats:
+                        print(deleted_filename + ' is not supported, skip.')
+                        continue
+                    print("processing(delete) " + deleted_filename + " ...")
+                    deleted_names.append(known_key(deleted_filename))
+
+                # tombstone the rows of every image in 'deleted'
+                # 将'deleted'中每一个图片的行标记为删除
+                store.delete(deleted_names)
+
+            # renamed images keep their encodings
+            # 被重命名的图片保留其编码
+            store.rename(renamed_keys)
 
             # processing 'new' List
             # 处理'new'列表 
             if len(new) != 0:
                 print("something newed: ")
-                for new_filename in new:
+                to_encode = []
+                for new_filename in sorted(new):
                     # check the compatibility of the file format
                     # 检测文件格式是否支持, 如果不支持则跳过
                     if os.path.splitext(new_filename)[1] not in compatible_formats:
                         print(new_filename + ' is not supported, skip.')
                         continue
-                    # save 'key:value's of every image in 'new' to new_dict
-                    # 把'new'中的每一个图片的键值对收录进'new_dict'
-                    print("processing(new) " + new_filename + " ...")
-                    this_image = face_recognition.load_image_file(known_path + new_filename)
-                    new_dict[os.path.splitext(new_filename)[0]] = face_recognition.face_encodings(this_image)[0]
+                    to_encode.append(new_filename)
+
+                # append the rows of every image in 'new' (a changed image replaces its old row)
+                # a changed image that is quarantined loses its old row
+                # 追加'new'中每一个图片的行 (被修改的图片替换它的旧行)
+                # 被修改后被隔离的图片删除它的旧行
+                quarantined = _enroll_images(store, known_path, to_encode, modate_dict, quarantine, workers)
+                store.delete([known_key(new_filename) for new_filename in quarantined])
+
+            # rewrite the matrix file if too many rows are tombstones
+            # 如果墓碑行太多, 则重写矩阵文件
+            if store.compact_if_needed():
+                print("encoding store compacted")
+
+    # the store is up to date, save the quarantine and the modification record
+    # (hashes may have been added even without a change)
+    # 人脸库已更新, 保存隔离列表与文件解析记录 (即使没有变化也可能补上了哈希)
+    folder_manager_reina.save_dict(quarantine, json_path + quarantine_json)
+    folder_manager_reina.save_dict(modate_dict, json_path + modate_json)
+    if len(quarantine) != 0:
+        print("{} images quarantined, see {}".format(len(quarantine), json_path + quarantine_json))
+
+    # the ann index follows the store: appended rows are assigned, a compaction reassigns every row
+    # ann索引跟随人脸库: 追加的行被分配, 压缩后重新分配每一行
+    if use_ann_index:
+        ann_index_reina.update_index(store, json_path)
 
-            # processing 'deleted' List
-            # 处理'deleted'列表
-            if len(deleted) != 0:
-                print("something deleted:")
+    # return
+    # 返回人脸库
+    return store
+
+
+# whether a file kept its scan state (same size and modification time, or the same content hash)
+# 文件的扫描状态是否没有变化 (大小与修改时间相同, 或内容哈希相同)
+def _is_unchanged(old_state, new_state) -> bool:
+    if old_state is None or new_state is None:
+        return False
+    if old_state.get('hash') is not None and old_state.get('hash') == new_state.get('hash'):
+        return True
+    return old_state.get('size') == new_state.get('size') and old_state.get('mtime') == new_state.get('mtime')
+
+# encode the known images (relative filenames) in order, by a process pool when there are enough of them
+# the rows are appended and the quarantine is saved every checkpoint_interval images
+# returns the filenames quarantined by this call
+# 按顺序编码已知图片 (相对文件名), 图片足够多时使用进程池
+# 每checkpoint_interval张图片追加一次行并保存隔离列表
+# 返回本次被隔离的文件名
+def _enroll_images(store, known_path, filenames, modate_dict, quarantine, workers) -> list:
+    if workers is None:
+        workers = enrollment_workers if enrollment_workers is not None else (os.cpu_count() or 1)
+    filenames_withpath = [known_path + one_file for one_file in filenames]
+
+    pool = None
+    if workers <= 1 or len(filenames) < parallel_enrollment_min:
+        results = map(_enroll_task, filenames_withpath)
+    else:
+        # forked workers share the models loaded once by the parent, imap keeps the order of the images
+        # fork出的工作进程共享父进程加载一次的模型, imap保持图片的顺序
+        if multiprocessing.get_start_method() == 'fork':
+            warm_up()
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap(_enroll_task, filenames_withpath, chunksize=recognition_chunksize)
+
+    names = []
+    encodings = []
+    quarantined = []
+    try:
+        for done, (one_file, (encoding, reason, error)) in enumerate(zip(filenames, results), 1):
+            if reason is None:
+                names.append(known_key(one_file))
+                encodings.append(encoding)
+            else:
+                print("quarantined(" + reason + ") " + one_file + ("" if error is None else ": " + error))
+                quarantine[one_file] = {'reason': reason, 'error': error, 'state': modate_dict.get(one_file)}
+                quarantined.append(one_file)
+
+            # checkpoint: the rows are written, an interrupted first run restarts after them
+            # 检查点: 写入这些行, 被中断的第一次运行从它们之后继续
+            if done % checkpoint_interval == 0 or done == len(filenames):
+                store.append(names, encodings)
+                folder_manager_reina.save_dict(quarantine, json_path + quarantine_json)
+                names = []
+                encodings = []
+                print("{} / {} images encoded".format(done, len(filenames)))
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return quarantined
+
+# encode the only face of one known image, errors are returned instead of raised so that one bad image never
+# stops the build: (encoding, None, None) or (None, reason, error)
+# 编码一张已知图片中唯一的人脸, 出错时返回错误而不是抛出, 一张坏图片不会终止整个构建:
+# (编码, None, None) 或 (None, 原因, 错误)
+def _enroll_task(filename_withpath: str) -> tuple:
+    try:
+        known_image = face_recognition.load_image_file(filename_withpath)
+        face_locations = detect_faces(known_image)
+        if len(face_locations) == 0:
+            return None, 'no_face', None
+        if len(face_locations) > 1:
+            return None, 'multiple_faces', None
+        return face_recognition.face_encodings(known_image, known_face_locations=face_locations)[0], None, None
+    except Exception as error:
+        return None, 'failed', repr(error)
 
-                # check the compatibility of the file format
-                # 检测文件格式是否支持, 如果不支持则跳过
-                for deleted_filename in deleted:
-                    if os.path.splitext(deleted_filename)[1] not in compatible_formats:
-                        print(deleted_filename + ' is not supported, skip.')
-                        continue
-                    print("processing(delete) " + deleted_filename + " ...")
 
-                    # delete 'key:value's of every image in 'deleted' from new_dict
-                    # 把'deleted'中的每一个图片的键值对从'new_dict'移除
-                    new_dict.pop(os.path.splitext(deleted_filename)[0]) 
+#==============================================================
+# generate and save the encoding dictionary                                                              
+# 生成和保存一个文件夹中人脸的'编码字典'
+# the gallery is saved in the binary store, see update_encoding_store
+# 人脸库保存在二进制人脸库中, 见update_encoding_store
+# @parameter:
+# - known_path: the path which stores the known images for encoding. (e.g. 'src/known/')
+#               保存待编码人脸图片的路径 (例: 'src/known/')
+# @return: 
+# - new_dict:   generated encoding dictionary | name -> str: encoding ->ndarray
+#               生成的编码字典 | name -> str: encoding ->ndarray
+def gen_sav_encodings_dict(known_path : str) -> dict:
+    return update_encoding_store(known_path).to_dict()
+
 
-            # serialize the new_dict
-            # 序列化新字典
-            new_dict_save = {}
-            for name in new_dict:
-                new_dict_save[name] = new_dict[name].tolist()
+#==============================================================
+# build the matcher from the encoding dictionary
+# 根据'编码字典'生成匹配器
+# @parameter:
+# - known_encoding_dict:    known encoding dictionary | {name: encoding}, an EncodingStore,
+#                           or a FaceMatcher/TemplateMatcher which will be returned directly
+#                           已知的编码字典 | {name -> str: encoding -> ndarray}, EncodingStore, 或直接返回的FaceMatcher
+# - tolerance:              face rocognition tolerance, None for fault_tolerance
+#                           人脸识别容错率, None则为fault_tolerance
+# - use_index:              use the ann index next to an EncodingStore, None for use_ann_index
+#                           使用EncodingStore旁边的ann索引, None则为use_ann_index
+# @return:
+# - matcher:    the whole gallery in one matrix | gallery_reina.FaceMatcher or gallery_reina.TemplateMatcher
+#               整个人脸库矩阵化后的匹配器 | gallery_reina.FaceMatcher或gallery_reina.TemplateMatcher
+def get_matcher(known_encoding_dict, tolerance=None, use_index=None):
+    if tolerance is None:
+        tolerance = fault_tolerance
+    if use_index is None:
+        use_index = use_ann_index
+
+    if isinstance(known_encoding_dict, (gallery_reina.FaceMatcher, gallery_reina.TemplateMatcher)):
+        return known_encoding_dict
+    if isinstance(known_encoding_dict, gallery_reina.EncodingStore):
+        keys, encodings = known_encoding_dict.alive()
+        searcher = None
+        search = 'exact'
+        if gallery_reina.uses_templates(keys):
+            # TemplateMatcher shortlists people by their templates, the ann and int8 searchers are not used,
+            # the version records the search which really runs
+            # TemplateMatcher按模板筛选候选人, 不使用ann与int8搜索器, 版本中记录真正运行的搜索方式
+            search = 'template{}x{}'.format(gallery_reina.templates_per_person, gallery_reina.default_shortlist)
+        elif use_index:
+            # an index saved before the last store change is synced in memory
+            # 在人脸库最后一次改变之前保存的索引在内存中同步
+            index = ann_index_reina.load_index(known_encoding_dict.store_path)
+            if index is not None:
+                index.sync(known_encoding_dict)
+                searcher = index.searcher(known_encoding_dict, ann_n_probe)
+                search = 'ann{}'.format(ann_n_probe)
+        if searcher is None and use_quantized_search and search == 'exact':
+            searcher = gallery_reina.QuantizedSearcher(encodings, quantized_rerank)
+            search = 'int8x{}'.format(quantized_rerank)
+        matcher = gallery_reina.build_matcher(keys, encodings, tolerance, searcher)
+
+        # any change of the store, the tolerance or the search gives another version,
+        # store_id tells a store built again at the same path (its version starts again) from the old one
+        # 人脸库, 容错率或搜索方式的任何改变都会得到另一个版本,
+        # store_id区分在同一路径重建的人脸库 (其version重新开始) 与旧的人脸库
+        matcher.gallery_version = '{}:{}:{}:{}:{}'.format(os.path.abspath(known_encoding_dict.store_path),
+                                                          known_encoding_dict.store_id, known_encoding_dict.version,
+                                                          tolerance, search)
+        return matcher
+
+    # one image per person gives a FaceMatcher, several images per person give a TemplateMatcher
+    # 每人一张图片时为FaceMatcher, 每人多张图片时为TemplateMatcher
+    return gallery_reina.build_matcher(list(known_encoding_dict.keys()), list(known_encoding_dict.values()), tolerance)
 
-            #save new_dict into json file
-            # 更改结束之后, 将序列化后的新字典保存到文件中
-            with open(json_path + encoding_json, 'w', encoding='utf-8') as encoding_file:
-                new_dict_s = json.dumps(new_dict_save)
-                encoding_file.write(new_dict_s)
 
-    # return
-    # 返回新'编码字典'
-    return new_dict
+#==============================================================
+# match encodings against the gallery in one operation, a face without an encoding (rejected by the quality gate)
+# is reported as low_quality_name
+# 一次性将编码与人脸库匹配, 没有编码的人脸 (未通过质量检查) 报告为low_quality_name
+# @parameter:
+# - known_matcher:  return value of get_matcher
+#                   get_matcher的返回值
+# - encodings:      ndarray (128) or None for each face, return value of encode_faces
+#                   每张人脸一个ndarray (128)或None, encode_faces的返回值
+# @return:
+# - results:    one dictionary for each face, same as known_matcher.match
+#               每张人脸一个字典, 与known_matcher.match相同
+def match_encodings(known_matcher, encodings) -> list:
+    passed = [encoding for encoding in encodings if encoding is not None]
+    matches = iter(known_matcher.match(passed) if len(passed) != 0 else [])
+    return [next(matches) if encoding is not None else
+            {'name': low_quality_name, 'distance': float('inf'), 'nearest': None,
+             'runner_up': None, 'runner_up_distance': float('inf')} for encoding in encodings]
 
 
 #==============================================================
@@ -371,52 +974,86 @@ def gen_sav_encodings_dict(known_path : str) -> dict:
 # @parameter:
 # - unknown_face_img:   cropped unknown face image (ndarray format)
 #                       裁剪后的未知人脸图像(ndarray格式)
-# - known_encoding_dict:    known encoding dictionary | {name: encoding}
-#                           已知的编码字典 | {name -> str: encoding -> ndarray}
+# - known_encoding_dict:    known encoding dictionary | {name: encoding}, or a FaceMatcher
+#                           已知的编码字典 | {name -> str: encoding -> ndarray}, 或FaceMatcher
 # @return: 
 # - matched_distance:   2 dim list of matiched people and its distance | [matched_people ->str, min_face_distance -> int]
 #                       匹配到的人与其distance的二维列表 | [matched_people -> str, min_face_distance -> int]
-def face_people_match(unknown_face_img: numpy.ndarray, known_encoding_dict: dict) -> list:
-    if len(face_recognition.face_encodings(unknown_face_img))!=0:
-        # preparation of unknown_face
-        # 对unknown_face的预处理
-        unknown_image_encoding = face_recognition.face_encodings(unknown_face_img)[0]
-    else:
+def face_people_match(unknown_face_img: numpy.ndarray, known_encoding_dict) -> list:
+    stats = stats_reina.stats
+
+    # preparation of unknown_face (detect and encode only once)
+    # 对unknown_face的预处理 (只检测和编码一次)
+    with stats.stage('detect_encode'):
+        unknown_image_encodings = face_recognition.face_encodings(unknown_face_img)
+    if len(unknown_image_encodings) == 0:
         return None
     
-    # initialize face distance and default matched people
-    # 初始化face distance和默认的matched people
-    min_face_distance = 99999
-    matched_people='unknown'
-    is_matched = False
-    
-    # compare one by one
-    # 逐个对比
-    for name in known_encoding_dict:
-        results = face_recognition.face_distance([known_encoding_dict[name]], unknown_image_encoding)
-        if results[0] < min_face_distance:
-            min_face_distance = results[0]
-            matched_people = name
-            if min_face_distance <= fault_tolerance:
-                is_matched = True
-    
+    # compare with the whole gallery at once
+    # 与整个人脸库一次性对比
+    with stats.stage('match'):
+        result = get_matcher(known_encoding_dict).match(unknown_image_encodings[:1])[0]
+
     # if can not be matched
-    # 如果没有匹配到        
-    if not is_matched:
-        matched_people='unknown'
-        min_face_distance = 99999
+    # 如果没有匹配到
+    if result['name'] == gallery_reina.unknown_name:
+        return ['unknown', 99999]
 
     # return the list of matched people's name and its distance
     # 返回匹配度最高的人名和distance的列表
-    matched_distance = [matched_people, min_face_distance]
+    matched_distance = [result['name'], result['distance']]
     return matched_distance
 
 
 #==============================================================
-# find all faces in one image, crop and recognize for each
+# find and recognize all faces in a decoded image
+# detection runs once on the full image, the locations go straight to the encoder
+# 找到并识别一张已解码图片中的所有人脸
+# 只在整张图片上检测一次, 检测到的位置直接交给编码器
+
+# @parameter:
+# - image:                  decoded RGB image | ndarray (e.g. face_recognition.load_image_file(...))
+#                           已解码的RGB图片 | ndarray (例: face_recognition.load_image_file(...))
+# - known_encoding_dict:    known encoding dictionary
+#                           已知的编码字典
+#                           {name: encoding} -> str: ndarray, or a FaceMatcher (或FaceMatcher)
+# - config:                 detection config, see detection_config (None for the default one)
+#                           检测配置, 见detection_config (None则使用默认配置)
+# @return:
+# - faces:  one dictionary for each face, two unknown faces will not overwrite each other
+#           每张人脸一个字典, 两张unknown人脸不会互相覆盖
+#           [{'box': [xmin, xmax, ymin, ymax], 'name': str, 'distance': float, 'runner_up': str, 'runner_up_distance': float}]
+def locate_and_recognize(image: numpy.ndarray, known_encoding_dict, config: dict = None) -> list:
+
+    # face_locations eg:(139,283,325,97) (y1,x1,y2,x2), always in full resolution
+    # face_locations 例:(139,283,325,97) (y1,x1,y2,x2), 总是原分辨率的坐标
+    stats = stats_reina.stats
+    with stats.stage('detect'):
+        face_locations = detect_faces(image, config)
+    if len(face_locations) == 0:
+        return []
+
+    # encode with the known locations, no second detection (faces failing the quality gate are not encoded)
+    # 使用已知位置编码, 不再重复检测 (未通过质量检查的人脸不编码)
+    unknown_encodings = encode_faces(image, face_locations, config)
+
+    # match all faces of this image against the whole gallery in one batch
+    # 将这张图片中的所有人脸与整个人脸库一次性批量匹配
+    with stats.stage('match'):
+        results = match_encodings(get_matcher(known_encoding_dict), unknown_encodings)
+    faces = []
+    for face, result in zip(face_locations, results):
+        y1, x1, y2, x2 = face
+        result['box'] = [min(x1,x2), max(x1,x2), min(y1,y2), max(y1,y2)]
+        faces.append(result)
+    return faces
+
+
+#==============================================================
+# find all faces in one image, recognize each (decoded and detected only once)
 # return the dictionary of name:[[xmin, xmax, ymin, ymax]]
 
-# 找到一张图片中的所有人脸, 依次裁剪后识别, 返回识别结果 
+# 找到一张图片中的所有人脸, 依次识别, 返回识别结果 (只解码和检测一次)
 # 返回人名与[[xmin, xmax, ymin, ymax], distance]的字典
 
 # @parameter:
@@ -424,42 +1061,70 @@ def face_people_match(unknown_face_img: numpy.ndarray, known_encoding_dict: dict
 #                           待识别带路径的图片文件名 | str (例:'src/unknown/unknown1.jpg')  
 # - known_encoding_dict:    known encoding dictionary
 #                           已知的编码字典
-#                           {name: encoding} -> str: ndarray
+#                           {name: encoding} -> str: ndarray, or a FaceMatcher (或FaceMatcher)
+# - config:                 detection config, see detection_config (None for the default one)
+#                           检测配置, 见detection_config (None则使用默认配置)
 # @return: 
 # - name__position_distance:    dictionary that stores recognition info
 #                               保存识别信息的字典 
 #                               {name:[xmin, xmax, ymin, ymax], distance} -> {str:[float, float, float, float], float}
-def crop_and_recognize(unknown_file_withpath, known_encoding_dict):
+def crop_and_recognize(unknown_file_withpath, known_encoding_dict, config=None):
     
-    image = face_recognition.load_image_file(unknown_file_withpath)
-    face_locations=face_recognition.face_locations(image)
+    # detection and encoding (and matching against the same gallery version) may come from recognition_cache
+    # 检测与编码 (以及与相同人脸库版本的匹配) 可能来自recognition_cache
+    face_key, face_locations, encodings, _ = _locate_and_encode_file(unknown_file_withpath, config)
+    faces = _match_located_faces(face_key, face_locations, encodings, get_matcher(known_encoding_dict))
+    stats_reina.stats.count('images')
+    stats_reina.stats.observe('faces_per_image', len(faces))
     
-    
-    if len(face_locations) == 0:
+    if len(faces) == 0:
         return None
 
-    # face_locations eg:(139,283,325,97) (y1,x1,y2,x2)
     name__position_distance = {}
-    for face in face_locations:
-        y1=face[0]
-        x1=face[1]
-        y2=face[2]
-        x2=face[3]
-        xmin = min(x1,x2)
-        ymin = min(y1,y2)
-        xmax = max(x1,x2)
-        ymax = max(y1,y2)
-        croped_image=image[ymin:ymax, xmin:xmax]
-
-        name_distance = face_people_match(croped_image, known_encoding_dict)
-        if name_distance == None:
-            continue
-
+    for face in faces:
+        distance = face['distance'] if face['name'] not in (gallery_reina.unknown_name, low_quality_name) else 99999
         # name:[[xmin, xmax, ymin, ymax], distance]
-        name__position_distance[name_distance[0]] = [[xmin, xmax, ymin, ymax],name_distance[1]]
+        name__position_distance[face['name']] = [face['box'], distance]
     return name__position_distance
 
 
+#==============================================================
+# draw the recognition results on an image
+# 根据识别结果在图片上绘制
+# @parameter:
+# - image:  BGR image to draw on, it will be changed in place | ndarray
+#           要绘制的BGR图片, 将被直接修改 | ndarray
+# - faces:  recognition results | return value of locate_and_recognize
+#           识别结果 | locate_and_recognize的返回值
+# @return: (no return)
+def draw_recognition(image: numpy.ndarray, faces: list):
+    for face in faces:
+
+        # processing the data
+        # 整理数据
+        xmin, xmax, ymin, ymax = face['box']
+        distance = face['distance']
+
+        # draw a rectangle according to a face position
+        # 根据人脸位置画矩形
+        cv2.rectangle(image,(xmin,ymin),(xmax,ymax),(0,0,255),3)
+        
+        # edit attributes of the text
+        # 编辑文字属性
+        text_content_name = face['name']
+        text_content_distance = "{:.3f}".format(distance)
+        text_position_name = (xmin, ymin-10)        #左上角名字
+        text_position_distance = (xmin, ymax+25)    #左下角匹配度
+        text_font = cv2.FONT_HERSHEY_SIMPLEX
+        text_size = 0.8
+        text_color = (0,0,255)
+        text_thickness = 2
+        
+        # place text
+        # 放置文字
+        cv2.putText(image, text_content_name, text_position_name, text_font, text_size, text_color, text_thickness)
+        cv2.putText(image, text_content_distance, text_position_distance, text_font, text_size, text_color, text_thickness)
+
 
 #==============================================================
 # recognize and draw results for one image
@@ -470,59 +1135,148 @@ def crop_and_recognize(unknown_file_withpath, known_encoding_dict):
 #                           待识别带路径的图片文件名 | str (例:'src/unknown/unknown1.jpg')  
 # - known_encoding_dict:    known encoding dictionary
 #                           已知的编码字典
-#                           {name: encoding} -> str: ndarray
+#                           {name: encoding} -> str: ndarray, or a FaceMatcher (或FaceMatcher)
 # - recog_file_path:        path to store recogized image file
 #                           保存识别后图片文件的路径
-# @return: (no return)
-def recognize_an_imge(unknown_file_withpath, known_encoding_dict, recog_file_path):
+# - config:                 detection config, see detection_config (None for the default one)
+#                           检测配置, 见detection_config (None则使用默认配置)
+# @return:
+# - faces:  recognition results of this image | return value of locate_and_recognize
+#           这张图片的识别结果 | locate_and_recognize的返回值
+def recognize_an_imge(unknown_file_withpath, known_encoding_dict, recog_file_path, config=None):
     
     # get filename
     # 获取文件名
     filename = os.path.split(unknown_file_withpath)[1]
 
-    # open image
-    # 打开图片
-    unknown_image = cv2.imread(unknown_file_withpath)
+    # open image, the only decode of this file, detection and encoding may come from recognition_cache
+    # 打开图片, 这个文件只解码这一次, 检测与编码可能来自recognition_cache
+    face_key, face_locations, encodings, unknown_image = _locate_and_encode_file(unknown_file_withpath, config,
+                                                                                 need_image=True)
 
     # get the data of recognition (Essential)
     # 获取识别信息 (关键步骤)
-    # dict {name:[[xmin, xmax, ymin, ymax], distance]}
-    name__position_distance = crop_and_recognize(unknown_file_withpath, known_encoding_dict)
-    
-    if name__position_distance != None:
-        for name in name__position_distance.keys():
-            
-            # processing the data
-            # 整理数据
-            xmin = name__position_distance[name][0][0]
-            xmax = name__position_distance[name][0][1]
-            ymin = name__position_distance[name][0][2]
-            ymax = name__position_distance[name][0][3]
-            distance = name__position_distance[name][1]
-            
-            # draw a rectangle according to a face position
-            # 根据人脸位置画矩形
-            cv2.rectangle(unknown_image,(xmin,ymin),(xmax,ymax),(0,0,255),3)
-            
-            # edit attributes of the text
-            # 编辑文字属性
-            text_content_name = name
-            text_content_distance = "{:.3f}".format(distance)
-            text_position_name = (xmin, ymin-10)        #左上角名字
-            text_position_distance = (xmin, ymax+25)    #左下角匹配度
-            text_font = cv2.FONT_HERSHEY_SIMPLEX
-            text_size = 0.8
-            text_color = (0,0,255)
-            text_thickness = 2
-            
-            # place text
-            # 放置文字
-            cv2.putText(unknown_image, text_content_name, text_position_name, text_font, text_size, text_color, text_thickness)
-            cv2.putText(unknown_image, text_content_distance, text_position_distance, text_font, text_size, text_color, text_thickness)
+    faces = _match_located_faces(face_key, face_locations, encodings, get_matcher(known_encoding_dict))
+    stats = stats_reina.stats
+    stats.count('images')
+    stats.observe('faces_per_image', len(faces))
+
+    # draw on the same buffer, converted to BGR in place
+    # 在同一块内存上绘制, 原地转换为BGR
+    with stats.stage('draw'):
+        cv2.cvtColor(unknown_image, cv2.COLOR_RGB2BGR, dst=unknown_image)
+        draw_recognition(unknown_image, faces)
     
     # save the picture
     # 保存图片
-    cv2.imwrite(recog_file_path + filename, unknown_image)
+    with stats.stage('write'):
+        cv2.imwrite(recog_file_path + filename, unknown_image)
+    return faces
+
+
+# the gallery and detection config of one worker process, loaded once by the pool initializer
+# 一个工作进程的人脸库与检测配置, 由进程池的初始化函数加载一次
+_worker_matcher = None
+_worker_config = None
+
+# pool initializer: memory-map the binary gallery store once per worker
+# 进程池初始化函数: 每个工作进程只内存映射一次二进制人脸库
+def _init_recognition_worker(store_path: str, tolerance: float, config: dict, use_index: bool, use_stats: bool):
+    global _worker_matcher, _worker_config
+    _worker_matcher = get_matcher(gallery_reina.EncodingStore(store_path), tolerance, use_index)
+    _worker_config = config
+    stats_reina.stats.reset()
+    stats_reina.stats.enabled = use_stats
+
+# recognize one image, drawn and saved to recog_file_path, or only recognized if recog_file_path is None
+# errors are returned instead of raised so that one bad image never stops the folder
+# 识别一张图片, 绘制后保存到recog_file_path, recog_file_path为None时只识别
+# 出错时返回错误而不是抛出, 一张坏图片不会终止整个文件夹
+def _recognize_task(unknown_file_withpath, recog_file_path, known_matcher, config) -> tuple:
+    try:
+        if recog_file_path is None:
+            face_key, face_locations, encodings, _ = _locate_and_encode_file(unknown_file_withpath, config)
+            faces = _match_located_faces(face_key, face_locations, encodings, known_matcher)
+            stats_reina.stats.count('images')
+            stats_reina.stats.observe('faces_per_image', len(faces))
+        else:
+            faces = recognize_an_imge(unknown_file_withpath, known_matcher, recog_file_path, config)
+        return unknown_file_withpath, faces, None
+    except Exception as error:
+        stats_reina.stats.count('errors')
+        return unknown_file_withpath, [], repr(error)
+
+# task of one worker: recognize one image with the gallery of this worker
+# the stats of the worker (None when disabled) are sent back with the result and merged by the parent
+# 一个工作进程的任务: 使用本进程的人脸库识别一张图片
+# 工作进程的统计 (关闭时为None) 随结果发回, 由父进程合并
+def _recognize_worker(task: tuple) -> tuple:
+    unknown_file_withpath, recog_file_path = task
+    result = _recognize_task(unknown_file_withpath, recog_file_path, _worker_matcher, _worker_config)
+    snapshot = stats_reina.stats.collect() if stats_reina.stats.enabled else None
+    return result + (snapshot,)
+
+
+# columns of the csv output, one row per face
+# csv输出的列, 每张人脸一行
+result_csv_columns = ['file', 'xmin', 'xmax', 'ymin', 'ymax', 'name', 'distance']
+
+
+#==============================================================
+# serialize results as strict JSON, the distance of a face matched against an empty gallery (or the runner-up
+# distance of a single person gallery) is inf, which json.dumps would write as the invalid token Infinity
+# 将结果序列化为严格的JSON, 与空人脸库匹配的人脸的距离(或只有一个人的人脸库的次近距离)为inf,
+# json.dumps会将其写为无效的Infinity
+# @parameter:
+# - value:  results (dict, list, tuple, str, int, float, None, numpy scalars)
+#           结果 (dict, list, tuple, str, int, float, None, numpy标量)
+# @return: one line of JSON, non-finite floats are null | str
+#          一行JSON, 非有限的浮点数为null | str
+def result_json(value) -> str:
+    return json.dumps(_finite(value), allow_nan=False)
+
+
+# the value with every non-finite float replaced by None
+# 将所有非有限的浮点数替换为None
+def _finite(value):
+    if isinstance(value, dict):
+        return {key: _finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(item) for item in value]
+    if isinstance(value, (float, numpy.floating)):
+        return float(value) if numpy.isfinite(value) else None
+    if isinstance(value, numpy.integer):
+        return int(value)
+    return value
+
+# open the result stream of recognize_a_folder, returns (stream, writer function, close function)
+# 打开recognize_a_folder的结果流, 返回 (流, 写入函数, 关闭函数)
+def _open_result_stream(output_format, output_file):
+    if output_format not in result_formats:
+        raise ValueError('output_format should be one of ' + str(result_formats))
+    if output_file is None or output_file == '-':
+        stream = sys.stdout
+        close = stream.flush
+    else:
+        stream = open(output_file, 'w', encoding='utf-8', newline='')
+        close = stream.close
+
+    if output_format == 'csv':
+        csv_writer = csv.writer(stream)
+        csv_writer.writerow(result_csv_columns)
+        def write_faces(filename_withpath, faces):
+            for face in faces:
+                # None (a non-finite distance) is written as an empty field, like null in jsonl
+                # None(非有限的距离)写为空字段, 与jsonl中的null对应
+                csv_writer.writerow([filename_withpath] + list(face['box']) + [face['name'], _finite(face['distance'])])
+            stream.flush()
+    else:
+        def write_faces(filename_withpath, faces):
+            for face in faces:
+                stream.write(result_json({'file': filename_withpath, 'box': face['box'], 'name': face['name'],
+                                          'distance': face['distance']}) + '\n')
+            stream.flush()
+    return stream, write_faces, close
 
 
 #==============================================================
@@ -533,40 +1287,256 @@ def recognize_an_imge(unknown_file_withpath, known_encoding_dict, recog_file_pat
 # - unknown_path:           path which stores unknown iamges 
 #                           待识别文件夹的路径
 #                           str (e.g. 'src/unknown/')  
-# - recog_file_path:        path to store recogized image file 
-#                           保存识别后图片文件的路径
+# - recog_file_path:        path to store recogized image file, not used (can be None) when output_format is given
+#                           保存识别后图片文件的路径, 给出output_format时不使用 (可以为None)
 #                           str (e.g. 'src/recognized/')  
 # - known_path:             path which stores known images
 #                           已知人脸图片文件的路径
 #                           str (e.g. 'src/known/')
-# @return: (no return)
-def recognize_a_folder(unknown_path, recog_file_path, known_path):
+# - workers:                number of worker processes, 1 to recognize in this process, None for all cpu cores
+#                           工作进程数, 1则在本进程中识别, None则使用全部cpu核心
+#                           int (default: 1)
+# - chunksize:              number of images sent to a worker at once
+#                           一次发送给一个工作进程的图片数
+#                           int (default: recognition_chunksize)
+# - config:                 detection config, see detection_config (None for the default one)
+#                           检测配置, 见detection_config (None则使用默认配置)
+# - output_format:          None to draw and save every image, or one of result_formats ('jsonl', 'csv') to skip
+#                           drawing and stream one line per face (file, box, name, distance) as each image finishes;
+#                           an infinite distance (empty gallery) is null in jsonl and an empty field in csv
+#                           None则绘制并保存每张图片, 或result_formats中的一个('jsonl', 'csv'): 不绘制,
+#                           每张图片完成时即输出每张人脸一行 (文件, 框, 名字, distance);
+#                           无穷大的距离(空人脸库)在jsonl中为null, 在csv中为空字段
+# - output_file:            file of the streamed results, None or '-' for stdout (the messages then go to stderr)
+#                           结果流的文件, None或'-'则为stdout (此时其他信息输出到stderr)
+# @return:
+# - results:    [(filename with path, number of faces, error or None)] in the order of the sorted filenames
+#               按排序后文件名顺序的[(带路径的文件名, 人脸数, 错误或None)]
+def recognize_a_folder(unknown_path, recog_file_path, known_path, workers=1, chunksize=None, config=None,
+                       output_format=None, output_file=None):
+
+    if output_format is None:
+        return _recognize_a_folder(unknown_path, recog_file_path, known_path, workers, chunksize, config, None)
+
+    stream, write_faces, close = _open_result_stream(output_format, output_file)
+    try:
+        # keep stdout for the results only
+        # stdout只用于输出结果
+        if stream is sys.stdout:
+            with contextlib.redirect_stdout(sys.stderr):
+                return _recognize_a_folder(unknown_path, None, known_path, workers, chunksize, config, write_faces)
+        return _recognize_a_folder(unknown_path, None, known_path, workers, chunksize, config, write_faces)
+    finally:
+        close()
+
+def _recognize_a_folder(unknown_path, recog_file_path, known_path, workers, chunksize, config, write_faces):
     
-    # generate the encoding dictionary
-    # 生成已知人脸编码字典
-    known_image_encodings_directory = gen_sav_encodings_dict(known_path)
+    # generate (or update) the binary gallery store once, before any worker starts
+    # 在所有工作进程启动前, 生成(或更新)一次二进制人脸库
+    known_store = update_encoding_store(known_path)
 
-    # get all filenames in the unknown_path folder 
-    # 得到未知人脸文件夹内所有文件名
-    file_in_raw_list = os.listdir(unknown_path)
+    # get all filenames in the unknown_path folder, sorted so that the results are deterministic
+    # 得到未知人脸文件夹内所有文件名, 排序以保证结果顺序确定
+    file_in_raw_list = sorted(os.listdir(unknown_path))
     
-    # create recog_file_path if not exists
-    # 如果目标文件夹不存在则创建
-    if not os.path.exists(recog_file_path):
+    # create recog_file_path if not exists (nothing is drawn in the render-free mode)
+    # 如果目标文件夹不存在则创建 (不绘制模式下不需要)
+    if recog_file_path is not None and not os.path.exists(recog_file_path):
         os.makedirs(recog_file_path)
 
+    tasks = []
     for raw_file in file_in_raw_list:
 
         # if it's a folder, skip
         # 检测是否为文件夹, 如果是则跳过
-        if os.path.isdir(raw_file):
+        if os.path.isdir(unknown_path + raw_file):
             continue
 
         # check the compatibility of the file format
         # 检测文件格式是否支持, 如果不支持则跳过
         if os.path.splitext(raw_file)[1] not in compatible_formats:
             continue 
-        print("recognizing for" + raw_file)
-        recognize_an_imge(unknown_path + raw_file, known_image_encodings_directory, recog_file_path)
-    
-    print("Complete!")
\ No newline at end of file
+        tasks.append((unknown_path + raw_file, recog_file_path))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = recognition_chunksize
+
+    stats = stats_reina.stats
+    start_time = time.perf_counter()
+    results = []
+
+    # every finished image is reported (and streamed) right away
+    # 每张完成的图片立刻报告 (并输出)
+    def finish(result):
+        unknown_file_withpath, faces, error = result[:3]
+        if len(result) > 3:
+            stats.merge(result[3])
+        results.append((unknown_file_withpath, len(faces), error))
+        if error is not None:
+            print("failed to recognize " + unknown_file_withpath + ": " + error)
+        elif write_faces is not None:
+            write_faces(unknown_file_withpath, faces)
+        if len(results) % progress_interval == 0 or len(results) == len(tasks):
+            print("recognized {}/{}".format(len(results), len(tasks)))
+
+    if workers <= 1:
+        # the gallery is turned into one matrix once for the whole folder
+        # 整个文件夹只需将人脸库矩阵化一次
+        known_image_encodings_directory = get_matcher(known_store)
+        for unknown_file_withpath, recog_path in tasks:
+            print("recognizing for " + unknown_file_withpath)
+            finish(_recognize_task(unknown_file_withpath, recog_path, known_image_encodings_directory, config))
+    else:
+        # every worker loads the gallery once in the initializer, tasks only carry filenames
+        # imap keeps the order of the tasks
+        # 每个工作进程在初始化时加载一次人脸库, 任务中只有文件名
+        # imap保持任务的顺序
+        # forked workers share the models loaded once by the parent
+        # fork出的工作进程共享父进程加载一次的模型
+        if multiprocessing.get_start_method() == 'fork':
+            warm_up(config)
+        with multiprocessing.Pool(workers, initializer=_init_recognition_worker,
+                                  initargs=(json_path, fault_tolerance, config, use_ann_index,
+                                            stats.enabled)) as pool:
+            for result in pool.imap(_recognize_worker, tasks, chunksize=chunksize):
+                finish(result)
+
+    # throughput of the whole folder
+    # 整个文件夹的吞吐量
+    elapsed = time.perf_counter() - start_time
+    print("Complete! {} images in {:.2f}s, {:.2f} images/s with {} worker(s)".format(
+        len(results), elapsed, len(results) / elapsed if elapsed > 0 else 0.0, max(workers, 1)))
+
+    # where the time went, only when stats_reina.stats is enabled
+    # 时间花在了哪里, 只在stats_reina.stats开启时
+    if stats.enabled:
+        stats.gauge('gallery_size', len(known_store))
+        stats.gauge('gallery_version', known_store.version)
+        stats.gauge('images_per_second', len(results) / elapsed if elapsed > 0 else 0.0)
+        print(stats.summary())
+    return results
+
+
+###------------------批量识别模块 batch recognition module------------------###
+
+#==============================================================
+# recognize any number of images and yield a structured result for each, in the input order
+# faces of batch_size images are matched against the gallery in one operation
+# nothing touches the filesystem except decoding the given paths and, if output_path is given, the annotated images
+# 识别任意多张图片, 按输入顺序逐张返回结构化的结果
+# batch_size张图片的人脸与人脸库一次性匹配
+# 除了解码给出的路径, 以及给出output_path时写入的绘制后图片, 不读写文件系统
+
+# @parameter:
+# - images:                 iterable of image files with path (str) or decoded RGB images (ndarray), can be a generator
+#                           带路径的图片文件名(str)或已解码的RGB图片(ndarray)的可迭代对象, 可以是生成器
+# - known_encoding_dict:    known encoding dictionary, EncodingStore, FaceMatcher or TemplateMatcher
+#                           已知的编码字典, EncodingStore, FaceMatcher或TemplateMatcher
+# - return_encodings:       add the 128-d 'encoding' of every face to its result
+#                           在每张人脸的结果中加入128维的'encoding'
+# - batch_size:             number of images matched together (default: recognition_batch_size)
+#                           一起匹配的图片数 (默认: recognition_batch_size)
+# - config:                 detection config, see detection_config (None for the default one)
+#                           检测配置, 见detection_config (None则使用默认配置)
+# - output_path:            directory to write the annotated images to, None to write nothing
+#                           写入绘制后图片的目录, None则不写入
+# @return: generator of one dictionary per image
+#          每张图片一个字典的生成器
+#   {'index': int, 'source': str or None (for arrays), 'error': str or None,
+#    'faces': [{'box': [xmin, xmax, ymin, ymax], 'name': str, 'distance': float, 'nearest': str,
+#               'runner_up': str, 'runner_up_distance': float, ('encoding': ndarray, not for low_quality_name)}],
+#    'timings': {'decode': float, 'detect': float, 'encode': float, 'match': float}} (seconds)
+#   'match' is the share of this image in the batched matching
+#   'match'为这张图片在批量匹配中分摊的时间
+def recognize_images(images, known_encoding_dict, return_encodings=False, batch_size=None, config=None,
+                     output_path=None):
+
+    # the gallery is turned into one matrix once for all images
+    # 所有图片只需将人脸库矩阵化一次
+    known_matcher = get_matcher(known_encoding_dict)
+    if batch_size is None:
+        batch_size = recognition_batch_size
+    if output_path is not None and not os.path.exists(output_path):
+        os.makedirs(output_path)
+
+    batch = []
+    for index, source in enumerate(images):
+        batch.append(_locate_and_encode(index, source, config, output_path is not None))
+        if len(batch) >= batch_size:
+            yield from _match_batch(batch, known_matcher, return_encodings, output_path)
+            batch = []
+    if len(batch) != 0:
+        yield from _match_batch(batch, known_matcher, return_encodings, output_path)
+
+
+# decode, detect and encode one image, errors are kept in the result instead of stopping the batch
+# returns the result without matches, the face locations, the encodings, and the image if it will be drawn
+# 解码, 检测并编码一张图片, 出错时记录在结果中而不是终止整批
+# 返回没有匹配信息的结果, 人脸位置, 编码, 以及需要绘制时的图片
+def _locate_and_encode(index, source, config, keep_image):
+    result = {
+        'index': index,
+        'source': source if isinstance(source, str) else None,
+        'error': None,
+        'faces': [],
+        'timings': {'decode': 0.0, 'detect': 0.0, 'encode': 0.0, 'match': 0.0},
+    }
+    timings = result['timings']
+    image = None
+    face_locations = []
+    encodings = []
+    try:
+        start_time = time.perf_counter()
+        image = face_recognition.load_image_file(source) if isinstance(source, str) else numpy.asarray(source)
+        timings['decode'] = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        face_locations = detect_faces(image, config)
+        timings['detect'] = time.perf_counter() - start_time
+
+        # 'encode' includes the quality gate
+        # 'encode'包括质量检查
+        start_time = time.perf_counter()
+        encodings = encode_faces(image, face_locations, config)
+        timings['encode'] = time.perf_counter() - start_time
+    except Exception as error:
+        result['error'] = repr(error)
+        face_locations = []
+        encodings = []
+    return result, face_locations, encodings, image if keep_image else None
+
+
+# match the faces of a whole batch in one operation, then fill and yield the results in order
+# 一次匹配整批图片的人脸, 然后按顺序填充并返回结果
+def _match_batch(batch, known_matcher, return_encodings, output_path):
+    all_encodings = [encoding for _, _, encodings, _ in batch for encoding in encodings]
+
+    start_time = time.perf_counter()
+    matches = match_encodings(known_matcher, all_encodings)
+    match_share = (time.perf_counter() - start_time) / len(batch)
+
+    position = 0
+    for result, face_locations, encodings, image in batch:
+        for face, encoding in zip(face_locations, encodings):
+            y1, x1, y2, x2 = face
+            match = matches[position]
+            position += 1
+            match['box'] = [min(x1,x2), max(x1,x2), min(y1,y2), max(y1,y2)]
+            if return_encodings and encoding is not None:
+                match['encoding'] = encoding
+            result['faces'].append(match)
+        result['timings']['match'] = match_share
+
+        if output_path is not None and image is not None and result['error'] is None:
+            if result['source'] is not None:
+                filename = os.path.split(result['source'])[1]
+            else:
+                filename = 'image{:0>6d}.jpg'.format(result['index'])
+            # the input array is never changed, the drawing is on a BGR copy
+            # 不修改输入的数组, 在BGR副本上绘制
+            annotated = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+            draw_recognition(annotated, result['faces'])
+            cv2.imwrite(os.path.join(output_path, filename), annotated)
+        yield result
@@ -1,114 +1,168 @@
 '''
+- scan_folder: 用os.scandir一次遍历文件夹, 得到每个文件的大小与修改时间 (可选内容哈希)
 - parse_modate: 解析文件修改时间
-- save_dict: 将可以序列化的字典保存到文件中
-- find_out_change: 根据新旧字典, 生成并返回'变化字典', 描述文件夹内容的增(改)删
+- file_hash: 计算文件内容的哈希
+- load_state: 读取保存的文件夹状态, 兼容旧的`文件名:修改时间`格式
+- save_dict: 将可以序列化的字典原子地保存到文件中
+- find_change: 根据新旧状态, 用集合运算生成'变化字典', 描述文件夹内容的增(改)删与重命名
+- get_change: 扫描文件夹并与保存的状态比较, 返回'变化字典'与新状态 (不保存)
+- get_change_and_renew: 扫描文件夹, 返回'变化字典'并保存新状态
 '''
 
 import os
 import json
+import hashlib
 
-def parse_modate(target_folder_path):
-    
-    # 得到文件夹中的所有文件和子文件夹
-    file_list_with_dir = os.listdir(target_folder_path)
-    
-    # 过滤掉子文件夹, 留下文件
-    file_list_without_dir = []
-    for document in file_list_with_dir:
-        if not os.path.isdir(document):
-            file_list_without_dir.append(document)
-
-    # 初始化`文件名:修改时间`字典
-    name__modate = {}
-
-    # 遍历填充字典
-    for file in file_list_without_dir:
-        modate = os.path.getmtime(target_folder_path + file)
-        name__modate[file] = modate
+# 计算哈希时每次读取的字节数
+hash_block_size = 1 << 20
 
-    # 返回`文件名:修改时间`字典
-    return name__modate
+# 递归扫描, 键为以'/'分隔的相对路径(例: 'alice/img1.jpg'), 跳过以'.'开头的子文件夹
+# 返回`文件名:{'size': 大小, 'mtime': 修改时间, 'hash': 内容哈希或None}`字典
+def scan_folder(target_folder_path, recursive=False, use_hash=False, prefix=''):
+
+    # 初始化`文件名:状态`字典
+    name__state = {}
+
+    # scandir一次返回文件名与类型, 不需要对每个文件再调用isdir
+    with os.scandir(target_folder_path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                if recursive and not entry.name.startswith('.'):
+                    # 子文件夹中的文件, 键为相对路径
+                    name__state.update(scan_folder(entry.path, recursive, use_hash, prefix + entry.name + '/'))
+                continue
+
+            # 一次stat同时得到大小与修改时间
+            stat = entry.stat()
+            name__state[prefix + entry.name] = {
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'hash': file_hash(entry.path) if use_hash else None,
+            }
+
+    # 返回`文件名:状态`字典
+    return name__state
+
+# recursive为真时, 包括子文件夹中的文件, 键为以'/'分隔的相对路径(例: 'alice/img1.jpg'), 跳过以'.'开头的子文件夹
+def parse_modate(target_folder_path, recursive=False):
 
-# 将字典写入文件
+    # 返回`文件名:修改时间`字典
+    return {name: state['mtime'] for name, state in scan_folder(target_folder_path, recursive).items()}
+
+# 分块读取文件, 返回内容的sha1
+def file_hash(file_with_path):
+    digest = hashlib.sha1()
+    with open(file_with_path, 'rb') as target_file:
+        for block in iter(lambda: target_file.read(hash_block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# 读取保存的状态, 文件不存在, 为空或损坏时返回空字典
+# 旧格式`文件名:修改时间`被转换为`文件名:{'size': None, 'mtime': 修改时间, 'hash': None}`
+def load_state(json_file_with_path):
+    if not os.path.exists(json_file_with_path):
+        return {}
+    try:
+        with open(json_file_with_path, 'r', encoding="utf-8") as json_file:
+            old_state = json.load(json_file)
+    except ValueError:
+        return {}
+    if not isinstance(old_state, dict):
+        return {}
+
+    name__state = {}
+    for name, state in old_state.items():
+        if isinstance(state, dict):
+            name__state[name] = state
+        else:
+            name__state[name] = {'size': None, 'mtime': state, 'hash': None}
+    return name__state
+
+# 将字典原子地写入文件: 先写临时文件, 再替换, 崩溃时不会留下写了一半的文件
 def save_dict(target_dict, save_filename_with_path):
     # 调用json模块, 将字典生成特定的json字符串
     js_dict = json.dumps(target_dict)
-    # 打开要写入的文件
-    file_modate = open(save_filename_with_path , 'w')
-    # 将json对象写入文件
-    file_modate.write(js_dict)
-    # 关闭文件
-    file_modate.close()
-
-def get_change_and_renew(target_folder_path, json_file_with_path):
-    # 如果旧字典不存在
-    if not os.path.exists(json_file_with_path):
-        # 新建空字典文件
-        with open(json_file_with_path, 'w', encoding="utf-8") as json_file:
-            pass
-    # 打开保存旧字典的json文件
-    with open(json_file_with_path, 'r', encoding="utf-8") as json_file:
-        old_name__modate_s = json_file.read()
-    # 获取旧字典
-    old_name__modate = json.loads(old_name__modate_s)
-    # 获取新字典
-    new_name__modate = parse_modate(target_folder_path)
-    # 保存新字典
-    save_dict(new_name__modate, json_file_with_path)
-
-    # 定义描述变化字典, 包含'new', 'deleted'两个键, 每个键由对应状态的文件名组成的列表作为值
-    change = {'new': [], 'deleted': []}
-
-    #如果旧字典不为空
-    if old_name__modate != None:
-
-        # 获取'new'的值
-        for mk_new_name__modate in new_name__modate.keys():
-            
-            #设置标志位
-            is_new = True
-            
-            # 如果新字典的一个键在旧字典的键中存在
-            if mk_new_name__modate in old_name__modate.keys():
-                # 并且相同键对应的值相同
-                if new_name__modate[mk_new_name__modate] == old_name__modate[mk_new_name__modate]:
-                    # 不是新的键值对
-                    is_new = False
-
-            # 如果是新的键值对
-            if is_new:
-                # 加入'变化'字典中的'new'列表中
-                change['new'].append(mk_new_name__modate)
-
-        # 获取'deleted'的值
-
-        is_deleted = False
-        for mk_old_name__modate in old_name__modate.keys():
-            # 如果旧键在新字典中找不到
-            if mk_old_name__modate not in new_name__modate.keys():
-                    # 被删除
-                    is_deleted = True
-                
-            # 如果是新的键值对
-            if is_deleted:
-                # 加入'变化'字典中的'deleted'列表中
-                change['deleted'].append(mk_old_name__modate)
-
-
-        is_changed = False
-        if is_new or is_deleted:
-            is_changed = True
-    
-    # 如果旧字典为空
-    else:
-        # 变化判断为真
-        is_changed = True
-        # 把新字典中所有键值对加入'new'列表中
-        for mk_new_name__modate in new_name__modate.keys():
-            change['new'].append(mk_new_name__modate)
-
-    # 返回变化判断, 变化字典 eg. True, {'new':[file3, file4], 'deleted':[file1, file2]}
+    # 写入临时文件并落盘
+    temp_filename = save_filename_with_path + '.tmp'
+    with open(temp_filename, 'w', encoding="utf-8") as temp_file:
+        temp_file.write(js_dict)
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+    # 替换旧文件
+    os.replace(temp_filename, save_filename_with_path)
+
+# 用集合运算比较新旧状态, 返回变化判断与'变化字典'
+# - 大小与修改时间都相同的文件没有变化
+# - use_hash为真时, 修改时间变了但内容哈希相同的文件(例如只被touch)没有变化, 哈希相同的删除与新增文件视为重命名
+# new_state中缺少的哈希会被补上, 以便之后保存
+def find_change(old_state, new_state, target_folder_path='', use_hash=False):
+
+    # 定义描述变化字典, 'new'与'deleted'为文件名列表, 'renamed'为[旧文件名, 新文件名]列表
+    change = {'new': [], 'deleted': [], 'renamed': []}
+
+    old_names = set(old_state)
+    new_names = set(new_state)
+    deleted = old_names - new_names
+    added = new_names - old_names
+
+    # 两边都有的文件: 大小与修改时间不同时才可能被修改
+    for name in old_names & new_names:
+        old, new = old_state[name], new_state[name]
+        is_same_stat = old['mtime'] == new['mtime'] and old['size'] in (None, new['size'])
+        if use_hash and new['hash'] is None:
+            if is_same_stat and old['hash'] is not None:
+                new['hash'] = old['hash']
+            else:
+                new['hash'] = file_hash(os.path.join(target_folder_path, name))
+        if is_same_stat:
+            continue
+        if use_hash and old['hash'] is not None and old['hash'] == new['hash']:
+            continue
+        change['new'].append(name)
+
+    # 新增的文件
+    if use_hash:
+        for name in added:
+            if new_state[name]['hash'] is None:
+                new_state[name]['hash'] = file_hash(os.path.join(target_folder_path, name))
+
+        # 哈希相同的删除与新增文件配对为重命名
+        hash__deleted = {}
+        for name in sorted(deleted):
+            if old_state[name]['hash'] is not None:
+                hash__deleted.setdefault(old_state[name]['hash'], []).append(name)
+        for name in sorted(added):
+            candidates = hash__deleted.get(new_state[name]['hash'])
+            if candidates:
+                old_name = candidates.pop(0)
+                change['renamed'].append([old_name, name])
+                deleted.discard(old_name)
+                added.discard(name)
+
+    change['new'].extend(added)
+    change['deleted'].extend(deleted)
+    change['new'].sort()
+    change['deleted'].sort()
+
+    is_changed = len(change['new']) != 0 or len(change['deleted']) != 0 or len(change['renamed']) != 0
+
+    # 返回变化判断, 变化字典 eg. True, {'new':[file3, file4], 'deleted':[file1], 'renamed':[[file2, file5]]}
     return is_changed, change
 
-
-
+# 扫描文件夹并与保存的状态比较, 不保存新状态
+# 调用者处理完变化后再用save_dict保存新状态, 中途崩溃时下次运行会重新得到这些变化
+def get_change(target_folder_path, json_file_with_path, recursive=False, use_hash=False):
+    # 获取旧状态
+    old_state = load_state(json_file_with_path)
+    # 获取新状态 (哈希只为可能变化的文件计算)
+    new_state = scan_folder(target_folder_path, recursive)
+    # 比较
+    is_changed, change = find_change(old_state, new_state, target_folder_path, use_hash)
+    return is_changed, change, new_state
+
+def get_change_and_renew(target_folder_path, json_file_with_path, recursive=False, use_hash=False):
+    is_changed, change, new_state = get_change(target_folder_path, json_file_with_path, recursive, use_hash)
+    # 保存新状态
+    save_dict(new_state, json_file_with_path)
+    # 返回变化判断, 变化字典
+    return is_changed, change
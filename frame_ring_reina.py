@@ -0,0 +1,180 @@
+'''
+@author Reina
+@desc 进程间共享内存的帧环形缓冲区
+描述 :
+检测与编码移到工作进程后, 在进程之间pickle整幅图片的开销会超过工作进程带来的收益
+FrameRing把帧放在一块multiprocessing.shared_memory中, 进程之间只传递槽号与形状,
+工作进程直接读取父进程写入的帧, 内存的上限为槽数 x 每槽字节数
+- 拥有者(创建它的进程)从空闲列表取得槽, 写入帧(或直接解码/捕获到槽中), 处理完成后释放槽
+- 工作进程通过pickle(或fork继承)得到FrameRing, 连接到同一块共享内存, 只读写帧, 不管理槽
+- FrameRing类: 共享内存中固定数量, 固定容量的帧槽
+
+description:
+ring buffer of frames in shared memory between processes
+once detection and encoding run in worker processes, pickling full-resolution images between processes
+costs more than the workers save
+FrameRing keeps the frames in one multiprocessing.shared_memory block, only slot numbers and shapes cross processes,
+workers read the frames written by the parent in place, the memory is bounded by slots x bytes per slot
+- the owner (the process which creates it) takes slots from the free list, writes frames (or decodes / captures
+  straight into a slot), and releases the slots when they are done
+- workers get the FrameRing pickled (or inherited by fork), attach to the same shared memory,
+  they only read and write frames and never manage slots
+- class: FrameRing: fixed number of fixed capacity frame slots in shared memory
+'''
+
+#coding=utf-8
+
+import sys
+import queue
+import threading
+import numpy
+from multiprocessing import shared_memory, resource_tracker
+
+
+###------------------环形缓冲区模块 ring buffer module------------------###
+
+#==============================================================
+# fixed number of fixed capacity frame slots in one shared memory block
+# a frame is addressed by its meta (slot, shape, dtype), which is all that crosses processes
+# 一块共享内存中固定数量, 固定容量的帧槽
+# 帧由其描述(槽号, 形状, dtype)定位, 只有描述在进程之间传递
+# @parameter:
+# - slots:      number of slots, the max number of frames alive at once
+#               槽数, 同时存在的帧的最大数量
+# - slot_bytes: capacity of one slot, e.g. frame.nbytes of the largest frame
+#               一个槽的容量, 例如最大帧的frame.nbytes
+class FrameRing:
+
+    def __init__(self, slots: int, slot_bytes: int):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, slots * slot_bytes))
+        self.is_owner = True
+
+        # free slots, only the owner hands them out; thread safe for the stages of a pipeline
+        # 空闲槽, 只有拥有者分配它们; 对流水线的各个阶段线程安全
+        self.free = queue.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+
+    # workers attach to the shared memory by its name, the free list stays with the owner
+    # 工作进程按名字连接到共享内存, 空闲列表留在拥有者中
+    def __getstate__(self):
+        return {'name': self.shm.name, 'slots': self.slots, 'slot_bytes': self.slot_bytes}
+
+    def __setstate__(self, state):
+        self.slots = state['slots']
+        self.slot_bytes = state['slot_bytes']
+        self.shm = _attach(state['name'])
+        self.is_owner = False
+        self.free = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    #==============================================================
+    # take a free slot (owner only)
+    # 取得一个空闲槽 (仅拥有者)
+    # @parameter:
+    # - block:      wait until a slot is released
+    #               等待直到有槽被释放
+    # - timeout:    max seconds to wait, None to wait forever
+    #               最多等待的秒数, None则一直等待
+    # @return:
+    # - slot:   int, or None if no slot is free
+    #           int, 没有空闲槽时为None
+    def acquire(self, block: bool = True, timeout: float = None):
+        try:
+            return self.free.get(block, timeout)
+        except queue.Empty:
+            return None
+
+    #==============================================================
+    # give a slot back (owner only), its frame must not be used any more
+    # 归还一个槽 (仅拥有者), 之后不能再使用其中的帧
+    # @parameter:
+    # - slot:   int, or a meta | (slot, shape, dtype)
+    #           int, 或帧描述 | (槽号, 形状, dtype)
+    # @return: (no return)
+    def release(self, slot):
+        self.free.put(slot[0] if isinstance(slot, tuple) else slot)
+
+    #==============================================================
+    # writable array in a slot, to decode or capture straight into it
+    # (e.g. video_capture.read(ring.array(slot, shape)))
+    # 槽中的可写数组, 用于直接解码或捕获到槽中 (例: video_capture.read(ring.array(slot, shape)))
+    # @parameter:
+    # - slot:   int
+    # - shape:  shape of the frame | tuple
+    #           帧的形状 | tuple
+    # - dtype:  numpy dtype (default: uint8)
+    # @return: ndarray on the shared memory
+    #          共享内存上的ndarray
+    def array(self, slot: int, shape: tuple, dtype=numpy.uint8) -> numpy.ndarray:
+        dtype = numpy.dtype(dtype)
+        if int(numpy.prod(shape)) * dtype.itemsize > self.slot_bytes:
+            raise ValueError('frame of shape {} does not fit a slot of {} bytes'.format(shape, self.slot_bytes))
+        return numpy.ndarray(shape, dtype, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+
+    #==============================================================
+    # copy a frame into a slot
+    # 将一帧复制到槽中
+    # @parameter:
+    # - slot:   int
+    # - frame:  ndarray
+    # @return:
+    # - meta:   (slot, shape, dtype name), what is sent to the workers
+    #           (槽号, 形状, dtype名), 发送给工作进程的内容
+    def write(self, slot: int, frame: numpy.ndarray) -> tuple:
+        self.array(slot, frame.shape, frame.dtype)[...] = frame
+        return slot, frame.shape, frame.dtype.name
+
+    #==============================================================
+    # the frame described by a meta, in place (no copy)
+    # 帧描述对应的帧, 原地访问 (不复制)
+    # @parameter:
+    # - meta:   (slot, shape, dtype name), return value of write
+    #           (槽号, 形状, dtype名), write的返回值
+    # @return: ndarray on the shared memory
+    #          共享内存上的ndarray
+    def frame(self, meta: tuple) -> numpy.ndarray:
+        slot, shape, dtype = meta
+        return self.array(slot, shape, dtype)
+
+    #==============================================================
+    # detach from the shared memory, the owner also frees it
+    # arrays returned by array() and frame() must not be used afterwards
+    # 断开与共享内存的连接, 拥有者同时释放它
+    # 之后不能再使用array()与frame()返回的数组
+    # @return: (no return)
+    def close(self):
+        if self.shm is None:
+            return
+        self.shm.close()
+        if self.is_owner:
+            self.shm.unlink()
+        self.shm = None
+
+
+# serializes the replacement of resource_tracker.register in _attach
+# 串行化_attach中对resource_tracker.register的替换
+_attach_lock = threading.Lock()
+
+# attach to the shared memory of the owner without registering it with the resource tracker of this process:
+# only the owner unlinks it, a worker whose tracker is not the owner's would otherwise unlink (or warn about) the
+# segment when it exits; Python 3.13 has track=False for this, before 3.13 the registration is skipped by hand
+# 连接到拥有者的共享内存, 但不在本进程的资源跟踪器中登记: 只有拥有者释放它, 否则跟踪器与拥有者不同的
+# 工作进程退出时会释放这块共享内存 (或对其发出警告); Python 3.13起有track=False, 3.13之前手动跳过登记
+def _attach(name: str) -> shared_memory.SharedMemory:
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    with _attach_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda *args: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
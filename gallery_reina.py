@@ -0,0 +1,853 @@
+'''
+@author Reina
+@desc 已知人脸库('编码字典')的矩阵化表示与批量匹配
+描述 :
+- FaceMatcher类: 将'编码字典'保存为一个连续的(N x 128)矩阵, 一次性批量匹配多张人脸
+- TemplateMatcher类: 每个人有多张登记照片时, 先与每人的模板(质心)比较, 再只与候选人的所有样本比较
+- build_matcher函数: 根据名字(每人一张还是多张)选择FaceMatcher或TemplateMatcher
+- uses_templates函数: build_matcher是否会选择TemplateMatcher
+- QuantizedSearcher类: int8标量量化的第一遍搜索, 候选行再由FaceMatcher用float精确重排
+- EncodingStore类: 二进制的人脸库文件, float32矩阵(可内存映射)加名字索引, 支持追加, 标记删除, 重命名和压缩
+- matrix_filename函数: 人脸库某一代的矩阵文件名
+
+description:
+gallery (the known 'encoding dictionary') as a matrix and batched matching
+- class: FaceMatcher: keep the encoding dictionary as one contiguous (N x 128) matrix, match many faces at once
+- class: TemplateMatcher: for several enrollment images per person, compare with the templates (centroids) of
+                          every person first, then only with all samples of the shortlisted people
+- function: build_matcher: choose FaceMatcher or TemplateMatcher according to the names (one or many images per person)
+- function: uses_templates: whether build_matcher chooses TemplateMatcher
+- class: QuantizedSearcher: int8 scalar quantized first pass, FaceMatcher re-ranks the candidates exactly in float
+- class: EncodingStore: binary gallery files, a memory-mappable float32 matrix plus a name index,
+                        supports append, tombstone-delete, rename and compaction
+- function: matrix_filename: filename of the matrix of a store generation
+'''
+
+#coding=utf-8
+
+import os
+import json
+import uuid
+import numpy
+
+
+###------------------预定义变量 predefinition------------------###
+
+# default face rocognition tolerance (same as facekit_reina.fault_tolerance)
+# 默认人脸识别容错率 (与facekit_reina.fault_tolerance相同)
+default_tolerance = 0.5
+
+# dimension of a face encoding
+# 人脸编码的维数
+encoding_dim = 128
+
+# name for the faces which can not be matched
+# 无法匹配的人脸的名字
+unknown_name = 'unknown'
+
+# filenames of the binary gallery: float32 matrix and name index
+# a compaction writes the matrix of generation g to 'encoding.g.f32', the index names the current one
+# 二进制人脸库的文件名: float32矩阵与名字索引
+# 压缩将第g代的矩阵写入'encoding.g.f32', 索引中记录当前的矩阵文件
+store_matrix = 'encoding.f32'
+store_index = 'encoding_index.json'
+
+# compact the store when this ratio of the rows are deleted
+# 被删除的行超过这个比例时压缩人脸库文件
+compact_ratio = 0.25
+
+# separator between the person and the image in a store key (e.g. 'alice/img1' belongs to 'alice')
+# 人脸库键中人与图片之间的分隔符 (例: 'alice/img1'属于'alice')
+key_separator = '/'
+
+# templates of one person: 1 for the centroid of all samples, more for k-means centroids of the samples
+# 一个人的模板数: 1则为所有样本的质心, 更多则为样本的k-means质心
+templates_per_person = 1
+
+# number of people compared with all their samples after the template stage
+# 模板阶段之后, 与其所有样本比较的候选人数
+default_shortlist = 8
+
+# number of candidates of the int8 first pass re-ranked exactly in float
+# int8第一遍搜索中用float精确重排的候选数
+default_rerank = 32
+
+# rows per block when quantizing and scanning the int8 codes (bounds the temporary memory)
+# 量化与扫描int8编码时每块的行数 (限制临时内存)
+quantize_block = 65536
+
+
+###------------------工具模块 utility module------------------###
+
+#==============================================================
+# the person a store key belongs to: 'alice/img1' -> 'alice', 'alice' -> 'alice'
+# 人脸库键所属的人: 'alice/img1' -> 'alice', 'alice' -> 'alice'
+# @parameter:
+# - key:    store key | str
+#           人脸库键 | str
+# @return: name of the person | str
+def identity_of(key: str) -> str:
+    return key.split(key_separator, 1)[0]
+
+
+#==============================================================
+# k-means centroids of the samples
+# 样本的k-means质心
+# @parameter:
+# - samples:    ndarray (N x 128)
+# - k:          number of centroids (at most N)
+#               质心数 (最多为N)
+# - iterations: number of iterations
+#               迭代次数
+# - seed:       random seed, the same seed gives the same centroids
+#               随机种子, 相同的种子得到相同的质心
+# @return:
+# - centroids:  ndarray (k x 128), same dtype as samples
+#               ndarray (k x 128), 与samples的数据类型相同
+def kmeans(samples: numpy.ndarray, k: int, iterations: int = 10, seed: int = 0) -> numpy.ndarray:
+    random = numpy.random.default_rng(seed)
+    sample_count = len(samples)
+    k = max(1, min(k, sample_count))
+    centroids = samples[random.choice(sample_count, k, replace=False)].copy()
+
+    for _ in range(iterations):
+        squared = (numpy.einsum('ij,ij->i', samples, samples)[:, None]
+                   + numpy.einsum('ij,ij->i', centroids, centroids)[None, :]
+                   - 2.0 * (samples @ centroids.T))
+        labels = numpy.argmin(squared, axis=1)
+        counts = numpy.bincount(labels, minlength=k)
+
+        # sum of the samples of every centroid: sort by centroid, then add up each run
+        # 每个质心的样本之和: 按质心排序, 再把每一段加起来
+        order = numpy.argsort(labels, kind='stable')
+        sorted_labels = labels[order]
+        run_starts = numpy.flatnonzero(numpy.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+        sums = numpy.zeros_like(centroids)
+        sums[sorted_labels[run_starts]] = numpy.add.reduceat(samples[order], run_starts, axis=0)
+
+        # an empty centroid takes a random sample again
+        # 空的质心重新随机取一个样本
+        is_empty = counts == 0
+        centroids[~is_empty] = sums[~is_empty] / counts[~is_empty, None]
+        if is_empty.any():
+            centroids[is_empty] = samples[random.choice(sample_count, int(is_empty.sum()))]
+    return centroids
+
+
+#==============================================================
+# whether build_matcher gives a TemplateMatcher for the keys (some person has several images)
+# build_matcher对这些键是否得到TemplateMatcher (有人有多张图片)
+# @parameter:
+# - keys:   store keys or names of every row
+#           每一行的人脸库键或名字
+# @return: bool
+def uses_templates(keys: list) -> bool:
+    names = [identity_of(key) for key in keys]
+    return len(set(names)) != len(names)
+
+
+#==============================================================
+# choose the matcher for the keys: FaceMatcher if every person has one image, else TemplateMatcher
+# 根据键选择匹配器: 每个人只有一张图片时为FaceMatcher, 否则为TemplateMatcher
+# @parameter:
+# - keys:       store keys or names of every row, 'person/image' for people with several images
+#               每一行的人脸库键或名字, 多张图片的人为'person/image'
+# - encodings:  ndarray (N x 128)
+# - tolerance:  face rocognition tolerance
+#               人脸识别容错率
+# - searcher:   ann searcher on these rows, only used by FaceMatcher
+#               这些行上的ann搜索器, 只用于FaceMatcher
+# @return: FaceMatcher or TemplateMatcher
+def build_matcher(keys: list, encodings: numpy.ndarray, tolerance: float = default_tolerance, searcher=None):
+    names = [identity_of(key) for key in keys]
+    if not uses_templates(names):
+        return FaceMatcher.from_arrays(names, encodings, tolerance, searcher)
+    return TemplateMatcher(names, encodings, tolerance)
+
+
+###------------------匹配模块 match module------------------###
+
+#==============================================================
+# the whole gallery as one matrix, matches every face against all known people in one operation
+# 将整个人脸库作为一个矩阵, 一次运算将所有人脸与所有已知的人进行匹配
+# @parameter:
+# - known_encoding_dict:    known encoding dictionary | {name -> str: encoding -> ndarray}
+#                           已知的编码字典 | {name -> str: encoding -> ndarray}
+# - tolerance:              face rocognition tolerance, distance larger than it will be 'unknown'
+#                           人脸识别容错率, 距离大于它则为'unknown'
+class FaceMatcher:
+
+    # version of the gallery and matching settings, set when built from a store, used as a cache key
+    # 人脸库与匹配设置的版本, 由人脸库生成时设置, 用作缓存的键
+    gallery_version = None
+
+    def __init__(self, known_encoding_dict: dict, tolerance: float = default_tolerance):
+        names = list(known_encoding_dict.keys())
+        if len(names) != 0:
+            encodings = numpy.array(list(known_encoding_dict.values()), dtype=numpy.float64)
+        else:
+            encodings = numpy.empty((0, encoding_dim), dtype=numpy.float64)
+        self._set_gallery(names, encodings, tolerance)
+        self.searcher = None
+
+    #==============================================================
+    # build the matcher directly from names and an encoding matrix (no dictionary needed)
+    # 直接使用名字与编码矩阵生成匹配器 (不需要'编码字典')
+    # @parameter:
+    # - names:      name of every row | list
+    #               每一行的名字 | list
+    # - encodings:  encoding matrix, its dtype is kept (float32 or float64) | ndarray (N x 128)
+    #               编码矩阵, 保持其数据类型 (float32或float64) | ndarray (N x 128)
+    # - tolerance:  face rocognition tolerance
+    #               人脸识别容错率
+    # - searcher:   approximate candidate search on these rows, None to scan the whole gallery
+    #               | ann_index_reina.IVFSearcher
+    #               在这些行上的近似候选搜索, None则扫描整个人脸库 | ann_index_reina.IVFSearcher
+    # @return:
+    # - matcher:    FaceMatcher
+    @classmethod
+    def from_arrays(cls, names: list, encodings: numpy.ndarray, tolerance: float = default_tolerance, searcher=None):
+        matcher = cls.__new__(cls)
+        matcher._set_gallery(names, encodings, tolerance)
+        matcher.searcher = searcher
+        return matcher
+
+    #==============================================================
+    # build the matcher from a binary gallery store
+    # 根据二进制人脸库生成匹配器
+    # @parameter:
+    # - store:      opened binary gallery | EncodingStore
+    #               已打开的二进制人脸库 | EncodingStore
+    # - tolerance:  face rocognition tolerance
+    #               人脸识别容错率
+    # - index:      ann index synced with the store, None to scan the whole gallery | ann_index_reina.IVFIndex
+    #               与人脸库同步的ann索引, None则扫描整个人脸库 | ann_index_reina.IVFIndex
+    # - n_probe:    number of lists searched for each face when index is given
+    #               给出index时, 每张人脸搜索的列表数
+    # @return:
+    # - matcher:    FaceMatcher
+    @classmethod
+    def from_store(cls, store, tolerance: float = default_tolerance, index=None, n_probe: int = 8):
+        keys, encodings = store.alive()
+        searcher = index.searcher(store, n_probe) if index is not None else None
+        return cls.from_arrays([identity_of(key) for key in keys], encodings, tolerance, searcher)
+
+    def _set_gallery(self, names, encodings, tolerance):
+        self.tolerance = tolerance
+
+        # names and encodings keep the same order: row i of encodings belongs to names[i]
+        # the names are one array, not one python object per person
+        # names与encodings顺序一致: encodings的第i行属于names[i]
+        # 名字保存在一个数组中, 而不是每人一个python对象
+        self.names = numpy.array(names) if len(names) != 0 else numpy.empty(0, dtype=str)
+        self.encodings = numpy.ascontiguousarray(encodings).reshape(-1, encoding_dim)
+
+        # squared norm of every known encoding, computed once
+        # 每个已知编码的平方范数, 只计算一次
+        self.squared_norms = numpy.einsum('ij,ij->i', self.encodings, self.encodings)
+
+    def __len__(self):
+        return len(self.names)
+
+    #==============================================================
+    # euclidean distance between every unknown encoding and every known encoding
+    # 每个未知编码与每个已知编码之间的欧氏距离
+    # @parameter:
+    # - unknown_encodings:  unknown face encodings | ndarray (M x 128) or a list of ndarray
+    #                       未知人脸编码 | ndarray (M x 128) 或 ndarray的列表
+    # @return:
+    # - distances:  distance matrix | ndarray (M x N)
+    #               距离矩阵 | ndarray (M x N)
+    def distances(self, unknown_encodings) -> numpy.ndarray:
+        # probes follow the dtype of the gallery, so a float32 gallery is never copied to float64
+        # 未知编码跟随人脸库的数据类型, float32的人脸库不会被复制成float64
+        probes = numpy.asarray(unknown_encodings, dtype=self.encodings.dtype).reshape(-1, encoding_dim)
+
+        # |a-b|^2 = |a|^2 + |b|^2 - 2ab, a single matrix multiplication for all pairs
+        # |a-b|^2 = |a|^2 + |b|^2 - 2ab, 所有组合只需一次矩阵乘法
+        squared = (numpy.einsum('ij,ij->i', probes, probes)[:, None]
+                   + self.squared_norms[None, :]
+                   - 2.0 * (probes @ self.encodings.T))
+        numpy.maximum(squared, 0.0, out=squared)
+        return numpy.sqrt(squared, out=squared)
+
+    #==============================================================
+    # match every unknown encoding with the gallery
+    # 将每个未知编码与人脸库匹配
+    # @parameter:
+    # - unknown_encodings:  unknown face encodings | ndarray (M x 128) or a list of ndarray
+    #                       未知人脸编码 | ndarray (M x 128) 或 ndarray的列表
+    # @return:
+    # - results:    one dictionary for each unknown encoding, in the same order
+    #               每个未知编码对应一个字典, 顺序相同
+    #               [{'name': str, 'distance': float, 'nearest': str, 'runner_up': str, 'runner_up_distance': float}]
+    #               'name' is 'unknown' if 'distance' > tolerance, 'nearest' is the nearest person anyway,
+    #               'runner_up' is None if there is no second person
+    #               如果'distance' > 容错率则'name'为'unknown', 'nearest'总是最近的人,
+    #               如果没有第二个人则'runner_up'为None
+    def match(self, unknown_encodings) -> list:
+        probes = numpy.asarray(unknown_encodings, dtype=numpy.float64).reshape(-1, encoding_dim)
+        face_count = len(probes)
+        if face_count == 0:
+            return []
+
+        # index of the nearest two rows of every face, -1 if there is no such row
+        # 每张人脸最近的两行的行号, 没有则为-1
+        if self.searcher is not None:
+            best_index, second_index = self._nearest_two_approximate(probes)
+        else:
+            best_index, second_index = self._nearest_two_exact(probes)
+
+        # the reported distances are computed again exactly in float64 (only 2 rows per face)
+        # 报告的距离用float64重新精确计算 (每张人脸只有2行)
+        best_distance = self._exact_distances(probes, best_index)
+        second_distance = self._exact_distances(probes, second_index)
+        is_matched = best_distance <= self.tolerance
+
+        results = []
+        for i in range(face_count):
+            nearest = self.names[best_index[i]].item() if best_index[i] >= 0 else None
+            results.append({
+                'name': nearest if is_matched[i] else unknown_name,
+                'distance': float(best_distance[i]),
+                'nearest': nearest,
+                'runner_up': self.names[second_index[i]].item() if second_index[i] >= 0 else None,
+                'runner_up_distance': float(second_distance[i]),
+            })
+        return results
+
+    # nearest two rows by scanning the whole gallery
+    # 扫描整个人脸库得到最近的两行
+    def _nearest_two_exact(self, probes: numpy.ndarray):
+        distances = self.distances(probes)
+        face_count, known_count = distances.shape
+        best_index = numpy.full(face_count, -1, dtype=numpy.intp)
+        second_index = numpy.full(face_count, -1, dtype=numpy.intp)
+        if known_count == 1:
+            best_index[:] = 0
+        elif known_count > 1:
+            # the two nearest people of each face without sorting the whole row
+            # 不对整行排序, 直接取出每张人脸最近的两个人
+            rows = numpy.arange(face_count)
+            nearest_two = numpy.argpartition(distances, 1, axis=1)[:, :2]
+            is_swapped = distances[rows, nearest_two[:, 0]] > distances[rows, nearest_two[:, 1]]
+            best_index[:] = numpy.where(is_swapped, nearest_two[:, 1], nearest_two[:, 0])
+            second_index[:] = numpy.where(is_swapped, nearest_two[:, 0], nearest_two[:, 1])
+        return best_index, second_index
+
+    # nearest two rows among the candidates of the ann searcher (exact distances on the candidates)
+    # 在ann搜索器的候选行中得到最近的两行 (在候选行上精确计算距离)
+    def _nearest_two_approximate(self, probes: numpy.ndarray):
+        best_index = numpy.full(len(probes), -1, dtype=numpy.intp)
+        second_index = numpy.full(len(probes), -1, dtype=numpy.intp)
+        for i, candidates in enumerate(self.searcher.candidates(probes)):
+            if len(candidates) == 0:
+                continue
+            candidate_distances = numpy.linalg.norm(self.encodings[candidates] - probes[i], axis=1)
+            if len(candidates) == 1:
+                best_index[i] = candidates[0]
+                continue
+            nearest_two = numpy.argpartition(candidate_distances, 1)[:2]
+            if candidate_distances[nearest_two[0]] > candidate_distances[nearest_two[1]]:
+                nearest_two = nearest_two[::-1]
+            best_index[i], second_index[i] = candidates[nearest_two]
+        return best_index, second_index
+
+    # exact euclidean distance between probes[i] and the known row index[i], inf where index[i] is -1
+    # probes[i]与已知第index[i]行之间的精确欧氏距离, index[i]为-1时为inf
+    def _exact_distances(self, probes: numpy.ndarray, index: numpy.ndarray) -> numpy.ndarray:
+        distances = numpy.full(len(probes), float('inf'))
+        is_found = index >= 0
+        if is_found.any():
+            distances[is_found] = numpy.linalg.norm(
+                probes[is_found] - self.encodings[index[is_found]].astype(numpy.float64), axis=1)
+        return distances
+
+
+#==============================================================
+# matcher for several enrollment images per person
+# - every person gets templates: the centroid of the samples (or k-means centroids, see templates_per_person)
+# - a face is compared with all templates first, the nearest `shortlist` people are kept
+# - then it is compared with all samples of the shortlisted people only, the nearest sample decides the distance
+# so the cost grows with the number of people, not with the number of enrolled images
+# 每人多张登记图片时的匹配器
+# - 每个人有模板: 样本的质心 (或k-means质心, 见templates_per_person)
+# - 一张人脸先与所有模板比较, 保留最近的shortlist个人
+# - 然后只与这些候选人的所有样本比较, 最近的样本决定距离
+# 因此开销随人数增长, 而不随登记图片数增长
+# @parameter:
+# - names:      person of every sample (repeated for several images) | list of str
+#               每个样本所属的人 (多张图片时重复) | str的列表
+# - encodings:  samples | ndarray (N x 128)
+#               样本 | ndarray (N x 128)
+# - tolerance:  face rocognition tolerance
+#               人脸识别容错率
+# - templates:  templates per person, None for templates_per_person
+#               每人的模板数, None则为templates_per_person
+# - shortlist:  number of people compared with all their samples, None for default_shortlist
+#               与其所有样本比较的候选人数, None则为default_shortlist
+class TemplateMatcher:
+
+    # version of the gallery and matching settings, set when built from a store, used as a cache key
+    # 人脸库与匹配设置的版本, 由人脸库生成时设置, 用作缓存的键
+    gallery_version = None
+
+    def __init__(self, names: list, encodings: numpy.ndarray, tolerance: float = default_tolerance,
+                 templates: int = None, shortlist: int = None):
+        self.tolerance = tolerance
+        self.shortlist = default_shortlist if shortlist is None else shortlist
+        if templates is None:
+            templates = templates_per_person
+        encodings = numpy.asarray(encodings).reshape(-1, encoding_dim)
+
+        # samples sorted by person, the samples of person p are samples[sample_starts[p]:sample_starts[p+1]]
+        # 按人排序的样本, 第p个人的样本为samples[sample_starts[p]:sample_starts[p+1]]
+        identities, sample_identity = numpy.unique(numpy.asarray(names, dtype=str), return_inverse=True)
+        self.names = identities
+        order = numpy.argsort(sample_identity, kind='stable')
+        self.samples = numpy.ascontiguousarray(encodings[order])
+        self.sample_starts = numpy.searchsorted(sample_identity[order], numpy.arange(len(identities) + 1))
+
+        # templates, also sorted by person
+        # 模板, 同样按人排序
+        template_list = []
+        template_counts = []
+        counts = numpy.diff(self.sample_starts)
+        if len(identities) != 0:
+            centroids = (numpy.add.reduceat(self.samples.astype(numpy.float64), self.sample_starts[:-1], axis=0)
+                         / counts[:, None])
+        for person in range(len(identities)):
+            if templates > 1 and counts[person] > templates:
+                person_samples = self.samples[self.sample_starts[person]:self.sample_starts[person + 1]]
+                person_templates = kmeans(person_samples.astype(numpy.float64), templates)
+            else:
+                person_templates = centroids[person:person + 1]
+            template_list.append(person_templates)
+            template_counts.append(len(person_templates))
+        if len(template_list) != 0:
+            template_matrix = numpy.concatenate(template_list).astype(self.samples.dtype)
+        else:
+            template_matrix = numpy.empty((0, encoding_dim), dtype=self.samples.dtype)
+        self.template_starts = numpy.concatenate([[0], numpy.cumsum(template_counts, dtype=numpy.intp)])
+        self.template_matcher = FaceMatcher.from_arrays(list(range(len(template_matrix))), template_matrix, tolerance)
+
+    def __len__(self):
+        return len(self.names)
+
+    #==============================================================
+    # match every unknown encoding with the gallery, same results as FaceMatcher.match
+    # 将每个未知编码与人脸库匹配, 结果与FaceMatcher.match相同
+    # @parameter:
+    # - unknown_encodings:  unknown face encodings | ndarray (M x 128) or a list of ndarray
+    #                       未知人脸编码 | ndarray (M x 128) 或 ndarray的列表
+    # @return:
+    # - results:    [{'name': str, 'distance': float, 'nearest': str, 'runner_up': str, 'runner_up_distance': float}]
+    #               runner_up is always another person
+    #               runner_up总是另一个人
+    def match(self, unknown_encodings) -> list:
+        probes = numpy.asarray(unknown_encodings, dtype=numpy.float64).reshape(-1, encoding_dim)
+        if len(probes) == 0:
+            return []
+        person_count = len(self.names)
+        if person_count == 0:
+            return [{'name': unknown_name, 'distance': float('inf'), 'nearest': None,
+                     'runner_up': None, 'runner_up_distance': float('inf')} for _ in range(len(probes))]
+
+        # stage 1: the nearest template of every person, keep the nearest people
+        # 第一阶段: 每个人最近的模板, 保留最近的几个人
+        template_distances = self.template_matcher.distances(probes)
+        person_distances = numpy.minimum.reduceat(template_distances, self.template_starts[:-1], axis=1)
+        shortlist = min(self.shortlist, person_count)
+        if shortlist < person_count:
+            shortlisted = numpy.argpartition(person_distances, shortlist - 1, axis=1)[:, :shortlist]
+        else:
+            shortlisted = numpy.broadcast_to(numpy.arange(person_count), (len(probes), person_count))
+
+        # stage 2: every sample of the shortlisted people, the nearest sample of a person is its distance
+        # 第二阶段: 候选人的每个样本, 一个人最近的样本即为其距离
+        results = []
+        for probe, people in zip(probes, shortlisted):
+            segments = [numpy.arange(self.sample_starts[p], self.sample_starts[p + 1]) for p in people]
+            rows = numpy.concatenate(segments)
+            segment_starts = numpy.concatenate([[0], numpy.cumsum([len(segment) for segment in segments])[:-1]])
+            sample_distances = numpy.linalg.norm(self.samples[rows].astype(numpy.float64) - probe, axis=1)
+            distances = numpy.minimum.reduceat(sample_distances, segment_starts)
+
+            ranking = numpy.argsort(distances)
+            nearest = self.names[people[ranking[0]]].item()
+            result = {
+                'name': nearest if distances[ranking[0]] <= self.tolerance else unknown_name,
+                'distance': float(distances[ranking[0]]),
+                'nearest': nearest,
+                'runner_up': None,
+                'runner_up_distance': float('inf'),
+            }
+            if len(ranking) > 1:
+                result['runner_up'] = self.names[people[ranking[1]]].item()
+                result['runner_up_distance'] = float(distances[ranking[1]])
+            results.append(result)
+        return results
+
+
+###------------------量化模块 quantization module------------------###
+
+#==============================================================
+# int8 scalar quantized first pass for FaceMatcher (used as its searcher)
+# - every dimension is scaled by its largest absolute value to [-127, 127] and rounded to int8,
+#   the codes take 128 bytes per row instead of 512 (float32) or 1024 (float64)
+# - a query scans the codes block by block and keeps the `rerank` nearest rows,
+#   FaceMatcher then computes the exact float distances on these rows only
+# the results are the ones of the exact scan whenever the true nearest two rows are among the candidates;
+# the quantization error of a distance is a few thousandths (unit-norm encodings), far less than the gap rerank candidates leave
+# int8标量量化的第一遍搜索, 用作FaceMatcher的搜索器
+# - 每一维按其最大绝对值缩放到[-127, 127]并取整为int8, 编码每行128字节, 而不是512 (float32) 或1024 (float64)
+# - 查询逐块扫描编码, 保留最近的rerank行, FaceMatcher只在这些行上计算精确的float距离
+# 只要真正最近的两行在候选中, 结果就与精确扫描相同; 距离的量化误差只有千分之几 (单位模长的编码), 远小于rerank个候选留下的余量
+# @parameter:
+# - encodings:  gallery rows, can be a memory-map (read block by block) | ndarray (N x 128)
+#               人脸库的行, 可以是内存映射 (逐块读取) | ndarray (N x 128)
+# - rerank:     number of candidates re-ranked exactly, None for default_rerank
+#               精确重排的候选数, None则为default_rerank
+class QuantizedSearcher:
+
+    def __init__(self, encodings: numpy.ndarray, rerank: int = None):
+        self.rerank = default_rerank if rerank is None else max(2, rerank)
+        encodings = numpy.asarray(encodings).reshape(-1, encoding_dim)
+        row_count = len(encodings)
+
+        # one scale per dimension, from the largest absolute value
+        # 每一维一个缩放系数, 来自最大的绝对值
+        max_abs = numpy.zeros(encoding_dim, dtype=numpy.float32)
+        for start in range(0, row_count, quantize_block):
+            block = numpy.abs(numpy.asarray(encodings[start:start + quantize_block], dtype=numpy.float32))
+            numpy.maximum(max_abs, block.max(axis=0), out=max_abs)
+        self.scales = numpy.where(max_abs > 0, max_abs / 127.0, 1.0).astype(numpy.float32)
+
+        # codes and the squared norm of every decoded row
+        # 编码与每个解码后的行的平方范数
+        self.codes = numpy.empty((row_count, encoding_dim), dtype=numpy.int8)
+        self.squared_norms = numpy.empty(row_count, dtype=numpy.float32)
+        for start in range(0, row_count, quantize_block):
+            block = numpy.asarray(encodings[start:start + quantize_block], dtype=numpy.float32)
+            codes = numpy.clip(numpy.rint(block / self.scales), -127, 127).astype(numpy.int8)
+            decoded = codes.astype(numpy.float32) * self.scales
+            self.codes[start:start + len(codes)] = codes
+            self.squared_norms[start:start + len(codes)] = numpy.einsum('ij,ij->i', decoded, decoded)
+
+    def __len__(self):
+        return len(self.codes)
+
+    #==============================================================
+    # candidate rows of every probe: the rerank nearest rows by the quantized distance
+    # 每个查询的候选行: 按量化距离最近的rerank行
+    # @parameter:
+    # - probes: ndarray (M x 128)
+    # @return:
+    # - candidates: list of M int ndarray
+    #               M个int ndarray的列表
+    def candidates(self, probes: numpy.ndarray) -> list:
+        probes = numpy.asarray(probes, dtype=numpy.float32).reshape(-1, encoding_dim)
+        row_count = len(self.codes)
+        if row_count <= self.rerank:
+            return [numpy.arange(row_count) for _ in range(len(probes))]
+
+        # |p - x|^2 = |p|^2 + |x|^2 - 2 (p * scales) . codes, |p|^2 is the same for every row and left out
+        # |p - x|^2 = |p|^2 + |x|^2 - 2 (p * scales) . codes, |p|^2对每一行都相同, 省略
+        scaled_probes = probes * self.scales
+        block_scores = []
+        block_rows = []
+        for start in range(0, row_count, quantize_block):
+            codes = self.codes[start:start + quantize_block].astype(numpy.float32)
+            scores = self.squared_norms[start:start + len(codes)][None, :] - 2.0 * (scaled_probes @ codes.T)
+            rows = numpy.broadcast_to(numpy.arange(start, start + len(codes)), scores.shape)
+            if len(codes) > self.rerank:
+                nearest = numpy.argpartition(scores, self.rerank - 1, axis=1)[:, :self.rerank]
+                scores = numpy.take_along_axis(scores, nearest, axis=1)
+                rows = nearest + start
+            block_scores.append(scores)
+            block_rows.append(rows)
+
+        scores = numpy.concatenate(block_scores, axis=1)
+        rows = numpy.concatenate(block_rows, axis=1)
+        nearest = numpy.argpartition(scores, self.rerank - 1, axis=1)[:, :self.rerank]
+        return list(numpy.take_along_axis(rows, nearest, axis=1))
+
+
+###------------------存储模块 store module------------------###
+
+#==============================================================
+# binary gallery store: one float32 matrix file plus a json name index
+# - the matrix file is raw float32, row i is the encoding of keys[i], it can be memory-mapped
+# - adding a key appends one row, deleting a key only marks its row in 'deleted' (tombstone)
+# - compact() writes a new matrix file without the deleted rows, the index written afterwards switches to it
+# - store_id is created with the store, a store deleted and built again at the same path gets another one
+# 二进制人脸库: 一个float32矩阵文件加一个json名字索引
+# - 矩阵文件为原始float32数据, 第i行是keys[i]的编码, 可以内存映射
+# - 添加一个名字只追加一行, 删除一个名字只在'deleted'中标记它的行(墓碑)
+# - compact()写入一个去掉被删除行的新矩阵文件, 之后写入的索引切换到它
+# - store_id随人脸库创建, 在同一路径删除并重建的人脸库会得到另一个store_id
+# @parameter:
+# - store_path:     directory of the store files (e.g. 'src/known/.json/')
+#                   人脸库文件的目录 (例: 'src/known/.json/')
+class EncodingStore:
+
+    def __init__(self, store_path: str):
+        self.store_path = store_path
+        self.matrix_file = os.path.join(store_path, store_matrix)
+        self.index_file = os.path.join(store_path, store_index)
+        self.version = 0
+        self.generation = 0
+        self.store_id = uuid.uuid4().hex
+        self.keys = []
+        self.deleted = set()
+        self.matrix = numpy.empty((0, encoding_dim), dtype=numpy.float32)
+        self._rows = None
+        if os.path.exists(self.index_file):
+            self.load()
+
+    def __len__(self):
+        return len(self.keys) - len(self.deleted)
+
+    #==============================================================
+    # whether the store files exist
+    # 人脸库文件是否存在
+    # @return: bool
+    def exists(self) -> bool:
+        return os.path.exists(self.index_file) and os.path.exists(self.matrix_file)
+
+    #==============================================================
+    # load the index and memory-map the matrix it names, no encoding is parsed
+    # an index without its matrix file is left unloaded (the store does not exist)
+    # 加载索引并内存映射其中记录的矩阵, 不解析任何编码
+    # 矩阵文件不存在的索引不会被加载 (人脸库不存在)
+    # @return: (no return)
+    def load(self):
+        with open(self.index_file, 'r', encoding='utf-8') as index_file:
+            index = json.load(index_file)
+        self.matrix_file = os.path.join(self.store_path, index.get('matrix', store_matrix))
+        if not os.path.exists(self.matrix_file):
+            return
+        self.version = index['version']
+        self.generation = index.get('generation', 0)
+        # stores written before store_id existed share the empty id, a store built again always gets a new one
+        # store_id出现之前写入的人脸库共用空id, 重建的人脸库总会得到新的id
+        self.store_id = index.get('store_id', '')
+        self.keys = index['keys']
+        self.deleted = set(index['deleted'])
+        self._rows = None
+        self._map_matrix()
+
+    def _map_matrix(self):
+        # rows behind len(keys) are left by an interrupted append, they are ignored
+        # len(keys)之后的行来自被中断的追加, 忽略它们
+        row_count = len(self.keys)
+        if row_count == 0:
+            self.matrix = numpy.empty((0, encoding_dim), dtype=numpy.float32)
+        else:
+            self.matrix = numpy.memmap(self.matrix_file, dtype=numpy.float32, mode='r',
+                                       shape=(row_count, encoding_dim))
+
+    # key -> row of the alive rows, only built when the store is changed
+    # key -> 行号(仅未删除的行), 只在修改人脸库时建立
+    def _row_of(self) -> dict:
+        if self._rows is None:
+            self._rows = {}
+            for row, key in enumerate(self.keys):
+                if row not in self.deleted:
+                    self._rows[key] = row
+        return self._rows
+
+    #==============================================================
+    # names and encodings of all rows that are not deleted
+    # 所有未被删除的行的名字与编码
+    # @return:
+    # - names:      list of str
+    # - encodings:  float32 ndarray (N x 128), the memory-map itself if nothing is deleted
+    #               float32 ndarray (N x 128), 没有删除时就是内存映射本身
+    def alive(self):
+        if len(self.deleted) == 0:
+            return list(self.keys), self.matrix
+        is_alive = self.alive_mask()
+        names = [key for key, alive in zip(self.keys, is_alive) if alive]
+        return names, self.matrix[is_alive]
+
+    #==============================================================
+    # which rows are not deleted
+    # 哪些行没有被删除
+    # @return:
+    # - is_alive:   bool ndarray, one for each row
+    #               bool ndarray, 每行一个
+    def alive_mask(self) -> numpy.ndarray:
+        is_alive = numpy.ones(len(self.keys), dtype=bool)
+        if len(self.deleted) != 0:
+            is_alive[list(self.deleted)] = False
+        return is_alive
+
+    #==============================================================
+    # the store as an 'encoding dictionary'
+    # 将人脸库转换为'编码字典'
+    # @return:
+    # - encoding_dict:  {name -> str: encoding -> ndarray}
+    def to_dict(self) -> dict:
+        names, encodings = self.alive()
+        return {name: numpy.array(encoding, dtype=numpy.float64) for name, encoding in zip(names, encodings)}
+
+    #==============================================================
+    # add (or replace) encodings, only the new rows are written
+    # 添加(或替换)编码, 只写入新的行
+    # @parameter:
+    # - keys:       names of the encodings | list of str
+    #               编码的名字 | str的列表
+    # - encodings:  encodings in the same order | list of ndarray or ndarray (M x 128)
+    #               顺序相同的编码 | ndarray的列表或ndarray (M x 128)
+    # @return: (no return)
+    def append(self, keys: list, encodings):
+        if len(keys) == 0:
+            return
+        rows = self._row_of()
+        block = numpy.asarray(encodings, dtype=numpy.float32).reshape(-1, encoding_dim)
+
+        # cut the rows left by an interrupted append before writing
+        # 写入前截掉被中断的追加留下的行
+        row_bytes = encoding_dim * numpy.dtype(numpy.float32).itemsize
+        with open(self.matrix_file, 'ab') as matrix_file:
+            matrix_file.truncate(len(self.keys) * row_bytes)
+            matrix_file.write(block.tobytes())
+            matrix_file.flush()
+            os.fsync(matrix_file.fileno())
+
+        # a replaced key leaves a tombstone on its old row
+        # 被替换的名字在旧行留下墓碑
+        for key in keys:
+            if key in rows:
+                self.deleted.add(rows[key])
+            rows[key] = len(self.keys)
+            self.keys.append(key)
+        self._save_index()
+
+    #==============================================================
+    # mark the rows of keys as deleted (tombstone), the matrix file is not rewritten
+    # 将名字对应的行标记为已删除(墓碑), 不重写矩阵文件
+    # @parameter:
+    # - keys:   names to delete, unknown names are ignored | list of str
+    #           要删除的名字, 不存在的名字被忽略 | str的列表
+    # @return: (no return)
+    def delete(self, keys: list):
+        rows = self._row_of()
+        is_changed = False
+        for key in keys:
+            if key in rows:
+                self.deleted.add(rows.pop(key))
+                is_changed = True
+        if is_changed:
+            self._save_index()
+
+    #==============================================================
+    # rename keys, the rows (and their encodings) are kept, nothing is re-encoded
+    # 重命名名字, 保留原来的行(及其编码), 不重新编码
+    # @parameter:
+    # - renamed:    [old key, new key] pairs, unknown old keys are ignored, an existing new key is replaced
+    #               [旧名字, 新名字]对, 不存在的旧名字被忽略, 已存在的新名字被替换
+    # @return: (no return)
+    def rename(self, renamed: list):
+        rows = self._row_of()
+        is_changed = False
+        for old_key, new_key in renamed:
+            if old_key not in rows or old_key == new_key:
+                continue
+            if new_key in rows:
+                self.deleted.add(rows.pop(new_key))
+            row = rows.pop(old_key)
+            self.keys[row] = new_key
+            rows[new_key] = row
+            is_changed = True
+        if is_changed:
+            self._save_index()
+
+    #==============================================================
+    # write the matrix without deleted rows to the file of the next generation
+    # the index is the commit point: a crash before it is written leaves the old matrix and index untouched
+    # 将去掉被删除行的矩阵写入下一代的文件
+    # 索引是提交点: 在写入索引之前崩溃, 旧的矩阵与索引保持不变
+    # @return: (no return)
+    def compact(self):
+        names, encodings = self.alive()
+        encodings = numpy.array(encodings, dtype=numpy.float32)
+        generation = self.generation + 1
+        matrix_file = os.path.join(self.store_path, matrix_filename(generation))
+        _atomic_write(matrix_file, encodings.tobytes())
+
+        # row numbers change, anything built on the rows (e.g. an ann index) checks the generation
+        # 行号改变, 基于行号的东西 (例如ann索引) 检查generation
+        self.matrix = numpy.empty((0, encoding_dim), dtype=numpy.float32)
+        self.matrix_file = matrix_file
+        self.keys = names
+        self.deleted = set()
+        self._rows = None
+        self.generation = generation
+        self._save_index()
+
+        # the matrix files of older generations (also those left by a crash after the commit) are not used any more
+        # 旧世代的矩阵文件 (包括提交之后崩溃留下的) 不再被使用
+        for filename in os.listdir(self.store_path):
+            filename_withpath = os.path.join(self.store_path, filename)
+            if _is_matrix_filename(filename) and filename_withpath != self.matrix_file:
+                # a file still mapped by another process on windows is removed by a later compaction
+                # 在windows上仍被其他进程映射的文件由之后的压缩删除
+                try:
+                    os.remove(filename_withpath)
+                except OSError:
+                    pass
+
+    #==============================================================
+    # compact the store if too many rows are deleted
+    # 如果被删除的行太多, 则压缩人脸库
+    # @return:
+    # - is_compacted: bool
+    def compact_if_needed(self) -> bool:
+        if len(self.keys) != 0 and len(self.deleted) / len(self.keys) > compact_ratio:
+            self.compact()
+            return True
+        return False
+
+    def _save_index(self):
+        self.version += 1
+        index = {'version': self.version, 'generation': self.generation, 'store_id': self.store_id,
+                 'matrix': os.path.basename(self.matrix_file), 'keys': self.keys, 'deleted': sorted(self.deleted)}
+        _atomic_write(self.index_file, json.dumps(index).encode('utf-8'))
+        self._map_matrix()
+
+
+#==============================================================
+# filename of the matrix of a store generation, generation 0 keeps the name of the stores before compaction
+# 人脸库某一代的矩阵文件名, 第0代沿用压缩之前的名字
+# @parameter:
+# - generation: int
+# @return: str
+def matrix_filename(generation: int) -> str:
+    if generation == 0:
+        return store_matrix
+    base, extension = os.path.splitext(store_matrix)
+    return '{}.{}{}'.format(base, generation, extension)
+
+
+# whether a filename is the matrix of some generation
+# 文件名是否是某一代的矩阵
+def _is_matrix_filename(filename: str) -> bool:
+    base, extension = os.path.splitext(store_matrix)
+    if filename == store_matrix:
+        return True
+    if not filename.startswith(base + '.') or not filename.endswith(extension):
+        return False
+    return filename[len(base) + 1:-len(extension)].isdigit()
+
+
+# write a file through a temporary file and os.replace, a crash never leaves a half written file
+# 通过临时文件与os.replace写文件, 崩溃时不会留下写了一半的文件
+def _atomic_write(filename_withpath: str, content: bytes):
+    temp_filename = filename_withpath + '.tmp'
+    with open(temp_filename, 'wb') as temp_file:
+        temp_file.write(content)
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+    os.replace(temp_filename, filename_withpath)
@@ -0,0 +1,89 @@
+'''
+@author Reina
+@desc 重量级依赖的延迟导入
+描述 :
+face_recognition在导入时加载dlib模型, cv2也很大, 只需要人脸库或文件夹记录的命令不应为它们付出启动时间
+- LazyModule类: 第一次访问属性时才导入真正模块的代理
+- face_recognition, cv2: 两个重量级依赖的代理
+- is_loaded函数: 一个代理的模块是否已经导入
+
+description:
+lazy import of the heavy dependencies
+face_recognition loads the dlib models when imported and cv2 is large,
+commands that only need the gallery or the folder records should not pay their startup time
+- class: LazyModule: proxy importing the real module on the first attribute access
+- face_recognition, cv2: proxies of the two heavy dependencies
+- function: is_loaded: whether the module of a proxy is imported already
+'''
+
+#coding=utf-8
+
+import importlib
+import threading
+
+
+###------------------延迟导入模块 lazy import module------------------###
+
+#==============================================================
+# proxy importing the real module on the first attribute access
+# 第一次访问属性时才导入真正模块的代理
+# @parameter:
+# - names:  module names tried in order, the first importable one is used
+#           依次尝试的模块名, 使用第一个可以导入的
+class LazyModule:
+
+    def __init__(self, *names):
+        self._names = names
+        self._module = None
+        self._lock = threading.Lock()
+
+    #==============================================================
+    # import the real module now (once)
+    # 立即导入真正的模块 (只导入一次)
+    # @return: module
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = _import_first(self._names)
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return '<lazy module {} ({})>'.format(self._names[0], state)
+
+
+# import the first importable module of names, the error of the last one is raised if none is
+# 导入names中第一个可以导入的模块, 都不能导入时抛出最后一个的错误
+def _import_first(names):
+    error = None
+    for name in names:
+        try:
+            return importlib.import_module(name)
+        except ImportError as import_error:
+            error = import_error
+    raise error
+
+
+#==============================================================
+# whether the module of a proxy is imported already
+# 一个代理的模块是否已经导入
+# @parameter:
+# - lazy_module:    LazyModule
+# @return: bool
+def is_loaded(lazy_module: LazyModule) -> bool:
+    return lazy_module._module is not None
+
+
+###------------------预定义变量 predefinition------------------###
+
+# face_recognition, the dlib models are loaded on the first use
+# face_recognition, 第一次使用时加载dlib模型
+face_recognition = LazyModule('face_recognition')
+
+# cv2: 'from cv2 import cv2' (wsl) is tried first, then 'import cv2'
+# cv2: 先尝试'from cv2 import cv2' (wsl), 再尝试'import cv2'
+cv2 = LazyModule('cv2.cv2', 'cv2')
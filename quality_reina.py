@@ -0,0 +1,132 @@
+'''
+@author Reina
+@desc 编码之前的人脸质量检查
+描述 :
+过小, 模糊或接近侧脸的人脸几乎从不能被匹配, 编码它们只是浪费时间
+按从便宜到昂贵的顺序检查: 检测框大小, 清晰度(拉普拉斯方差), 由特征点估计的偏航角
+阈值保存在检测配置中 (见facekit_reina.detection_config), None则不检查
+- face_size函数: 检测框较短边的像素数
+- sharpness函数: 人脸缩放到固定大小后灰度图的拉普拉斯方差
+- yaw函数: 由5点特征点估计的偏航程度
+- assess_faces函数: 检查一张图片中的所有人脸, 返回每张人脸未通过的检查 (通过则为None)
+
+description:
+quality check of the faces before encoding
+tiny, blurred or near-profile faces are almost never matched, encoding them is wasted time
+the checks run from the cheapest to the most expensive: box size, sharpness (Laplacian variance),
+yaw estimated from the landmarks
+the thresholds are kept in the detection config (see facekit_reina.detection_config), None to skip a check
+- function: face_size: pixels of the shorter side of the box
+- function: sharpness: Laplacian variance of the grayscale face resized to a fixed size
+- function: yaw: how far the face is turned, estimated from the 5-point landmarks
+- function: assess_faces: check all faces of an image, return the failed check of every face (None if it passes)
+'''
+
+#coding=utf-8
+
+import numpy
+
+# face_recognition (it loads the dlib models) and cv2 are imported on their first use, see lazy_reina
+# face_recognition(会加载dlib模型)与cv2在第一次使用时才导入, 见lazy_reina
+from lazy_reina import face_recognition, cv2
+
+
+###------------------预定义变量 predefinition------------------###
+
+# the face is resized to sharpness_size x sharpness_size before the Laplacian, so the score does not depend on the
+# size of the face and min_sharpness works for near and far faces alike
+# 计算拉普拉斯之前人脸被缩放到sharpness_size x sharpness_size, 因此分数不依赖人脸的大小,
+# min_sharpness对远近人脸同样适用
+sharpness_size = 64
+
+# names of the checks, in the order they run
+# 检查的名字, 按运行顺序
+quality_checks = ['size', 'sharpness', 'pose']
+
+
+###------------------质量模块 quality module------------------###
+
+#==============================================================
+# pixels of the shorter side of the box
+# 检测框较短边的像素数
+# @parameter:
+# - face_location:  (top, right, bottom, left)
+# @return: int
+def face_size(face_location) -> int:
+    top, right, bottom, left = face_location
+    return min(abs(bottom - top), abs(right - left))
+
+
+#==============================================================
+# Laplacian variance of the grayscale face resized to sharpness_size, low for blurred faces
+# 人脸缩放到sharpness_size后灰度图的拉普拉斯方差, 模糊的人脸较低
+# @parameter:
+# - image:          RGB image | ndarray
+#                   RGB图片 | ndarray
+# - face_location:  (top, right, bottom, left)
+# @return: float
+def sharpness(image: numpy.ndarray, face_location) -> float:
+    height, width = image.shape[:2]
+    top, right, bottom, left = face_location
+    top, bottom = max(0, min(top, bottom)), min(height, max(top, bottom))
+    left, right = max(0, min(left, right)), min(width, max(left, right))
+    if bottom - top < 2 or right - left < 2:
+        return 0.0
+    gray = cv2.cvtColor(numpy.ascontiguousarray(image[top:bottom, left:right]), cv2.COLOR_RGB2GRAY)
+    gray = cv2.resize(gray, (sharpness_size, sharpness_size), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+#==============================================================
+# how far the face is turned: horizontal offset of the nose tip from the middle of the eyes, over the eye distance
+# about 0 for a frontal face, growing towards 1 for a profile
+# 人脸转动的程度: 鼻尖相对两眼中点的水平偏移除以两眼距离
+# 正脸约为0, 越接近侧脸越接近1
+# @parameter:
+# - landmarks:  5-point landmarks of one face | face_recognition.face_landmarks(..., model='small')[i]
+#               一张人脸的5点特征点 | face_recognition.face_landmarks(..., model='small')[i]
+# @return: float
+def yaw(landmarks: dict) -> float:
+    left_eye = numpy.mean(landmarks['left_eye'], axis=0)
+    right_eye = numpy.mean(landmarks['right_eye'], axis=0)
+    nose_tip = numpy.mean(landmarks['nose_tip'], axis=0)
+    eye_axis = right_eye - left_eye
+    eye_distance = numpy.linalg.norm(eye_axis)
+    if eye_distance == 0:
+        return 1.0
+
+    # offset along the eye axis, so a tilted (rolled) head is not mistaken for a turned one
+    # 沿两眼连线方向的偏移, 歪头(翻滚)不会被误认为转头
+    offset = numpy.dot(nose_tip - (left_eye + right_eye) / 2, eye_axis) / eye_distance
+    return float(min(1.0, 2 * abs(offset) / eye_distance))
+
+
+#==============================================================
+# check all faces of an image, the landmarks are only computed for the faces passing the cheaper checks
+# 检查一张图片中的所有人脸, 只为通过了较便宜检查的人脸计算特征点
+# @parameter:
+# - image:          RGB image | ndarray
+#                   RGB图片 | ndarray
+# - face_locations: [(top, right, bottom, left)]
+# - config:         complete detection config, the keys 'min_face_size', 'min_sharpness' and 'max_yaw' are used
+#                   完整的检测配置, 使用其中的'min_face_size', 'min_sharpness'与'max_yaw'
+# @return:
+# - failed: one of quality_checks or None for every face
+#           每张人脸为quality_checks之一或None
+def assess_faces(image: numpy.ndarray, face_locations: list, config: dict) -> list:
+    failed = [None] * len(face_locations)
+    for i, face_location in enumerate(face_locations):
+        if config['min_face_size'] is not None and face_size(face_location) < config['min_face_size']:
+            failed[i] = 'size'
+        elif config['min_sharpness'] is not None and sharpness(image, face_location) < config['min_sharpness']:
+            failed[i] = 'sharpness'
+
+    if config['max_yaw'] is not None:
+        remaining = [i for i in range(len(face_locations)) if failed[i] is None]
+        if len(remaining) != 0:
+            all_landmarks = face_recognition.face_landmarks(image, [face_locations[i] for i in remaining],
+                                                            model='small')
+            for i, landmarks in zip(remaining, all_landmarks):
+                if yaw(landmarks) > config['max_yaw']:
+                    failed[i] = 'pose'
+    return failed
@@ -0,0 +1,526 @@
+'''
+@author Reina
+@desc 本地HTTP识别服务, 对并发请求的匹配进行微批处理
+描述 :
+人脸库只加载一次, 通过HTTP接收上传的图片并返回结构化的JSON结果
+- 解码, 检测与编码(CPU密集)在进程池中运行
+- 并发请求的人脸被分成微批次, 与人脸库一次性匹配 (可配置最大批大小与最长等待时间)
+- GET /stats 返回队列深度与p50/p99延迟
+- RecognitionServer类: 基于asyncio的识别服务
+- serve函数: 启动服务直到ctrl+c
+
+接口:
+- POST /recognize: 请求体为图片文件的字节 (或multipart/form-data中的第一个文件)
+- POST /reload:    已知人脸文件夹改变时重新加载人脸库
+- GET  /stats:     队列深度, 请求数, 平均批大小, p50/p99延迟
+- GET  /health:    {'status': 'ok'}
+
+description:
+local HTTP recognition service with request micro-batching
+the gallery is loaded once, uploaded images are received over HTTP and structured JSON results are returned
+- decoding, detection and encoding (CPU bound) run in a process pool
+- faces of concurrent requests are grouped into micro-batches matched against the gallery in one operation
+  (configurable max batch size and max wait time)
+- GET /stats reports the queue depth and the p50/p99 latency
+- class: RecognitionServer: asyncio based recognition service
+- function: serve: run the service until ctrl+c
+
+endpoints:
+- POST /recognize: the body is the bytes of an image file (or the first file of a multipart/form-data body)
+- POST /reload:    reload the gallery if the known folder changed
+- GET  /stats:     queue depth, request counters, mean batch size, p50/p99 latency
+- GET  /health:    {'status': 'ok'}
+
+example:
+    curl --data-binary @src/unknown/img1.jpg http://127.0.0.1:8000/recognize
+'''
+
+#coding=utf-8
+
+import facekit_reina
+import folder_manager_reina
+
+import io
+import os
+import sys
+import time
+import email
+import asyncio
+import argparse
+import collections
+import concurrent.futures
+import multiprocessing
+import numpy
+
+# face_recognition (it loads the dlib models) is imported on its first use, see lazy_reina
+# face_recognition(会加载dlib模型)在第一次使用时才导入, 见lazy_reina
+from lazy_reina import face_recognition
+
+
+###------------------预定义变量 predefinition------------------###
+
+# address of the service, only the local machine by default
+# 服务的地址, 默认只有本机可以访问
+default_host = '127.0.0.1'
+default_port = 8000
+
+# max number of requests whose faces are matched together
+# 人脸被一起匹配的最大请求数
+default_max_batch_size = 32
+
+# max seconds the first request of a batch waits for more requests
+# 一个批次的第一个请求等待更多请求的最长秒数
+default_max_wait = 0.005
+
+# max size of an uploaded image in bytes
+# 上传图片的最大字节数
+max_body_size = 32 * 1024 * 1024
+
+# number of the most recent requests used for the latency quantiles
+# 用于计算延迟分位数的最近请求数
+latency_window = 10000
+
+# HTTP status lines
+# HTTP状态行
+status_texts = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                411: 'Length Required', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+###------------------工作进程模块 worker module------------------###
+
+# detection config of one worker process, set once by the pool initializer
+# 一个工作进程的检测配置, 由进程池的初始化函数设置一次
+_worker_config = None
+
+# pool initializer: the models are loaded before the first request
+# 进程池初始化函数: 在第一个请求之前加载模型
+def _init_server_worker(config: dict):
+    global _worker_config
+    _worker_config = facekit_reina.get_detection_config(config)
+    facekit_reina.warm_up(_worker_config)
+
+# decode, detect and encode one uploaded image in a worker process
+# returns (face_locations, encodings, timings)
+# 在工作进程中解码, 检测并编码一张上传的图片
+# 返回 (face_locations, encodings, timings)
+def _locate_and_encode_bytes(content: bytes) -> tuple:
+    timings = {}
+    start_time = time.perf_counter()
+    image = face_recognition.load_image_file(io.BytesIO(content))
+    timings['decode'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    face_locations = facekit_reina.detect_faces(image, _worker_config)
+    timings['detect'] = time.perf_counter() - start_time
+
+    # faces failing the quality gate of the config are not encoded, see facekit_reina.encode_faces
+    # 未通过配置中质量检查的人脸不编码, 见facekit_reina.encode_faces
+    start_time = time.perf_counter()
+    encodings = facekit_reina.encode_faces(image, face_locations, _worker_config)
+    timings['encode'] = time.perf_counter() - start_time
+    return face_locations, encodings, timings
+
+
+###------------------服务模块 service module------------------###
+
+# error answered to the client with an HTTP status
+# 以HTTP状态码回复给客户端的错误
+class _HTTPError(Exception):
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+#==============================================================
+# asyncio based recognition service
+# 基于asyncio的识别服务
+# @parameter:
+# - known_path:         path which stores known images | str (e.g. 'src/known/')
+#                       已知人脸图片文件的路径 | str (例: 'src/known/')
+# - workers:            number of detection and encoding processes (None for the number of cpus)
+#                       检测与编码的进程数 (None则为cpu数)
+# - max_batch_size:     max number of requests whose faces are matched together
+#                       人脸被一起匹配的最大请求数
+# - max_wait:           max seconds the first request of a batch waits for more requests (0: never wait)
+#                       一个批次的第一个请求等待更多请求的最长秒数 (0: 不等待)
+# - config:             detection config, see facekit_reina.detection_config (None for the default one)
+#                       检测配置, 见facekit_reina.detection_config (None则使用默认配置)
+class RecognitionServer:
+
+    def __init__(self, known_path, workers=None, max_batch_size=default_max_batch_size, max_wait=default_max_wait,
+                 config=None):
+        self.known_path = known_path
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait)
+        self.config = facekit_reina.get_detection_config(config)
+
+        # the gallery is loaded once and only reloaded on POST /reload
+        # 人脸库只加载一次, 只在POST /reload时重新加载
+        self.known_store = None
+        self.known_matcher = None
+        self.reload_gallery()
+
+        # forked workers share the models loaded once by the parent
+        # fork出的工作进程共享父进程加载一次的模型
+        if multiprocessing.get_start_method() == 'fork':
+            facekit_reina.warm_up(self.config)
+
+        # the workers are started before the event loop runs, so no worker is forked from a running loop
+        # (a worker forked while another thread holds a lock can hang)
+        # 工作进程在事件循环运行之前启动, 不会从正在运行的循环中fork (在其他线程持有锁时fork的进程可能卡住)
+        self.pool = concurrent.futures.ProcessPoolExecutor(self.workers, initializer=_init_server_worker,
+                                                           initargs=(self.config,))
+        for future in [self.pool.submit(int) for _ in range(self.workers)]:
+            future.result()
+
+        # requests waiting for the matching step: [(encodings, future, enqueue time)]
+        # 等待匹配的请求: [(encodings, future, 入队时间)]
+        self.match_pending = []
+        self.match_wakeup = None
+        self.match_task = None
+
+        # one reload at a time, both would update the same store
+        # 同一时间只进行一次重新加载, 否则两者会修改同一个人脸库
+        self.reload_lock = None
+
+        # counters
+        # 计数
+        self.detect_pending = 0
+        self.requests = 0
+        self.errors = 0
+        self.faces = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.reloads = 0
+        self.latencies = collections.deque(maxlen=latency_window)
+        self.start_time = time.time()
+
+    #==============================================================
+    # update the binary gallery store and rebuild the matcher, the old matcher serves until the new one is ready
+    # 更新二进制人脸库并重建匹配器, 新的匹配器准备好之前旧的匹配器继续服务
+    # @parameter:
+    # - workers:    enrollment processes, see facekit_reina.update_encoding_store
+    #               登记的进程数, 见facekit_reina.update_encoding_store
+    # @return: (no return)
+    def reload_gallery(self, workers: int = None):
+        store = facekit_reina.update_encoding_store(self.known_path, workers=workers)
+        self.known_matcher = facekit_reina.get_matcher(store)
+        self.known_store = store
+
+    #==============================================================
+    # reload the gallery if files in the known folder changed
+    # it runs in a thread of the running server, so the new images are encoded in this process:
+    # an enrollment pool forked from a thread while the event loop and the worker pool run could hang
+    # 如果已知人脸文件夹中的文件改变则重新加载人脸库
+    # 它在运行中的服务器的线程里执行, 因此新图片在本进程中编码:
+    # 在事件循环与工作进程池运行时从线程fork出的登记进程池可能卡住
+    # @return:
+    # - is_reloaded:    bool
+    def reload_gallery_if_changed(self) -> bool:
+        is_changed = folder_manager_reina.get_change(self.known_path,
+                                                     facekit_reina.json_path + facekit_reina.modate_json,
+                                                     recursive=True)[0]
+        if not is_changed:
+            return False
+        version = self.known_store.version
+        self.reload_gallery(workers=1)
+        if self.known_store.version == version:
+            return False
+        self.reloads += 1
+        return True
+
+    #==============================================================
+    # recognize one uploaded image: detection and encoding in the pool, then micro-batched matching
+    # 识别一张上传的图片: 在进程池中检测与编码, 然后进行微批匹配
+    # @parameter:
+    # - content:    bytes of the image file
+    #               图片文件的字节
+    # @return:
+    # - result:     {'faces': [{'box': [xmin, xmax, ymin, ymax], 'name': str, 'distance': float, 'nearest': str,
+    #                           'runner_up': str, 'runner_up_distance': float}],
+    #                'timings': {'decode', 'detect', 'encode', 'queue', 'match', 'total'}} (seconds)
+    async def recognize(self, content: bytes) -> dict:
+        loop = asyncio.get_running_loop()
+        start_time = time.perf_counter()
+
+        self.detect_pending += 1
+        try:
+            face_locations, encodings, timings = await loop.run_in_executor(self.pool, _locate_and_encode_bytes,
+                                                                            content)
+        except concurrent.futures.process.BrokenProcessPool:
+            raise
+        except Exception as error:
+            raise _HTTPError(400, 'cannot decode the image: ' + repr(error))
+        finally:
+            self.detect_pending -= 1
+
+        faces = []
+        timings['queue'] = 0.0
+        timings['match'] = 0.0
+        if len(encodings) != 0:
+            future = loop.create_future()
+            self.match_pending.append((encodings, future, time.perf_counter()))
+            self.match_wakeup.set()
+            results, timings['queue'], timings['match'] = await future
+
+            for face, result in zip(face_locations, results):
+                y1, x1, y2, x2 = face
+                result['box'] = [min(x1,x2), max(x1,x2), min(y1,y2), max(y1,y2)]
+                faces.append(result)
+
+        timings['total'] = time.perf_counter() - start_time
+        self.latencies.append(timings['total'])
+        self.faces += len(faces)
+        return {'faces': faces, 'timings': timings}
+
+    #==============================================================
+    # queue depth, counters and latency quantiles of the service
+    # 服务的队列深度, 计数与延迟分位数
+    # @return: dict
+    def stats(self) -> dict:
+        latencies = numpy.array(self.latencies, dtype=numpy.float64)
+        p50, p99 = numpy.percentile(latencies, [50, 99]).tolist() if len(latencies) != 0 else (None, None)
+        return {
+            'queue_depth': self.detect_pending + len(self.match_pending),
+            'detect_pending': self.detect_pending,
+            'match_pending': len(self.match_pending),
+            'requests': self.requests,
+            'errors': self.errors,
+            'faces': self.faces,
+            'batches': self.batches,
+            'mean_batch_size': self.batched_requests / self.batches if self.batches != 0 else None,
+            'latency': {'p50': p50, 'p99': p99, 'window': len(latencies)},
+            'gallery_size': len(self.known_store),
+            'gallery_version': self.known_matcher.gallery_version,
+            'reloads': self.reloads,
+            'workers': self.workers,
+            'max_batch_size': self.max_batch_size,
+            'max_wait': self.max_wait,
+            'uptime': time.time() - self.start_time,
+        }
+
+    #==============================================================
+    # serve on host:port until the task is cancelled
+    # 在host:port上服务直到任务被取消
+    # @parameter:
+    # - host:   str
+    # - port:   int
+    # @return: (no return)
+    async def serve(self, host=default_host, port=default_port):
+        self.match_wakeup = asyncio.Event()
+        self.reload_lock = asyncio.Lock()
+        self.match_task = asyncio.create_task(self._match_loop())
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        print("Serving on http://{}:{} ({} workers, {} encodings)".format(host, port, self.workers,
+                                                                        len(self.known_store)))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.match_task.cancel()
+
+    #==============================================================
+    # shut the process pool down
+    # 关闭进程池
+    # @return: (no return)
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+    # group the pending requests into micro-batches and match each batch in one operation
+    # the first request of a batch waits at most max_wait for more requests, a full batch is matched at once
+    # 将等待的请求分成微批次, 每批一次性匹配
+    # 一个批次的第一个请求最多等待max_wait来凑更多请求, 满的批次立刻匹配
+    async def _match_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.match_wakeup.wait()
+            self.match_wakeup.clear()
+            deadline = loop.time() + self.max_wait
+            while len(self.match_pending) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self.match_wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                self.match_wakeup.clear()
+
+            batch = self.match_pending[:self.max_batch_size]
+            self.match_pending = self.match_pending[self.max_batch_size:]
+            if len(self.match_pending) != 0:
+                self.match_wakeup.set()
+            if len(batch) == 0:
+                continue
+
+            batch_time = time.perf_counter()
+            all_encodings = [encoding for encodings, _, _ in batch for encoding in encodings]
+            known_matcher = self.known_matcher
+            try:
+                # numpy releases the GIL, the event loop keeps accepting requests while a batch is matched
+                # numpy会释放GIL, 匹配一个批次时事件循环继续接收请求
+                matches = await loop.run_in_executor(None, facekit_reina.match_encodings, known_matcher,
+                                                     all_encodings)
+            except Exception as error:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            match_time = time.perf_counter() - batch_time
+            self.batches += 1
+            self.batched_requests += len(batch)
+
+            position = 0
+            for encodings, future, enqueue_time in batch:
+                results = matches[position:position + len(encodings)]
+                position += len(encodings)
+                if not future.done():
+                    future.set_result((results, batch_time - enqueue_time, match_time))
+
+    # serve the requests of one connection (keep-alive unless the client closes it)
+    # 处理一个连接的请求 (除非客户端关闭, 否则保持连接)
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                keep_alive = await self._handle_request(head, reader, writer)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    # parse and answer one request, returns whether the connection is kept
+    # 解析并回复一个请求, 返回是否保持连接
+    async def _handle_request(self, head: bytes, reader, writer) -> bool:
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            self._respond(writer, 400, {'error': 'malformed request line'}, False)
+            return False
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+        keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+        path = target.split('?', 1)[0]
+
+        try:
+            body = await self._read_body(headers, reader)
+            if path == '/recognize':
+                if method != 'POST':
+                    raise _HTTPError(405, 'use POST')
+                self.requests += 1
+                content = _uploaded_file(headers.get('content-type', ''), body)
+                answer = await self.recognize(content)
+            elif path == '/stats':
+                answer = self.stats()
+            elif path == '/health':
+                answer = {'status': 'ok'}
+            elif path == '/reload':
+                if method != 'POST':
+                    raise _HTTPError(405, 'use POST')
+                async with self.reload_lock:
+                    is_reloaded = await asyncio.get_running_loop().run_in_executor(None,
+                                                                                   self.reload_gallery_if_changed)
+                answer = {'reloaded': is_reloaded, 'gallery_size': len(self.known_store)}
+            else:
+                raise _HTTPError(404, 'unknown path ' + path)
+        except _HTTPError as error:
+            self.errors += 1
+            # the rest of a rejected body is not read, the connection cannot be reused
+            # 被拒绝的请求体剩余部分没有读取, 连接不能复用
+            keep_alive = keep_alive and error.status not in (411, 413)
+            self._respond(writer, error.status, {'error': error.message}, keep_alive)
+            return keep_alive
+        except Exception as error:
+            self.errors += 1
+            self._respond(writer, 500, {'error': repr(error)}, False)
+            return False
+
+        self._respond(writer, 200, answer, keep_alive)
+        return keep_alive
+
+    async def _read_body(self, headers: dict, reader) -> bytes:
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise _HTTPError(411, 'chunked bodies are not supported, send Content-Length')
+        try:
+            length = int(headers.get('content-length', '0'))
+        except ValueError:
+            raise _HTTPError(400, 'bad Content-Length')
+        if length > max_body_size:
+            raise _HTTPError(413, 'the body is larger than {} bytes'.format(max_body_size))
+        if length <= 0:
+            return b''
+        return await reader.readexactly(length)
+
+    def _respond(self, writer, status: int, answer: dict, keep_alive: bool):
+        body = facekit_reina.result_json(answer).encode('utf-8')
+        head = 'HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'.format(
+            status, status_texts[status], len(body), 'keep-alive' if keep_alive else 'close')
+        writer.write(head.encode('latin-1') + body)
+
+
+# the image of a request: the raw body, or the first file of a multipart/form-data body
+# 请求中的图片: 原始请求体, 或multipart/form-data请求体中的第一个文件
+def _uploaded_file(content_type: str, body: bytes) -> bytes:
+    if content_type.lower().startswith('multipart/form-data'):
+        message = email.message_from_bytes(b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+        for part in message.walk():
+            if part.get_filename() is not None or part.get_content_type().startswith('image/'):
+                body = part.get_payload(decode=True) or b''
+                break
+        else:
+            raise _HTTPError(400, 'no file in the multipart body')
+    if len(body) == 0:
+        raise _HTTPError(400, 'empty body, send the bytes of an image')
+    return body
+
+
+#==============================================================
+# run the recognition service until ctrl+c
+# 启动识别服务直到ctrl+c
+# @parameter: known_path, workers, max_batch_size, max_wait, config: same as RecognitionServer
+#             known_path, workers, max_batch_size, max_wait, config: 与RecognitionServer相同
+# - host:   str
+# - port:   int
+# @return: (no return)
+def serve(known_path, host=default_host, port=default_port, workers=None, max_batch_size=default_max_batch_size,
+          max_wait=default_max_wait, config=None):
+    server = RecognitionServer(known_path, workers, max_batch_size, max_wait, config)
+    try:
+        asyncio.run(server.serve(host, port))
+    except KeyboardInterrupt:
+        print("Stopped.")
+    finally:
+        server.close()
+
+
+def _parse_arguments(argv):
+    parser = argparse.ArgumentParser(description='local HTTP recognition service of face_reina')
+    parser.add_argument('--known', default='src/known/', help='path which stores known images')
+    parser.add_argument('--host', default=default_host)
+    parser.add_argument('--port', type=int, default=default_port)
+    parser.add_argument('--workers', type=int, default=None, help='detection processes (default: number of cpus)')
+    parser.add_argument('--max-batch-size', type=int, default=default_max_batch_size,
+                        help='max number of requests matched together')
+    parser.add_argument('--max-wait-ms', type=float, default=default_max_wait * 1000,
+                        help='max milliseconds a request waits for a batch')
+    parser.add_argument('--model', default=None, help="detection model, 'hog' or 'cnn'")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    arguments = _parse_arguments(sys.argv[1:])
+    serve(arguments.known, arguments.host, arguments.port, arguments.workers, arguments.max_batch_size,
+          arguments.max_wait_ms / 1000, {'model': arguments.model} if arguments.model is not None else None)
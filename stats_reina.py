@@ -0,0 +1,395 @@
+'''
+@author Reina
+@desc 每个阶段的耗时与计数统计
+描述 :
+可选的性能统计, 默认关闭, 关闭时每次调用只检查一个标志
+- 每个阶段(解码, 检测, 编码, 匹配, 绘制, 写入)的耗时直方图
+- 每张图片的人脸数直方图, 计数器(图片数, 错误数, 缓存命中/未命中), 仪表(人脸库大小与版本)
+- Histogram类: 固定分桶的直方图, 可以估计分位数
+- Stats类: 进程内的统计对象, 可以打印摘要或导出Prometheus文本格式
+- stats: 全局统计对象, stats.enable()开启
+
+description:
+per-stage timings and counters
+optional instrumentation, disabled by default, a disabled call only checks one flag
+- latency histogram of every stage (decode, detect, encode, match, draw, write)
+- histogram of faces per image, counters (images, errors, cache hits/misses), gauges (gallery size and version)
+- class: Histogram: histogram with fixed buckets, can estimate quantiles
+- class: Stats: in-process stats object, prints a summary or dumps the Prometheus text format
+- stats: the global stats object, stats.enable() to turn it on
+'''
+
+#coding=utf-8
+
+import os
+import time
+import threading
+
+
+###------------------预定义变量 predefinition------------------###
+
+# upper bounds (seconds) of the latency buckets, the last bucket is +inf
+# 耗时分桶的上界(秒), 最后一个桶为+inf
+latency_buckets = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+# upper bounds of the faces per image buckets
+# 每张图片人脸数分桶的上界
+faces_buckets = [0, 1, 2, 3, 5, 10, 20, 50]
+
+# prefix of the Prometheus metric names
+# Prometheus指标名的前缀
+metric_prefix = 'face_reina'
+
+
+###------------------直方图模块 histogram module------------------###
+
+#==============================================================
+# histogram with fixed buckets
+# 固定分桶的直方图
+# @parameter:
+# - buckets:    sorted upper bounds, a +inf bucket is added
+#               排好序的上界, 会再加上一个+inf桶
+class Histogram:
+
+    def __init__(self, buckets: list):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    #==============================================================
+    # add one value
+    # 加入一个值
+    # @parameter:
+    # - value:  float
+    # @return: (no return)
+    def observe(self, value: float):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    #==============================================================
+    # estimate a quantile, linear inside the bucket (the +inf bucket gives its lower bound)
+    # 估计分位数, 在桶内线性插值 (+inf桶返回其下界)
+    # @parameter:
+    # - q:  quantile in [0, 1] (e.g. 0.99)
+    #       [0, 1]中的分位数 (例: 0.99)
+    # @return: float, or None without values
+    def quantile(self, q: float):
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count != 0 and seen + count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    #==============================================================
+    # add the values of another histogram with the same buckets (e.g. from a worker process)
+    # 加入另一个相同分桶的直方图的值 (例如来自工作进程)
+    # @parameter:
+    # - other:  Histogram or its to_dict()
+    # @return: (no return)
+    def merge(self, other):
+        if isinstance(other, Histogram):
+            other = other.to_dict()
+        for index, count in enumerate(other['counts']):
+            self.counts[index] += count
+        self.sum += other['sum']
+        self.count += other['count']
+
+    # picklable and json serializable form
+    # 可序列化的形式
+    def to_dict(self) -> dict:
+        return {'buckets': self.buckets, 'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+
+###------------------统计模块 stats module------------------###
+
+# timer of a stage, records the elapsed time on exit
+# 一个阶段的计时器, 退出时记录耗时
+class _StageTimer:
+
+    __slots__ = ('stats', 'stage', 'start_time')
+
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stats.observe_stage(self.stage, time.perf_counter() - self.start_time)
+        return False
+
+
+# the timer given when stats are disabled, does nothing
+# 统计关闭时给出的计时器, 什么也不做
+class _NullTimer:
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_timer = _NullTimer()
+
+
+#==============================================================
+# in-process stats: stage latency histograms, other histograms, counters and gauges
+# every method returns right away when disabled
+# 进程内的统计: 阶段耗时直方图, 其他直方图, 计数器与仪表
+# 关闭时每个方法立刻返回
+# @parameter:
+# - enabled:    start enabled
+#               是否一开始就开启
+class Stats:
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    #==============================================================
+    # turn on / off
+    # 开启 / 关闭
+    # @return: (no return)
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    #==============================================================
+    # forget every value
+    # 清空所有值
+    # @return: (no return)
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+            self.histograms = {}
+            self.counters = {}
+            self.gauges = {}
+            self.start_time = time.time()
+
+    #==============================================================
+    # time a stage: with stats.stage('detect'): ...
+    # 计时一个阶段: with stats.stage('detect'): ...
+    # @parameter:
+    # - stage:  stage name (e.g. 'decode', 'detect', 'encode', 'match', 'draw', 'write')
+    #           阶段名 (例: 'decode', 'detect', 'encode', 'match', 'draw', 'write')
+    # @return: context manager
+    def stage(self, stage: str):
+        if not self.enabled:
+            return _null_timer
+        return _StageTimer(self, stage)
+
+    #==============================================================
+    # record the latency of a stage
+    # 记录一个阶段的耗时
+    # @parameter:
+    # - stage:      stage name
+    #               阶段名
+    # - seconds:    float
+    # @return: (no return)
+    def observe_stage(self, stage: str, seconds: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = Histogram(latency_buckets)
+            self.stages[stage].observe(seconds)
+
+    #==============================================================
+    # record a value in a histogram (e.g. 'faces_per_image')
+    # 在直方图中记录一个值 (例: 'faces_per_image')
+    # @parameter:
+    # - name:       histogram name
+    #               直方图名
+    # - value:      float
+    # - buckets:    buckets used when the histogram is created, faces_buckets by default
+    #               创建直方图时使用的分桶, 默认为faces_buckets
+    # @return: (no return)
+    def observe(self, name: str, value: float, buckets: list = None):
+        if not self.enabled:
+            return
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(buckets if buckets is not None else faces_buckets)
+            self.histograms[name].observe(value)
+
+    #==============================================================
+    # add to a counter (e.g. 'images', 'errors')
+    # 增加一个计数器 (例: 'images', 'errors')
+    # @parameter:
+    # - name:   counter name
+    #           计数器名
+    # - value:  increment
+    #           增量
+    # @return: (no return)
+    def count(self, name: str, value: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    #==============================================================
+    # set a gauge (e.g. 'gallery_size', 'cache_face_hits')
+    # 设置一个仪表 (例: 'gallery_size', 'cache_face_hits')
+    # @parameter:
+    # - name:   gauge name
+    #           仪表名
+    # - value:  float
+    # @return: (no return)
+    def gauge(self, name: str, value: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.gauges[name] = value
+
+    #==============================================================
+    # all values as a picklable and json serializable dictionary
+    # 所有值, 为可序列化的字典
+    # @return: dict
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                'stages': {stage: histogram.to_dict() for stage, histogram in self.stages.items()},
+                'histograms': {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+            }
+
+    #==============================================================
+    # take the values and reset, used by worker processes to send their values to the parent
+    # 取出所有值并清空, 工作进程用它把统计发给父进程
+    # @return: dict (same as to_dict)
+    def collect(self) -> dict:
+        snapshot = self.to_dict()
+        self.reset()
+        return snapshot
+
+    #==============================================================
+    # add the values of another process (return value of collect or to_dict)
+    # 加入另一个进程的值 (collect或to_dict的返回值)
+    # @parameter:
+    # - snapshot:   dict
+    # @return: (no return)
+    def merge(self, snapshot: dict):
+        if not self.enabled or snapshot is None:
+            return
+        with self._lock:
+            for stage, histogram in snapshot['stages'].items():
+                if stage not in self.stages:
+                    self.stages[stage] = Histogram(histogram['buckets'])
+                self.stages[stage].merge(histogram)
+            for name, histogram in snapshot['histograms'].items():
+                if name not in self.histograms:
+                    self.histograms[name] = Histogram(histogram['buckets'])
+                self.histograms[name].merge(histogram)
+            for name, value in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            self.gauges.update(snapshot['gauges'])
+
+    #==============================================================
+    # human readable summary: count, total, mean, p50 and p99 of every stage, then histograms, counters and gauges
+    # 可读的摘要: 每个阶段的次数, 总耗时, 平均, p50与p99, 然后是直方图, 计数器与仪表
+    # @return: str
+    def summary(self) -> str:
+        snapshot = self.to_dict()
+        lines = ['{:<12} {:>8} {:>10} {:>10} {:>10} {:>10}'.format('stage', 'count', 'total(s)', 'mean(ms)',
+                                                                    'p50(ms)', 'p99(ms)')]
+        for stage, histogram in self._sorted_stages(snapshot):
+            restored = Histogram(histogram['buckets'])
+            restored.merge(histogram)
+            lines.append('{:<12} {:>8} {:>10.3f} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+                stage, histogram['count'], histogram['sum'], 1000 * histogram['sum'] / max(1, histogram['count']),
+                1000 * restored.quantile(0.5), 1000 * restored.quantile(0.99)))
+        for name, histogram in sorted(snapshot['histograms'].items()):
+            lines.append('{}: mean {:.2f} over {}'.format(name, histogram['sum'] / max(1, histogram['count']),
+                                                           histogram['count']))
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append('{}: {}'.format(name, value))
+        for name, value in sorted(snapshot['gauges'].items()):
+            lines.append('{}: {}'.format(name, value))
+        return '\n'.join(lines)
+
+    #==============================================================
+    # Prometheus text exposition format
+    # Prometheus文本格式
+    # @parameter:
+    # - prefix: prefix of the metric names
+    #           指标名的前缀
+    # @return: str
+    def prometheus_text(self, prefix: str = metric_prefix) -> str:
+        snapshot = self.to_dict()
+        lines = []
+        if len(snapshot['stages']) != 0:
+            lines.append('# HELP {}_stage_seconds latency of each stage'.format(prefix))
+            lines.append('# TYPE {}_stage_seconds histogram'.format(prefix))
+            for stage, histogram in self._sorted_stages(snapshot):
+                lines.extend(_prometheus_histogram(prefix + '_stage_seconds', histogram, 'stage="{}",'.format(stage)))
+        for name, histogram in sorted(snapshot['histograms'].items()):
+            lines.append('# TYPE {}_{} histogram'.format(prefix, name))
+            lines.extend(_prometheus_histogram(prefix + '_' + name, histogram, ''))
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append('# TYPE {}_{}_total counter'.format(prefix, name))
+            lines.append('{}_{}_total {}'.format(prefix, name, value))
+        for name, value in sorted(snapshot['gauges'].items()):
+            lines.append('# TYPE {}_{} gauge'.format(prefix, name))
+            lines.append('{}_{} {}'.format(prefix, name, value))
+        return '\n'.join(lines) + '\n'
+
+    #==============================================================
+    # write the Prometheus text atomically (e.g. for the node exporter textfile collector)
+    # 原子地写入Prometheus文本 (例如用于node exporter的textfile collector)
+    # @parameter:
+    # - filename_withpath:  e.g. 'metrics/face_reina.prom'
+    # @return: (no return)
+    def write_prometheus(self, filename_withpath: str):
+        temp_filename = filename_withpath + '.tmp'
+        with open(temp_filename, 'w', encoding='utf-8') as temp_file:
+            temp_file.write(self.prometheus_text())
+        os.replace(temp_filename, filename_withpath)
+
+    # stages in pipeline order, unknown stages last
+    # 按流水线顺序排列的阶段, 未知的阶段在最后
+    @staticmethod
+    def _sorted_stages(snapshot):
+        order = ['read', 'decode', 'detect', 'quality', 'encode', 'detect_encode', 'match', 'draw', 'write']
+        return sorted(snapshot['stages'].items(),
+                      key=lambda item: (order.index(item[0]) if item[0] in order else len(order), item[0]))
+
+
+# lines of one Prometheus histogram (cumulative buckets)
+# 一个Prometheus直方图的各行 (累计分桶)
+def _prometheus_histogram(name, histogram, labels):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram['buckets'] + ['+Inf'], histogram['counts']):
+        cumulative += count
+        lines.append('{}_bucket{{{}le="{}"}} {}'.format(name, labels, bound, cumulative))
+    labels = labels.rstrip(',')
+    label_text = '{' + labels + '}' if labels != '' else ''
+    lines.append('{}_sum{} {}'.format(name, label_text, histogram['sum']))
+    lines.append('{}_count{} {}'.format(name, label_text, histogram['count']))
+    return lines
+
+
+# the global stats object, disabled until stats.enable()
+# 全局统计对象, 在stats.enable()之前关闭
+stats = Stats()
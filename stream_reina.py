@@ -0,0 +1,443 @@
+'''
+@author Reina
+@desc 实时视频流识别流水线, 不经过磁盘
+描述 :
+捕获 -> 检测/编码/匹配 -> 绘制 -> VideoWriter, 全部在内存中完成
+各阶段由有界队列连接, 队列满时按照丢帧策略处理
+workers > 1时, 帧被捕获到共享内存的环形缓冲区(frame_ring_reina)中, 由多个工作进程识别, 进程之间只传递槽号
+- FrameQueue类: 带丢帧策略的有界队列
+- StreamPipeline类: 捕获, 识别, 写入三个线程组成的流水线 (识别可以分给多个进程)
+- recognize_a_frame函数: 识别一帧BGR图像并在其上绘制结果
+
+description:
+real-time recognition pipeline for video streams, without any disk round-trip
+capture -> detect/encode/match -> annotate -> VideoWriter, all in memory
+stages are connected by bounded queues, a full queue is handled with a drop policy
+with workers > 1 the frames are captured into a shared memory ring buffer (frame_ring_reina) and recognized by
+worker processes, only slot numbers cross processes
+- class: FrameQueue: bounded queue with a drop policy
+- class: StreamPipeline: pipeline of three threads: capture, recognize and write (recognition can use processes)
+- function: recognize_a_frame: recognize one BGR frame and draw the results on it
+'''
+
+#coding=utf-8
+
+import facekit_reina
+import frame_ring_reina
+
+import queue
+import threading
+import time
+import collections
+import concurrent.futures
+import multiprocessing
+import numpy
+
+# cv2 is imported on its first use ('from cv2 import cv2' on wsl, else 'import cv2'), see lazy_reina
+# cv2在第一次使用时才导入 (WSL上为'from cv2 import cv2', 否则为'import cv2'), 见lazy_reina
+from lazy_reina import cv2
+
+
+###------------------预定义变量 predefinition------------------###
+
+# drop policies when a queue is full
+# - 'block': wait until there is room, nothing is dropped (the camera may fall behind)
+# - 'drop_oldest': drop the oldest waiting frame, always work on the latest frame
+# - 'drop_newest': drop the incoming frame
+# 队列满时的丢帧策略
+# - 'block': 等待直到有空位, 不丢帧 (可能落后于摄像头)
+# - 'drop_oldest': 丢弃等待最久的帧, 总是处理最新的帧
+# - 'drop_newest': 丢弃新来的帧
+drop_policies = ['block', 'drop_oldest', 'drop_newest']
+
+# default size of each queue between two stages
+# 两个阶段之间每个队列的默认大小
+default_queue_size = 4
+
+# marker of the end of the stream
+# 视频流结束的标记
+_end_of_stream = object()
+
+
+###------------------队列模块 queue module------------------###
+
+#==============================================================
+# bounded queue with a drop policy
+# 带丢帧策略的有界队列
+# @parameter:
+# - maxsize:        max number of waiting frames
+#                   最多等待的帧数
+# - drop_policy:    one of drop_policies
+#                   drop_policies中的一个
+# - on_drop:        function(item) called with every dropped item (e.g. to release its ring slot), None for nothing
+#                   每个被丢弃的项调用的function(项) (例如释放它的环形缓冲区槽), None则不调用
+class FrameQueue:
+
+    def __init__(self, maxsize: int = default_queue_size, drop_policy: str = 'drop_oldest', on_drop=None):
+        if drop_policy not in drop_policies:
+            raise ValueError('drop_policy should be one of ' + str(drop_policies))
+        self.queue = queue.Queue(maxsize)
+        self.drop_policy = drop_policy
+        self.on_drop = on_drop
+        self.dropped = 0
+
+    def __len__(self):
+        return self.queue.qsize()
+
+    #==============================================================
+    # put a frame according to the drop policy
+    # 根据丢帧策略放入一帧
+    # @parameter:
+    # - item:   the frame (or anything passed between two stages)
+    #           帧 (或两个阶段之间传递的任何东西)
+    # @return: (no return)
+    def put(self, item):
+        if self.drop_policy == 'block':
+            self.queue.put(item)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                if self.drop_policy == 'drop_newest':
+                    self._drop(item)
+                    return
+                # drop_oldest: make room and try again
+                # drop_oldest: 腾出空位后重试
+                try:
+                    self._drop(self.queue.get_nowait())
+                except queue.Empty:
+                    pass
+
+    def _drop(self, item):
+        self.dropped += 1
+        if self.on_drop is not None:
+            self.on_drop(item)
+
+    #==============================================================
+    # put the end marker, it is never dropped
+    # 放入结束标记, 结束标记永远不会被丢弃
+    # @return: (no return)
+    def put_end(self):
+        self.queue.put(_end_of_stream)
+
+    #==============================================================
+    # take the next frame, wait if there is none
+    # 取出下一帧, 如果没有则等待
+    # @return: the frame, or the end marker
+    def get(self):
+        return self.queue.get()
+
+
+###------------------识别模块 recognition module------------------###
+
+#==============================================================
+# recognize one BGR frame and draw the results on it (the frame is changed in place)
+# 识别一帧BGR图像并在其上绘制结果 (直接修改这一帧)
+# @parameter:
+# - frame:                  BGR frame from cv2.VideoCapture | ndarray
+#                           cv2.VideoCapture得到的BGR帧 | ndarray
+# - known_encoding_dict:    known encoding dictionary, EncodingStore or FaceMatcher
+#                           已知的编码字典, EncodingStore或FaceMatcher
+# - config:                 detection config, see facekit_reina.detection_config (None for the default one)
+#                           检测配置, 见facekit_reina.detection_config (None则使用默认配置)
+# @return:
+# - frame:  the annotated frame
+#           绘制后的帧
+def recognize_a_frame(frame, known_encoding_dict, config=None):
+    faces = facekit_reina.locate_and_recognize(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), known_encoding_dict, config)
+    facekit_reina.draw_recognition(frame, faces)
+    return frame
+
+
+# the frame ring, gallery and detection config of one worker process, set once by the pool initializer
+# 一个工作进程的帧环形缓冲区, 人脸库与检测配置, 由进程池的初始化函数设置一次
+_worker_ring = None
+_worker_matcher = None
+_worker_config = None
+
+# pool initializer of the recognition processes, the ring is attached (or inherited by fork) once
+# 识别进程池的初始化函数, 环形缓冲区只连接(或由fork继承)一次
+def _init_stream_worker(ring, known_matcher, config):
+    global _worker_ring, _worker_matcher, _worker_config
+    _worker_ring = ring
+    _worker_matcher = known_matcher
+    _worker_config = config
+
+# task of one worker: recognize the frame of a slot in place, only the faces are sent back
+# 一个工作进程的任务: 原地识别一个槽中的帧, 只发回人脸
+def _recognize_slot(meta: tuple) -> list:
+    frame = _worker_ring.frame(meta)
+    return facekit_reina.locate_and_recognize(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), _worker_matcher, _worker_config)
+
+
+###------------------流水线模块 pipeline module------------------###
+
+#==============================================================
+# capture -> recognize -> write, three threads connected by FrameQueue
+# 捕获 -> 识别 -> 写入, 三个线程由FrameQueue连接
+# @parameter:
+# - video_capture:          opened cv2.VideoCapture (camera, ip camera url or video file)
+#                           已打开的cv2.VideoCapture (摄像头, 网络摄像头url或视频文件)
+# - video_writer:           opened cv2.VideoWriter, None to only recognize
+#                           已打开的cv2.VideoWriter, None则只识别
+# - known_encoding_dict:    known encoding dictionary, EncodingStore or FaceMatcher
+#                           已知的编码字典, EncodingStore或FaceMatcher
+# - frame_size:             (width, height) of the video_writer, frames are resized to it, None to keep the size
+#                           video_writer的(宽, 高), 帧会被缩放到这个大小, None则保持原大小
+# - max_frames:             stop after capturing this number of frames, None to run until stop() or the end of stream
+#                           捕获这么多帧后停止, None则一直运行直到stop()或视频流结束
+# - queue_size:             size of each queue
+#                           每个队列的大小
+# - drop_policy:            drop policy of each queue, one of drop_policies
+#                           每个队列的丢帧策略, drop_policies中的一个
+# - process_frame:          function(frame) -> annotated frame, recognize_a_frame with the gallery by default
+#                           function(帧) -> 绘制后的帧, 默认为使用该人脸库的recognize_a_frame
+# - config:                 detection config of the default process_frame (None for the default one)
+#                           默认process_frame的检测配置 (None则使用默认配置)
+# - workers:                number of recognition processes, 1 to recognize in the recognize thread
+#                           with workers > 1 the frames are captured into a shared memory FrameRing, the workers get
+#                           slot numbers only and the results are drawn on the shared frame, so no frame is copied
+#                           between processes and the memory is bounded by the ring size; frames are resized to the
+#                           size of the first frame; process_frame can not be used (it runs in this process)
+#                           识别进程数, 1则在识别线程中识别
+#                           workers > 1时帧被捕获到共享内存的FrameRing中, 工作进程只得到槽号, 结果绘制在共享的帧上,
+#                           因此进程之间不复制帧, 内存的上限为环形缓冲区的大小; 帧被缩放到第一帧的大小;
+#                           不能使用process_frame (它在本进程中运行)
+class StreamPipeline:
+
+    def __init__(self, video_capture, video_writer, known_encoding_dict, frame_size=None, max_frames=None,
+                 queue_size=default_queue_size, drop_policy='drop_oldest', process_frame=None, config=None,
+                 workers=1):
+        if workers > 1 and process_frame is not None:
+            raise ValueError('process_frame runs in this process, it can not be used with workers > 1')
+        self.video_capture = video_capture
+        self.video_writer = video_writer
+        self.frame_size = frame_size
+        self.max_frames = max_frames
+        self.queue_size = queue_size
+        self.config = config
+        self.workers = workers
+
+        # the gallery is turned into one matrix once for the whole stream
+        # 整个视频流只需将人脸库矩阵化一次
+        self.known_matcher = None
+        if process_frame is None:
+            known_matcher = facekit_reina.get_matcher(known_encoding_dict)
+            process_frame = lambda frame: recognize_a_frame(frame, known_matcher, config)
+            self.known_matcher = known_matcher
+        self.process_frame = process_frame
+
+        self.captured_queue = FrameQueue(queue_size, drop_policy)
+        self.recognized_queue = FrameQueue(queue_size, drop_policy)
+        self.stop_event = threading.Event()
+
+        # frame ring and worker processes (workers > 1), created by run()
+        # 帧环形缓冲区与工作进程 (workers > 1), 由run()创建
+        self.ring = None
+        self.pool = None
+        self.frame_shape = None
+        self.first_frame = None
+        self.max_in_flight = 2 * workers
+
+        # counters of each stage
+        # 每个阶段的计数
+        self.captured = 0
+        self.recognized = 0
+        self.written = 0
+
+    #==============================================================
+    # ask the pipeline to stop, frames already captured are still written
+    # 请求停止流水线, 已经捕获的帧仍然会被写入
+    # @return: (no return)
+    def stop(self):
+        self.stop_event.set()
+
+    #==============================================================
+    # run the pipeline until max_frames, stop() or the end of the stream
+    # 运行流水线直到max_frames, stop()或视频流结束
+    # @return:
+    # - stats:  {'captured': int, 'recognized': int, 'written': int, 'dropped': int, 'seconds': float}
+    def run(self) -> dict:
+        start_time = time.perf_counter()
+        recognize_loop = self._recognize_loop
+        if self.workers > 1:
+            self._start_workers()
+            recognize_loop = self._dispatch_loop
+        threads = [
+            threading.Thread(target=self._capture_loop, name='capture'),
+            threading.Thread(target=recognize_loop, name='recognize'),
+            threading.Thread(target=self._write_loop, name='write'),
+        ]
+        try:
+            for thread in threads:
+                thread.start()
+            try:
+                for thread in threads:
+                    while thread.is_alive():
+                        thread.join(0.5)
+            except KeyboardInterrupt:
+                # ctrl+c stops capturing, the rest of the pipeline is drained
+                # ctrl+c停止捕获, 流水线中剩下的帧继续处理完
+                self.stop()
+                for thread in threads:
+                    thread.join()
+        finally:
+            if self.workers > 1:
+                self._stop_workers()
+
+        return {
+            'captured': self.captured,
+            'recognized': self.recognized,
+            'written': self.written,
+            'dropped': self.captured_queue.dropped + self.recognized_queue.dropped,
+            'seconds': time.perf_counter() - start_time,
+        }
+
+    # the first frame gives the slot size, the ring and the worker processes are created before any thread starts
+    # (forking a process with running threads may copy a held lock)
+    # 第一帧决定槽的大小, 环形缓冲区与工作进程在任何线程启动之前创建 (在有运行中线程的进程中fork可能复制被持有的锁)
+    def _start_workers(self):
+        ret, frame = self.video_capture.read()
+        if ret:
+            self.first_frame = frame
+            self.frame_shape = frame.shape
+
+        # frames alive at once: both queues, the frames in the workers, one being captured and one being written
+        # 同时存在的帧: 两个队列中的, 工作进程中的, 正在捕获的一帧与正在写入的一帧
+        slots = 2 * self.queue_size + self.max_in_flight + 2
+        self.ring = frame_ring_reina.FrameRing(slots, frame.nbytes if ret else 1)
+        self.captured_queue.on_drop = self.ring.release
+        self.recognized_queue.on_drop = self.ring.release
+
+        # forked workers share the models loaded once by the parent, the ring is inherited
+        # fork出的工作进程共享父进程加载一次的模型, 环形缓冲区被继承
+        if multiprocessing.get_start_method() == 'fork':
+            facekit_reina.warm_up(self.config)
+        self.pool = concurrent.futures.ProcessPoolExecutor(self.workers, initializer=_init_stream_worker,
+                                                           initargs=(self.ring, self.known_matcher, self.config))
+        for future in [self.pool.submit(int) for _ in range(self.workers)]:
+            future.result()
+
+    def _stop_workers(self):
+        self.pool.shutdown(cancel_futures=True)
+        self.first_frame = None
+        self.ring.close()
+
+    # read the next frame straight into a free slot, returns its meta, or None at the end of the stream
+    # 将下一帧直接读入一个空闲槽, 返回其描述, 视频流结束时返回None
+    def _read_into_ring(self):
+        if self.frame_shape is None:
+            return None
+        slot = self.ring.acquire()
+        if self.first_frame is not None:
+            frame, self.first_frame = self.first_frame, None
+            return self.ring.write(slot, frame)
+
+        view = self.ring.array(slot, self.frame_shape)
+        ret, frame = self.video_capture.read(view)
+        if not ret:
+            self.ring.release(slot)
+            return None
+        if not numpy.shares_memory(frame, view):
+            # the stream changed its size, the frame is resized into the slot
+            # 视频流改变了大小, 帧被缩放到槽中
+            cv2.resize(frame, (self.frame_shape[1], self.frame_shape[0]), dst=view)
+        return slot, self.frame_shape, view.dtype.name
+
+    def _capture_loop(self):
+        try:
+            while not self.stop_event.is_set():
+                if self.max_frames is not None and self.captured >= self.max_frames:
+                    break
+                if self.ring is not None:
+                    frame = self._read_into_ring()
+                    if frame is None:
+                        break
+                else:
+                    ret, frame = self.video_capture.read()
+                    if not ret:
+                        break
+                self.captured += 1
+                self.captured_queue.put(frame)
+        finally:
+            self.captured_queue.put_end()
+
+    def _recognize_loop(self):
+        is_drained = False
+        try:
+            while True:
+                frame = self.captured_queue.get()
+                if frame is _end_of_stream:
+                    is_drained = True
+                    break
+                self.recognized_queue.put(self.process_frame(frame))
+                self.recognized += 1
+        finally:
+            self.recognized_queue.put_end()
+            # on an error, stop capturing and empty the queue so that the capture thread is never blocked
+            # 出错时停止捕获并清空队列, 使捕获线程不会被阻塞
+            if not is_drained:
+                self.stop_event.set()
+                while self.captured_queue.get() is not _end_of_stream:
+                    pass
+
+    # recognize stage with worker processes: the slots are sent to the pool, the results are drawn on the shared
+    # frames in capture order, at most max_in_flight frames are in the workers
+    # 使用工作进程的识别阶段: 槽号被发送给进程池, 结果按捕获顺序绘制在共享的帧上, 最多max_in_flight帧在工作进程中
+    def _dispatch_loop(self):
+        in_flight = collections.deque()
+        is_drained = False
+        try:
+            while True:
+                meta = self.captured_queue.get()
+                if meta is _end_of_stream:
+                    is_drained = True
+                    break
+                in_flight.append((meta, self.pool.submit(_recognize_slot, meta)))
+                while len(in_flight) >= self.max_in_flight or (len(in_flight) != 0 and in_flight[0][1].done()):
+                    self._finish_slot(*in_flight.popleft())
+            while len(in_flight) != 0:
+                self._finish_slot(*in_flight.popleft())
+        finally:
+            self.recognized_queue.put_end()
+            # on an error, stop capturing and empty the queue so that the capture thread is never blocked,
+            # the slots of the frames left behind are released
+            # 出错时停止捕获并清空队列, 使捕获线程不会被阻塞, 释放被丢下的帧的槽
+            if not is_drained:
+                self.stop_event.set()
+                for meta, _ in in_flight:
+                    self.ring.release(meta)
+                while True:
+                    meta = self.captured_queue.get()
+                    if meta is _end_of_stream:
+                        break
+                    self.ring.release(meta)
+
+    def _finish_slot(self, meta, future):
+        faces = future.result()
+        facekit_reina.draw_recognition(self.ring.frame(meta), faces)
+        self.recognized += 1
+        self.recognized_queue.put(meta)
+
+    def _write_loop(self):
+        while True:
+            frame = self.recognized_queue.get()
+            if frame is _end_of_stream:
+                break
+            meta = None
+            if self.ring is not None:
+                meta, frame = frame, self.ring.frame(frame)
+            try:
+                if self.video_writer is None:
+                    continue
+                if self.frame_size is not None and (frame.shape[1], frame.shape[0]) != tuple(self.frame_size):
+                    frame = cv2.resize(frame, tuple(self.frame_size))
+                self.video_writer.write(frame)
+                self.written += 1
+            finally:
+                # the slot is free again once its frame is written
+                # 帧写入后槽重新空闲
+                if meta is not None:
+                    self.ring.release(meta)
@@ -0,0 +1,52 @@
+'''
+@author Reina
+@desc 测试的公共设置
+描述 :
+face_reina的模块位于仓库顶层而不是包中, 测试从仓库根目录导入它们
+这里的测试只覆盖纯numpy与纯文件读写的部分, 不需要face_recognition/dlib或摄像头
+- random_encodings, make_store: 人脸库, ann索引与缓存的测试共用的fixture
+
+description:
+common setup of the tests
+the modules of face_reina live at the top of the repository, not in a package, the tests import them from the root
+the tests only cover the pure numpy and pure file I/O parts, neither face_recognition/dlib nor a camera is needed
+- random_encodings, make_store: fixtures shared by the tests of the gallery store, the ann index and the cache
+'''
+
+#coding=utf-8
+
+import os
+import sys
+
+import numpy
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gallery_reina
+
+
+#==============================================================
+# random float32 encodings, the same seed gives the same encodings
+# 随机的float32编码, 相同的种子得到相同的编码
+# @return: function(count, seed=0) -> ndarray (count x 128)
+@pytest.fixture
+def random_encodings():
+    def make(count, seed=0):
+        return numpy.random.default_rng(seed).normal(size=(count, gallery_reina.encoding_dim)).astype(numpy.float32)
+    return make
+
+
+#==============================================================
+# binary gallery stores in the temporary directory of the test
+# 测试临时目录中的二进制人脸库
+# @return: function(keys, encodings, name='store') -> gallery_reina.EncodingStore in tmp_path/name/
+@pytest.fixture
+def make_store(tmp_path):
+    def make(keys, encodings, name='store'):
+        store_path = str(tmp_path / name) + '/'
+        os.makedirs(store_path, exist_ok=True)
+        store = gallery_reina.EncodingStore(store_path)
+        store.append(keys, encodings)
+        return store
+    return make
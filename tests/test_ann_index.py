@@ -0,0 +1,96 @@
+'''
+@author Reina
+@desc ann_index_reina的测试: 召回率, 增量同步与保存
+description:
+tests of ann_index_reina: recall, incremental sync and saving
+'''
+
+#coding=utf-8
+
+import numpy
+
+import ann_index_reina
+import gallery_reina
+
+
+# clustered gallery, like face encodings: people are spread around a few dense regions
+# 有聚类结构的人脸库, 与人脸编码类似: 人分布在几个密集区域周围
+def _gallery(count, seed=0):
+    random = numpy.random.default_rng(seed)
+    centers = random.normal(0, 0.3, (16, gallery_reina.encoding_dim))
+    encodings = centers[random.integers(0, 16, count)] + random.normal(0, 0.05, (count, gallery_reina.encoding_dim))
+    return encodings.astype(numpy.float32)
+
+
+def _keys(encodings):
+    return ['k{}'.format(i) for i in range(len(encodings))]
+
+
+def test_probing_every_list_is_exact():
+    encodings = _gallery(2000)
+    index = ann_index_reina.IVFIndex.train(encodings)
+    report = ann_index_reina.recall_report(encodings, n_probes=(index.n_lists,), index=index, probe_count=100)
+    assert report[0]['recall'] == 1.0
+    assert report[0]['candidates_per_query'] == len(encodings)
+
+
+def test_recall_grows_with_n_probe():
+    encodings = _gallery(2000)
+    report = ann_index_reina.recall_report(encodings, n_probes=(1, 8, 32), probe_count=200)
+    recalls = [line['recall'] for line in report]
+    assert recalls == sorted(recalls)
+    assert recalls[1] >= 0.9
+    assert report[0]['candidates_per_query'] < report[2]['candidates_per_query'] < len(encodings)
+
+
+def test_sync_follows_appends_and_compactions(make_store):
+    encodings = _gallery(300)
+    store = make_store(_keys(encodings[:200]), encodings[:200])
+    index = ann_index_reina.update_index(store, store.store_path)
+    numpy.testing.assert_array_equal(index.assignments, index.assign(encodings[:200]))
+
+    # appended rows are assigned, nothing else changes
+    # 追加的行被分配, 其他不变
+    store.append(['n{}'.format(i) for i in range(100)], encodings[200:])
+    assert index.sync(store)
+    assert len(index.assignments) == 300
+    assert not index.sync(store)
+
+    # a compaction changes the rows, every row is assigned again
+    # 压缩改变行号, 每一行被重新分配
+    store.delete(['k{}'.format(i) for i in range(100)])
+    store.compact()
+    assert index.sync(store)
+    numpy.testing.assert_array_equal(index.assignments, index.assign(encodings[100:]))
+
+
+def test_a_rebuilt_store_is_assigned_again(make_store):
+    encodings = _gallery(200)
+    store = make_store(_keys(encodings), encodings, 'old')
+    index = ann_index_reina.update_index(store, store.store_path)
+
+    # same size, same generation, other rows
+    # 相同的大小与generation, 不同的行
+    rebuilt = make_store(_keys(encodings), encodings[::-1], 'new')
+    assert index.sync(rebuilt)
+    numpy.testing.assert_array_equal(index.assignments, index.assign(encodings[::-1]))
+
+
+def test_searcher_skips_deleted_rows(make_store):
+    encodings = _gallery(200)
+    store = make_store(_keys(encodings), encodings)
+    index = ann_index_reina.update_index(store, store.store_path)
+    store.delete(['k{}'.format(i) for i in range(0, 200, 2)])
+    searcher = index.searcher(store, index.n_lists)
+    assert sorted(searcher.candidates(encodings[:1])[0]) == list(range(100))
+
+
+def test_save_and_load(make_store):
+    encodings = _gallery(200)
+    store = make_store(_keys(encodings), encodings)
+    index = ann_index_reina.update_index(store, store.store_path)
+    loaded = ann_index_reina.load_index(store.store_path)
+    numpy.testing.assert_array_equal(loaded.centroids, index.centroids)
+    numpy.testing.assert_array_equal(loaded.assignments, index.assignments)
+    assert (loaded.generation, loaded.trained_rows, loaded.store_id) == (0, 200, store.store_id)
+    assert not loaded.sync(store)
@@ -0,0 +1,96 @@
+'''
+@author Reina
+@desc audit_reina人脸库自查的测试
+description:
+tests of the gallery audit of audit_reina
+'''
+
+#coding=utf-8
+
+import numpy
+import pytest
+
+import audit_reina
+import gallery_reina
+
+
+def _gallery(count, seed=0):
+    random = numpy.random.default_rng(seed)
+    encodings = random.normal(size=(count, gallery_reina.encoding_dim))
+    return encodings / numpy.linalg.norm(encodings, axis=1, keepdims=True) * 0.45
+
+
+def _brute_force_lookalikes(keys, encodings, tolerance):
+    distances = numpy.linalg.norm(encodings[:, None] - encodings[None], axis=2)
+    identities = [gallery_reina.identity_of(key) for key in keys]
+    return sorted((keys[a], keys[b]) for a in range(len(keys)) for b in range(a + 1, len(keys))
+                  if identities[a] != identities[b] and distances[a, b] <= tolerance)
+
+
+def test_clusters_join_chains_of_pairs():
+    pairs_a = numpy.array([0, 5, 1, 7])
+    pairs_b = numpy.array([1, 6, 2, 2])
+    distances = numpy.array([0.1, 0.05, 0.2, 0.15])
+    clusters = audit_reina._clusters(pairs_a, pairs_b, distances)
+    assert clusters == [([0, 1, 2, 7], 0.2), ([5, 6], 0.05)]
+
+
+@pytest.mark.parametrize('block', [7, 64, audit_reina.audit_block])
+def test_blocks_give_the_brute_force_answer(block):
+    encodings = _gallery(150)
+    keys = ['p{}'.format(i) for i in range(150)]
+    for i in range(20, 40):
+        keys[i] = 'team/{}'.format(i)
+    for i in range(60, 80):
+        encodings[i + 20] = encodings[i] + numpy.random.default_rng(i).normal(0, 0.03, gallery_reina.encoding_dim)
+
+    report = audit_reina.audit_gallery(keys, encodings.astype(numpy.float32), 0.5, 0.25, block=block)
+    pairs = sorted(tuple(sorted((pair['a'], pair['b']))) for pair in report['lookalike_pairs'])
+    expected = _brute_force_lookalikes(keys, encodings.astype(numpy.float32).astype(numpy.float64), 0.5)
+    assert len(expected) >= 20
+    assert report['lookalike_count'] == len(expected)
+    assert pairs == sorted(tuple(sorted(pair)) for pair in expected)
+    assert [pair['distance'] for pair in report['lookalike_pairs']] == sorted(
+        pair['distance'] for pair in report['lookalike_pairs'])
+
+
+def test_duplicates_across_identities_are_clustered():
+    encodings = _gallery(50)
+    encodings[1] = encodings[0]
+    encodings[2] = encodings[0] + 0.001
+    encodings[11] = encodings[10]
+    keys = ['p{}'.format(i) for i in range(50)]
+    keys[10], keys[11] = 'sam/1', 'sam/2'
+
+    report = audit_reina.audit_gallery(keys, encodings, 0.5, 0.25)
+    clusters = {tuple(cluster['keys']): cluster['identities'] for cluster in report['duplicate_clusters']}
+    assert clusters == {('p0', 'p1', 'p2'): ['p0', 'p1', 'p2'], ('sam/1', 'sam/2'): ['sam']}
+
+    # the same person enrolled twice is a duplicate but not a lookalike
+    # 同一个人录入两次是重复录入, 但不是容易混淆的身份
+    assert all('sam/1' not in (pair['a'], pair['b']) for pair in report['lookalike_pairs'])
+
+    # the mislabeled duplicates do not drag the suggested threshold down to 0
+    # 标错名字的重复录入不会把建议阈值拉低到0
+    assert report['suggested_threshold'] > 0.3
+
+
+def test_one_identity_has_no_threshold():
+    report = audit_reina.audit_gallery(['sam/1', 'sam/2'], _gallery(2))
+    assert report['suggested_threshold'] is None
+    assert report['nearest_other_identity'] == {'p01': None, 'p05': None, 'p50': None}
+    assert 'no threshold' in audit_reina.format_report(report)
+
+
+def test_audit_store_reads_the_alive_rows(tmp_path):
+    encodings = _gallery(10)
+    encodings[1] = encodings[0]
+    store = gallery_reina.EncodingStore(str(tmp_path) + '/')
+    store.append(['p{}'.format(i) for i in range(10)], encodings)
+    assert len(audit_reina.audit_store(store)['duplicate_clusters']) == 1
+
+    store.delete(['p1'])
+    report = audit_reina.audit_store(store)
+    assert report['encodings'] == 9
+    assert report['duplicate_clusters'] == []
+    assert report['version'] == store.version
@@ -0,0 +1,155 @@
+'''
+@author Reina
+@desc facekit_reina.update_encoding_store的测试: 隔离, 检查点与继续被中断的构建
+face_recognition被sys.modules中的假模块代替, 不需要dlib
+description:
+tests of facekit_reina.update_encoding_store: quarantine, checkpoints and resuming an interrupted build
+face_recognition is replaced by a fake module in sys.modules, dlib is not needed
+'''
+
+#coding=utf-8
+
+import json
+import os
+import sys
+import types
+
+import numpy
+import pytest
+
+import facekit_reina
+import gallery_reina
+import lazy_reina
+
+# first byte of a fake image: no face, two faces, unreadable, anything else is one face
+# 假图片的第一个字节: 没有人脸, 两张人脸, 无法读取, 其他值为一张人脸
+no_face = 0
+two_faces = 1
+unreadable = 255
+
+
+# fake face_recognition: the image is its first byte, the encoding of a face is filled with that byte
+# 假的face_recognition: 图片即第一个字节, 人脸的编码用这个字节填充
+@pytest.fixture
+def fake_face_recognition(monkeypatch):
+    fake = types.ModuleType('face_recognition')
+    fake.encoded = []
+
+    def load_image_file(filename_withpath):
+        with open(filename_withpath, 'rb') as image_file:
+            value = image_file.read(1)[0]
+        if value == unreadable:
+            raise OSError('cannot identify image file')
+        return numpy.full((8, 8, 3), value, numpy.uint8)
+
+    def face_locations(image, number_of_times_to_upsample=1, model='hog'):
+        return {no_face: [], two_faces: [(1, 5, 5, 1), (2, 6, 6, 2)]}.get(int(image[0, 0, 0]), [(1, 5, 5, 1)])
+
+    def face_encodings(image, known_face_locations=None):
+        fake.encoded.append(int(image[0, 0, 0]))
+        return [numpy.full(gallery_reina.encoding_dim, image[0, 0, 0] / 1000.0) for _ in known_face_locations]
+
+    fake.load_image_file = load_image_file
+    fake.face_locations = face_locations
+    fake.face_encodings = face_encodings
+
+    # the proxy imports the fake on its next use
+    # 代理在下一次使用时导入假模块
+    monkeypatch.setitem(sys.modules, 'face_recognition', fake)
+    monkeypatch.setattr(lazy_reina.face_recognition, '_module', None)
+    monkeypatch.setattr(facekit_reina, 'warm_up', lambda config=None: 0.0)
+    return fake
+
+
+@pytest.fixture
+def known_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(facekit_reina, 'json_path', str(tmp_path / '.json') + '/')
+    os.makedirs(str(tmp_path / 'known'))
+    return str(tmp_path / 'known') + '/'
+
+
+def _write(known_path, images):
+    for filename, value in images.items():
+        with open(known_path + filename, 'wb') as image_file:
+            image_file.write(bytes([value]))
+
+
+def _quarantine():
+    with open(facekit_reina.json_path + facekit_reina.quarantine_json, 'r', encoding='utf-8') as quarantine_file:
+        return json.load(quarantine_file)
+
+
+def test_bad_images_are_quarantined(fake_face_recognition, known_path):
+    _write(known_path, {'alice.jpg': 10, 'nobody.jpg': no_face, 'crowd.jpg': two_faces, 'broken.jpg': unreadable})
+    store = facekit_reina.update_encoding_store(known_path, workers=1)
+
+    keys, encodings = store.alive()
+    assert keys == ['alice']
+    numpy.testing.assert_allclose(encodings[0], 0.01)
+    quarantine = _quarantine()
+    assert {filename: entry['reason'] for filename, entry in quarantine.items()} == {
+        'nobody.jpg': 'no_face', 'crowd.jpg': 'multiple_faces', 'broken.jpg': 'failed'}
+    assert 'cannot identify image file' in quarantine['broken.jpg']['error']
+
+    # nothing changed: nothing is encoded again and the quarantine is kept
+    # 没有变化: 不重新编码, 隔离列表保留
+    del fake_face_recognition.encoded[:]
+    facekit_reina.update_encoding_store(known_path, workers=1)
+    assert fake_face_recognition.encoded == []
+    assert set(_quarantine()) == {'nobody.jpg', 'crowd.jpg', 'broken.jpg'}
+
+
+def test_a_fixed_image_leaves_the_quarantine(fake_face_recognition, known_path):
+    _write(known_path, {'alice.jpg': 10, 'bob.jpg': no_face})
+    facekit_reina.update_encoding_store(known_path, workers=1)
+    assert set(_quarantine()) == {'bob.jpg'}
+
+    _write(known_path, {'bob.jpg': 20})
+    os.utime(known_path + 'bob.jpg', (1, 1))
+    store = facekit_reina.update_encoding_store(known_path, workers=1)
+    assert sorted(store.alive()[0]) == ['alice', 'bob']
+    assert _quarantine() == {}
+
+
+def test_rows_are_appended_at_every_checkpoint(fake_face_recognition, known_path, monkeypatch):
+    _write(known_path, {'p{}.jpg'.format(i): 10 + i for i in range(5)})
+    monkeypatch.setattr(facekit_reina, 'checkpoint_interval', 2)
+    batches = []
+    append = gallery_reina.EncodingStore.append
+
+    def counted_append(self, keys, encodings):
+        batches.append(len(keys))
+        return append(self, keys, encodings)
+    monkeypatch.setattr(gallery_reina.EncodingStore, 'append', counted_append)
+
+    store = facekit_reina.update_encoding_store(known_path, workers=1)
+    assert batches == [2, 2, 1]
+    assert store.alive()[0] == ['p0', 'p1', 'p2', 'p3', 'p4']
+
+
+def test_an_interrupted_build_resumes_after_the_last_checkpoint(fake_face_recognition, known_path, monkeypatch):
+    _write(known_path, {'p{}.jpg'.format(i): 10 + i for i in range(5)})
+    _write(known_path, {'nobody.jpg': no_face})
+    monkeypatch.setattr(facekit_reina, 'checkpoint_interval', 3)
+    append = gallery_reina.EncodingStore.append
+
+    # the build is killed at its second checkpoint
+    # 构建在第二个检查点被终止
+    def interrupted_append(self, keys, encodings):
+        if len(self) != 0:
+            raise KeyboardInterrupt
+        return append(self, keys, encodings)
+    monkeypatch.setattr(gallery_reina.EncodingStore, 'append', interrupted_append)
+    with pytest.raises(KeyboardInterrupt):
+        facekit_reina.update_encoding_store(known_path, workers=1)
+    assert not os.path.exists(facekit_reina.json_path + facekit_reina.modate_json)
+
+    # the images before the checkpoint (the quarantined one included) are not encoded again
+    # 检查点之前的图片 (包括被隔离的图片) 不会被重新编码
+    monkeypatch.setattr(gallery_reina.EncodingStore, 'append', append)
+    del fake_face_recognition.encoded[:]
+    store = facekit_reina.update_encoding_store(known_path, workers=1)
+    assert fake_face_recognition.encoded == [12, 13, 14]
+    assert store.alive()[0] == ['p0', 'p1', 'p2', 'p3', 'p4']
+    assert set(_quarantine()) == {'nobody.jpg'}
+    assert os.path.exists(facekit_reina.json_path + facekit_reina.modate_json)
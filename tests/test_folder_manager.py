@@ -0,0 +1,126 @@
+'''
+@author Reina
+@desc folder_manager_reina的测试: 新增, 删除, 重命名, 只被touch的文件与旧的状态格式
+description:
+tests of folder_manager_reina: new, deleted and renamed files, touched files and the legacy state format
+'''
+
+#coding=utf-8
+
+import json
+import os
+
+import folder_manager_reina
+
+
+def _write(folder, name, content):
+    with open(os.path.join(str(folder), name), 'wb') as target_file:
+        target_file.write(content)
+
+
+# move the modification time of a file without changing its content
+# 只改变文件的修改时间, 不改变内容
+def _touch(folder, name, seconds=10):
+    file_with_path = os.path.join(str(folder), name)
+    mtime = os.stat(file_with_path).st_mtime + seconds
+    os.utime(file_with_path, (mtime, mtime))
+
+
+def _folder(tmp_path, files):
+    folder = tmp_path / 'known'
+    folder.mkdir()
+    for name, content in files.items():
+        _write(folder, name, content)
+    return folder
+
+
+def test_a_saved_folder_is_unchanged(tmp_path):
+    folder = _folder(tmp_path, {'a.jpg': b'a', 'b.jpg': b'b'})
+    state_json = str(tmp_path / 'modate.json')
+    is_changed, change = folder_manager_reina.get_change_and_renew(str(folder), state_json)
+    assert is_changed
+    assert change == {'new': ['a.jpg', 'b.jpg'], 'deleted': [], 'renamed': []}
+
+    assert folder_manager_reina.get_change(str(folder), state_json)[:2] == (False, {'new': [], 'deleted': [], 'renamed': []})
+
+
+def test_new_modified_and_deleted_files(tmp_path):
+    folder = _folder(tmp_path, {'a.jpg': b'a', 'b.jpg': b'b', 'c.jpg': b'c'})
+    state_json = str(tmp_path / 'modate.json')
+    folder_manager_reina.get_change_and_renew(str(folder), state_json)
+
+    _write(folder, 'b.jpg', b'bigger b')
+    os.remove(str(folder / 'c.jpg'))
+    _write(folder, 'd.jpg', b'd')
+    is_changed, change = folder_manager_reina.get_change_and_renew(str(folder), state_json)
+    assert is_changed
+    assert change == {'new': ['b.jpg', 'd.jpg'], 'deleted': ['c.jpg'], 'renamed': []}
+
+
+def test_without_hash_a_rename_is_a_delete_and_a_new_file(tmp_path):
+    folder = _folder(tmp_path, {'a.jpg': b'a'})
+    state_json = str(tmp_path / 'modate.json')
+    folder_manager_reina.get_change_and_renew(str(folder), state_json)
+
+    os.rename(str(folder / 'a.jpg'), str(folder / 'alice.jpg'))
+    change = folder_manager_reina.get_change(str(folder), state_json)[1]
+    assert change == {'new': ['alice.jpg'], 'deleted': ['a.jpg'], 'renamed': []}
+
+
+def test_with_hash_a_rename_is_paired(tmp_path):
+    folder = _folder(tmp_path, {'a.jpg': b'a', 'b.jpg': b'b'})
+    state_json = str(tmp_path / 'modate.json')
+    folder_manager_reina.get_change_and_renew(str(folder), state_json, use_hash=True)
+
+    os.rename(str(folder / 'a.jpg'), str(folder / 'alice.jpg'))
+    change = folder_manager_reina.get_change(str(folder), state_json, use_hash=True)[1]
+    assert change == {'new': [], 'deleted': [], 'renamed': [['a.jpg', 'alice.jpg']]}
+
+
+def test_a_touched_file_is_unchanged_only_with_hash(tmp_path):
+    folder = _folder(tmp_path, {'a.jpg': b'a'})
+    state_json = str(tmp_path / 'modate.json')
+    folder_manager_reina.get_change_and_renew(str(folder), state_json, use_hash=True)
+
+    _touch(folder, 'a.jpg')
+    assert folder_manager_reina.get_change(str(folder), state_json)[1]['new'] == ['a.jpg']
+    is_changed, change, new_state = folder_manager_reina.get_change(str(folder), state_json, use_hash=True)
+    assert not is_changed
+    # the hash of the touched file is kept for the next comparison
+    # 被touch的文件的哈希被保留, 用于下一次比较
+    assert new_state['a.jpg']['hash'] == folder_manager_reina.file_hash(str(folder / 'a.jpg'))
+
+
+def test_renames_with_duplicate_hashes(tmp_path):
+    folder = _folder(tmp_path, {'a.jpg': b'same', 'b.jpg': b'same', 'c.jpg': b'same'})
+    state_json = str(tmp_path / 'modate.json')
+    folder_manager_reina.get_change_and_renew(str(folder), state_json, use_hash=True)
+
+    # three copies of the same content, two renamed and one deleted
+    # 相同内容的三个副本, 两个被重命名, 一个被删除
+    os.rename(str(folder / 'a.jpg'), str(folder / 'x.jpg'))
+    os.rename(str(folder / 'b.jpg'), str(folder / 'y.jpg'))
+    os.remove(str(folder / 'c.jpg'))
+    change = folder_manager_reina.get_change(str(folder), state_json, use_hash=True)[1]
+    assert change == {'new': [], 'deleted': ['c.jpg'], 'renamed': [['a.jpg', 'x.jpg'], ['b.jpg', 'y.jpg']]}
+
+
+def test_load_state_converts_the_legacy_format(tmp_path):
+    folder = _folder(tmp_path, {'a.jpg': b'a', 'b.jpg': b'b'})
+    state_json = str(tmp_path / 'modate.json')
+    with open(state_json, 'w', encoding='utf-8') as json_file:
+        json.dump({'a.jpg': os.stat(str(folder / 'a.jpg')).st_mtime, 'gone.jpg': 1.0}, json_file)
+
+    assert folder_manager_reina.load_state(state_json)['gone.jpg'] == {'size': None, 'mtime': 1.0, 'hash': None}
+    # an unknown size is not a change
+    # 未知的大小不算变化
+    change = folder_manager_reina.get_change(str(folder), state_json)[1]
+    assert change == {'new': ['b.jpg'], 'deleted': ['gone.jpg'], 'renamed': []}
+
+
+def test_missing_or_corrupt_state_is_empty(tmp_path):
+    state_json = str(tmp_path / 'modate.json')
+    assert folder_manager_reina.load_state(state_json) == {}
+    with open(state_json, 'w', encoding='utf-8') as json_file:
+        json_file.write('{"a.jpg": ')
+    assert folder_manager_reina.load_state(state_json) == {}
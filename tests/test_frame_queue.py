@@ -0,0 +1,71 @@
+'''
+@author Reina
+@desc stream_reina.FrameQueue丢帧策略的测试
+description:
+tests of the drop policies of stream_reina.FrameQueue
+'''
+
+#coding=utf-8
+
+import threading
+
+import pytest
+
+import stream_reina
+
+
+def _drain(frame_queue):
+    items = []
+    while len(frame_queue) != 0:
+        items.append(frame_queue.get())
+    return items
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        stream_reina.FrameQueue(2, 'drop_random')
+
+
+def test_drop_oldest_keeps_the_latest_frames():
+    dropped = []
+    frame_queue = stream_reina.FrameQueue(3, 'drop_oldest', on_drop=dropped.append)
+    for frame in range(7):
+        frame_queue.put(frame)
+    assert _drain(frame_queue) == [4, 5, 6]
+    assert dropped == [0, 1, 2, 3]
+    assert frame_queue.dropped == 4
+
+
+def test_drop_newest_keeps_the_first_frames():
+    dropped = []
+    frame_queue = stream_reina.FrameQueue(3, 'drop_newest', on_drop=dropped.append)
+    for frame in range(7):
+        frame_queue.put(frame)
+    assert _drain(frame_queue) == [0, 1, 2]
+    assert dropped == [3, 4, 5, 6]
+    assert frame_queue.dropped == 4
+
+
+def test_block_waits_and_drops_nothing():
+    frame_queue = stream_reina.FrameQueue(2, 'block')
+    producer = threading.Thread(target=lambda: [frame_queue.put(frame) for frame in range(6)])
+    producer.start()
+    received = [frame_queue.get() for _ in range(6)]
+    producer.join(timeout=5)
+    assert received == list(range(6))
+    assert frame_queue.dropped == 0
+
+
+def test_the_end_marker_waits_instead_of_dropping():
+    frame_queue = stream_reina.FrameQueue(2, 'drop_oldest')
+    frame_queue.put('a')
+    frame_queue.put('b')
+
+    # the queue is full, the end marker waits for room instead of dropping 'a'
+    # 队列已满, 结束标记等待空位而不是丢弃'a'
+    ender = threading.Thread(target=frame_queue.put_end)
+    ender.start()
+    received = [frame_queue.get(), frame_queue.get(), frame_queue.get()]
+    ender.join(timeout=5)
+    assert received == ['a', 'b', stream_reina._end_of_stream]
+    assert frame_queue.dropped == 0
@@ -0,0 +1,122 @@
+'''
+@author Reina
+@desc gallery_reina.EncodingStore的测试: 追加, 墓碑, 重命名, 压缩与崩溃恢复
+description:
+tests of gallery_reina.EncodingStore: append, tombstones, rename, compaction and crash recovery
+'''
+
+#coding=utf-8
+
+import os
+
+import numpy
+import pytest
+
+import gallery_reina
+
+
+def test_append_is_loaded_again(make_store, random_encodings):
+    encodings = random_encodings(5)
+    store = make_store(['k{}'.format(i) for i in range(5)], encodings)
+
+    loaded = gallery_reina.EncodingStore(store.store_path)
+    keys, matrix = loaded.alive()
+    assert loaded.exists()
+    assert keys == ['k0', 'k1', 'k2', 'k3', 'k4']
+    numpy.testing.assert_array_equal(matrix, encodings)
+    assert loaded.version == store.version
+    assert loaded.store_id == store.store_id
+
+
+def test_replaced_key_leaves_a_tombstone(make_store, random_encodings):
+    encodings = random_encodings(3)
+    store = make_store(['a', 'b', 'c'], encodings)
+    store.append(['b'], encodings[:1])
+
+    assert len(store) == 3
+    assert store.deleted == {1}
+    assert store.to_dict()['b'] == pytest.approx(encodings[0].astype(numpy.float64))
+
+
+def test_delete_and_rename_keep_the_rows(make_store, random_encodings):
+    encodings = random_encodings(3)
+    store = make_store(['a', 'b', 'c'], encodings)
+    store.delete(['a', 'missing'])
+    store.rename([['b', 'bob'], ['missing', 'x']])
+
+    loaded = gallery_reina.EncodingStore(store.store_path)
+    keys, matrix = loaded.alive()
+    assert keys == ['bob', 'c']
+    numpy.testing.assert_array_equal(matrix, encodings[1:])
+    assert loaded.generation == 0
+
+
+def test_compact_drops_the_tombstones(make_store, random_encodings):
+    encodings = random_encodings(6)
+    store = make_store(['k{}'.format(i) for i in range(6)], encodings)
+    store.delete(['k0', 'k2'])
+    assert store.compact_if_needed()
+
+    loaded = gallery_reina.EncodingStore(store.store_path)
+    keys, matrix = loaded.alive()
+    assert loaded.generation == 1
+    assert loaded.deleted == set()
+    assert keys == ['k1', 'k3', 'k4', 'k5']
+    numpy.testing.assert_array_equal(matrix, encodings[[1, 3, 4, 5]])
+
+    # only the matrix named by the index is left
+    # 只留下索引中记录的矩阵
+    assert sorted(os.listdir(store.store_path)) == [gallery_reina.matrix_filename(1), gallery_reina.store_index]
+
+
+def test_crash_before_the_index_keeps_the_old_store(make_store, random_encodings, monkeypatch):
+    encodings = random_encodings(4)
+    store = make_store(['a', 'b', 'c', 'd'], encodings)
+    store.delete(['a'])
+
+    def crash(self):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(gallery_reina.EncodingStore, '_save_index', crash)
+    with pytest.raises(KeyboardInterrupt):
+        store.compact()
+    monkeypatch.undo()
+
+    loaded = gallery_reina.EncodingStore(store.store_path)
+    keys, matrix = loaded.alive()
+    assert loaded.generation == 0
+    assert keys == ['b', 'c', 'd']
+    numpy.testing.assert_array_equal(matrix, encodings[1:])
+
+    # the next compaction replaces the file left by the crash
+    # 下一次压缩替换崩溃留下的文件
+    loaded.compact()
+    assert gallery_reina.EncodingStore(store.store_path).alive()[0] == ['b', 'c', 'd']
+
+
+def test_rows_of_an_interrupted_append_are_ignored(make_store, random_encodings):
+    encodings = random_encodings(3)
+    store = make_store(['a', 'b'], encodings[:2])
+    with open(store.matrix_file, 'ab') as matrix_file:
+        matrix_file.write(b'\0' * 100)
+
+    loaded = gallery_reina.EncodingStore(store.store_path)
+    assert len(loaded) == 2
+    loaded.append(['c'], encodings[2:])
+    numpy.testing.assert_array_equal(gallery_reina.EncodingStore(store.store_path).alive()[1], encodings)
+
+
+def test_a_rebuilt_store_gets_another_store_id(make_store, random_encodings):
+    store = make_store(['a'], random_encodings(1))
+    old_store_id = store.store_id
+    for filename in os.listdir(store.store_path):
+        os.remove(os.path.join(store.store_path, filename))
+
+    rebuilt = make_store(['a'], random_encodings(1, seed=1))
+    assert rebuilt.version == store.version
+    assert rebuilt.store_id != old_store_id
+
+
+def test_an_index_without_its_matrix_is_no_store(make_store, random_encodings):
+    store = make_store(['a'], random_encodings(1))
+    os.remove(store.matrix_file)
+    assert not gallery_reina.EncodingStore(store.store_path).exists()
@@ -0,0 +1,71 @@
+'''
+@author Reina
+@desc quality_reina人脸质量检查的测试
+description:
+tests of the face quality checks of quality_reina
+'''
+
+#coding=utf-8
+
+import numpy
+import pytest
+
+import quality_reina
+
+
+def _landmarks(nose_x, roll=0.0):
+    # 5-point landmarks of a face 40 pixels between the eyes, rotated by roll (radians) around the middle of the eyes
+    # 两眼相距40像素的5点特征点, 绕两眼中点旋转roll(弧度)
+    points = {'left_eye': [(-25, 0), (-15, 0)], 'right_eye': [(15, 0), (25, 0)], 'nose_tip': [(nose_x, 20)]}
+    rotation = numpy.array([[numpy.cos(roll), -numpy.sin(roll)], [numpy.sin(roll), numpy.cos(roll)]])
+    return {name: [tuple(rotation @ numpy.array(point) + 100) for point in group] for name, group in points.items()}
+
+
+def _config(**thresholds):
+    config = {'min_face_size': None, 'min_sharpness': None, 'max_yaw': None}
+    config.update(thresholds)
+    return config
+
+
+def test_face_size_is_the_shorter_side():
+    assert quality_reina.face_size((10, 70, 50, 20)) == 40
+    assert quality_reina.face_size((50, 20, 10, 70)) == 40
+
+
+def test_yaw_of_frontal_turned_and_rolled_faces():
+    assert quality_reina.yaw(_landmarks(0)) == pytest.approx(0.0)
+    assert quality_reina.yaw(_landmarks(10)) == pytest.approx(0.5)
+    assert quality_reina.yaw(_landmarks(-40)) == 1.0
+
+    # a tilted head is not a turned one
+    # 歪头不是转头
+    assert quality_reina.yaw(_landmarks(0, roll=0.5)) == pytest.approx(0.0, abs=1e-9)
+
+
+def test_sharpness_is_lower_for_a_blurred_face():
+    cv2 = pytest.importorskip('cv2')
+    image = numpy.random.default_rng(0).integers(0, 256, (200, 200, 3), dtype=numpy.uint8)
+    blurred = cv2.GaussianBlur(image, (15, 15), 5)
+    face_location = (20, 180, 180, 20)
+    assert quality_reina.sharpness(blurred, face_location) < quality_reina.sharpness(image, face_location) / 10
+
+    # the score does not depend much on the size of the face
+    # 分数与人脸的大小关系不大
+    large = cv2.resize(image[20:100, 20:100], (160, 160), interpolation=cv2.INTER_NEAREST)
+    assert quality_reina.sharpness(large, (0, 160, 160, 0)) > quality_reina.sharpness(blurred, face_location)
+
+    # a box outside the image has nothing to measure
+    # 图片之外的检测框没有可测量的内容
+    assert quality_reina.sharpness(image, (300, 400, 400, 300)) == 0.0
+
+
+def test_assess_faces_reports_the_first_failed_check():
+    cv2 = pytest.importorskip('cv2')
+    image = numpy.random.default_rng(0).integers(0, 256, (200, 200, 3), dtype=numpy.uint8)
+    image[100:, 100:] = cv2.GaussianBlur(image, (31, 31), 10)[100:, 100:]
+    face_locations = [(0, 90, 90, 0), (100, 200, 200, 100), (0, 10, 10, 0)]
+
+    assert quality_reina.assess_faces(image, face_locations, _config()) == [None, None, None]
+    assert quality_reina.assess_faces(image, face_locations, _config(min_face_size=20)) == [None, None, 'size']
+    failed = quality_reina.assess_faces(image, face_locations, _config(min_face_size=20, min_sharpness=50))
+    assert failed == [None, 'sharpness', 'size']
@@ -0,0 +1,55 @@
+'''
+@author Reina
+@desc gallery_reina.QuantizedSearcher的测试: 与精确的FaceMatcher结果相同, 以及gallery_version中记录的搜索方式
+description:
+tests of gallery_reina.QuantizedSearcher: same results as the exact FaceMatcher, and the search recorded in gallery_version
+'''
+
+#coding=utf-8
+
+import numpy
+import pytest
+
+import facekit_reina
+import gallery_reina
+
+
+# probes near some gallery rows (matched) and far from all of them (unknown)
+# 靠近某些人脸库行的探针 (匹配) 与远离所有行的探针 (unknown)
+def _probes(encodings, count, seed=1):
+    random = numpy.random.default_rng(seed)
+    near = encodings[random.choice(len(encodings), count, replace=False)] + random.normal(0, 0.05, (count, encodings.shape[1]))
+    far = random.normal(size=(count, encodings.shape[1]))
+    return numpy.concatenate([near, far]).astype(numpy.float32)
+
+
+@pytest.mark.parametrize('rerank', [8, facekit_reina.quantized_rerank])
+def test_quantized_search_matches_the_exact_search(random_encodings, rerank):
+    encodings = random_encodings(2000) * 0.2
+    keys = ['p{}'.format(i) for i in range(len(encodings))]
+    probes = _probes(encodings, 100)
+
+    exact = gallery_reina.build_matcher(keys, encodings, 0.6).match(probes)
+    quantized = gallery_reina.build_matcher(keys, encodings, 0.6,
+                                            searcher=gallery_reina.QuantizedSearcher(encodings, rerank)).match(probes)
+
+    assert [face['name'] for face in quantized] == [face['name'] for face in exact]
+    assert [face['nearest'] for face in quantized] == [face['nearest'] for face in exact]
+    assert [face['runner_up'] for face in quantized] == [face['runner_up'] for face in exact]
+    assert [face['distance'] for face in quantized] == pytest.approx([face['distance'] for face in exact], abs=1e-5)
+    assert [face['runner_up_distance'] for face in quantized] == pytest.approx(
+        [face['runner_up_distance'] for face in exact], abs=1e-5)
+    # both kinds of probes are really there
+    # 两类探针确实都存在
+    assert 0 < sum(face['name'] != gallery_reina.unknown_name for face in exact) < len(probes)
+
+
+def test_gallery_version_records_the_exact_or_quantized_search(make_store, random_encodings, monkeypatch):
+    store = make_store(['alice', 'bob', 'carol'], random_encodings(3))
+    assert facekit_reina.get_matcher(store, 0.5, False).gallery_version.endswith(':0.5:exact')
+
+    monkeypatch.setattr(facekit_reina, 'use_quantized_search', True)
+    monkeypatch.setattr(facekit_reina, 'quantized_rerank', 16)
+    matcher = facekit_reina.get_matcher(store, 0.5, False)
+    assert isinstance(matcher.searcher, gallery_reina.QuantizedSearcher)
+    assert matcher.gallery_version.endswith(':0.5:int8x16')
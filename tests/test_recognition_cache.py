@@ -0,0 +1,98 @@
+'''
+@author Reina
+@desc cache_reina.RecognitionCache与匹配结果缓存键的测试
+description:
+tests of cache_reina.RecognitionCache and of the cache key of the match results
+'''
+
+#coding=utf-8
+
+import os
+
+import numpy
+
+import cache_reina
+import facekit_reina
+import gallery_reina
+
+
+def _cache(tmp_path, max_entries=cache_reina.default_max_entries):
+    return cache_reina.RecognitionCache(str(tmp_path / 'cache' / 'recognition.sqlite'), max_entries)
+
+
+def test_face_key_depends_on_content_and_settings(tmp_path):
+    cache = _cache(tmp_path)
+    config = facekit_reina.get_detection_config()
+    key = cache.face_key(b'image', config)
+    assert key == cache.face_key(b'image', dict(config))
+    assert key != cache.face_key(b'other image', config)
+    assert key != cache.face_key(b'image', facekit_reina.get_detection_config({'upsample': 2}))
+
+
+def test_faces_roundtrip(tmp_path):
+    cache = _cache(tmp_path)
+    encodings = numpy.random.default_rng(0).normal(size=(2, cache_reina.encoding_dim))
+    cache.put_faces('with', [(1, 2, 3, 4), (5, 6, 7, 8)], encodings)
+    cache.put_faces('without', [(1, 2, 3, 4)])
+
+    face_locations, cached = cache.get_faces('with')
+    assert face_locations == [(1, 2, 3, 4), (5, 6, 7, 8)]
+    numpy.testing.assert_array_equal(cached, encodings)
+
+    # locations saved without encodings only serve the callers which do not need encodings
+    # 没有编码的位置只服务不需要编码的调用者
+    assert cache.get_faces('without') is None
+    assert cache.get_faces('without', need_encodings=False) == ([(1, 2, 3, 4)], None)
+    assert cache.get_faces('missing') is None
+    stats = cache.stats()
+    assert (stats['face_hits'], stats['face_misses'], stats['face_entries']) == (2, 2, 2)
+
+
+def test_matches_are_keyed_by_gallery_version(tmp_path):
+    cache = _cache(tmp_path)
+    results = [{'name': 'alice', 'distance': 0.3}]
+    cache.put_matches('face', 'v1', results)
+    assert cache.get_matches('face', 'v1') == results
+    assert cache.get_matches('face', 'v2') is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = _cache(tmp_path, max_entries=2)
+    for key in ('a', 'b', 'c'):
+        cache.put_matches(key, 'v', [])
+    cache._db().execute("UPDATE matches SET last_used = 0 WHERE key = 'b@v'")
+    cache.evict()
+    assert cache.get_matches('b', 'v') is None
+    assert cache.get_matches('a', 'v') == [] and cache.get_matches('c', 'v') == []
+
+
+def test_gallery_version_changes_with_the_gallery(make_store, random_encodings):
+    store = make_store(['alice', 'bob'], random_encodings(2))
+    version = facekit_reina.get_matcher(store, 0.5, False).gallery_version
+    assert facekit_reina.get_matcher(store, 0.5, False).gallery_version == version
+    assert facekit_reina.get_matcher(store, 0.4, False).gallery_version != version
+
+    store.append(['carol'], numpy.zeros(gallery_reina.encoding_dim))
+    assert facekit_reina.get_matcher(store, 0.5, False).gallery_version != version
+
+
+def test_a_rebuilt_store_never_reuses_a_gallery_version(make_store, random_encodings):
+    store = make_store(['alice', 'bob'], random_encodings(2))
+    store_path = store.store_path
+    version = facekit_reina.get_matcher(store, 0.5, False).gallery_version
+    for filename in os.listdir(store_path):
+        os.remove(os.path.join(store_path, filename))
+
+    # the rebuilt store has the same path and the same store version
+    # 重建的人脸库有相同的路径与相同的版本
+    rebuilt = make_store(['alice', 'bob'], random_encodings(2, seed=1))
+    assert rebuilt.version == store.version
+    assert facekit_reina.get_matcher(rebuilt, 0.5, False).gallery_version != version
+
+
+def test_gallery_version_records_the_template_search(make_store, random_encodings, monkeypatch):
+    store = make_store(['alice/1', 'alice/2', 'bob'], random_encodings(3))
+    monkeypatch.setattr(facekit_reina, 'use_quantized_search', True)
+    matcher = facekit_reina.get_matcher(store, 0.5, False)
+    assert isinstance(matcher, gallery_reina.TemplateMatcher)
+    assert matcher.gallery_version.split(':')[-1].startswith('template')
@@ -0,0 +1,528 @@
+'''
+@author Reina
+@desc 视频的隔帧检测与光流跟踪
+描述 :
+人脸在相邻帧之间移动很少, 不需要每帧都检测
+每N帧(或跟踪置信度下降时)完整地检测, 编码和匹配一次
+中间的帧用Lucas-Kanade光流移动人脸框, 沿用上次的识别结果
+- FaceTracker类: 隔帧检测加光流跟踪的识别器
+- process_a_video函数: 使用FaceTracker识别一个视频(文件, 摄像头或url)并写入带标注的视频
+- process_a_video_file函数: 将视频文件按帧范围分块, 在多个进程中并行识别, 按顺序合并为JSONL时间线(和带标注的视频)
+
+description:
+detect every N frames and track with optical flow in between, for video sources
+faces move very little between frames, so there is no need to detect on every frame
+full detection, encoding and matching runs every N frames (or when the tracking confidence drops)
+the frames in between move the boxes with Lucas-Kanade optical flow and keep the last identities
+- class: FaceTracker: recognizer with detection every N frames and optical flow tracking
+- function: process_a_video: recognize a video (file, camera or url) with FaceTracker and write the annotated video
+- function: process_a_video_file: split a video file into frame ranges, recognize them in parallel worker processes,
+                                  merge them in order into a JSONL timeline (and an annotated video)
+'''
+
+#coding=utf-8
+
+import facekit_reina
+import gallery_reina
+
+import os
+import time
+import shutil
+import tempfile
+import subprocess
+import numpy
+import multiprocessing
+
+# cv2 is imported on its first use ('from cv2 import cv2' on wsl, else 'import cv2'), see lazy_reina
+# cv2在第一次使用时才导入 (WSL上为'from cv2 import cv2', 否则为'import cv2'), 见lazy_reina
+from lazy_reina import cv2
+
+
+###------------------预定义变量 predefinition------------------###
+
+# full detection every detect_interval frames
+# 每detect_interval帧完整检测一次
+default_detect_interval = 10
+
+# detect again when the ratio of tracked points of a face falls below it
+# 一张人脸被跟踪到的特征点比例低于它时重新检测
+default_min_confidence = 0.6
+
+# at least this number of frames between two detections triggered by low confidence
+# 两次因为置信度低而触发的检测之间至少相隔的帧数
+default_min_redetect_interval = 2
+
+# parameters of the feature points inside a face box (cv2.goodFeaturesToTrack)
+# 人脸框内特征点的参数 (cv2.goodFeaturesToTrack)
+feature_params = {'maxCorners': 30, 'qualityLevel': 0.01, 'minDistance': 3}
+
+# parameters of the optical flow (cv2.calcOpticalFlowPyrLK)
+# the criteria type 3 is cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, written out so importing does not load cv2
+# 光流的参数 (cv2.calcOpticalFlowPyrLK)
+# criteria的类型3即cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 直接写出以免导入时加载cv2
+flow_params = {'winSize': (15, 15), 'maxLevel': 2, 'criteria': (3, 10, 0.03)}
+
+# a face with fewer tracked points than it is lost
+# 被跟踪的特征点少于它的人脸视为丢失
+min_track_points = 4
+
+# frames per chunk of process_a_video_file, every chunk starts with a full detection
+# process_a_video_file中每块的帧数, 每块都从一次完整检测开始
+default_chunk_frames = 300
+
+
+###------------------跟踪模块 tracking module------------------###
+
+#==============================================================
+# recognizer for video frames: detect every N frames, track with optical flow in between
+# the detector budget is at most fps / detect_interval scheduled detections per second,
+# plus at most fps / min_redetect_interval when the tracking confidence drops
+# 视频帧的识别器: 每N帧检测一次, 中间的帧用光流跟踪
+# 检测器的开销最多为每秒 fps / detect_interval 次定时检测,
+# 加上跟踪置信度下降时最多每秒 fps / min_redetect_interval 次
+# @parameter:
+# - known_encoding_dict:    known encoding dictionary, EncodingStore or FaceMatcher
+#                           已知的编码字典, EncodingStore或FaceMatcher
+# - detect_interval:        full detection every detect_interval frames (1 to detect on every frame)
+#                           每detect_interval帧完整检测一次 (1则每帧都检测)
+# - min_confidence:         detect again when a face has a lower ratio of tracked points
+#                           一张人脸被跟踪到的特征点比例低于它时重新检测
+# - min_redetect_interval:  at least this number of frames between two detections triggered by low confidence
+#                           两次因为置信度低而触发的检测之间至少相隔的帧数
+# - config:                 detection config, see facekit_reina.detection_config (None for the default one)
+#                           检测配置, 见facekit_reina.detection_config (None则使用默认配置)
+class FaceTracker:
+
+    def __init__(self, known_encoding_dict, detect_interval=default_detect_interval,
+                 min_confidence=default_min_confidence, min_redetect_interval=default_min_redetect_interval,
+                 config=None):
+        self.known_matcher = facekit_reina.get_matcher(known_encoding_dict)
+        self.config = config
+        self.detect_interval = max(1, detect_interval)
+        self.min_confidence = min_confidence
+        self.min_redetect_interval = max(1, min_redetect_interval)
+
+        # tracked faces: [(face result, feature points)]
+        # 被跟踪的人脸: [(人脸识别结果, 特征点)]
+        self.tracks = []
+        self.previous_gray = None
+        self.frames_since_detection = 0
+
+        # counters
+        # 计数
+        self.frames = 0
+        self.detections = 0
+
+    #==============================================================
+    # forget all tracked faces, the next frame is detected
+    # 清空所有跟踪的人脸, 下一帧将被检测
+    # @return: (no return)
+    def reset(self):
+        self.tracks = []
+        self.previous_gray = None
+
+    #==============================================================
+    # recognize one frame, by detection or by tracking
+    # 识别一帧, 通过检测或跟踪
+    # @parameter:
+    # - frame:  BGR frame | ndarray
+    #           BGR帧 | ndarray
+    # @return:
+    # - faces:  same as facekit_reina.locate_and_recognize, plus 'confidence' (1.0 on detected frames)
+    #           与facekit_reina.locate_and_recognize相同, 另有'confidence' (检测的帧为1.0)
+    def process(self, frame: numpy.ndarray) -> list:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        self.frames += 1
+        self.frames_since_detection += 1
+
+        faces = None
+        if self.previous_gray is not None and self.frames_since_detection < self.detect_interval:
+            faces, confidence = self._track(gray)
+            # lost faces are detected again, but not more often than min_redetect_interval
+            # 丢失的人脸重新检测, 但不比min_redetect_interval更频繁
+            if confidence < self.min_confidence and self.frames_since_detection >= self.min_redetect_interval:
+                faces = None
+
+        if faces is None:
+            faces = self._detect(frame, gray)
+
+        self.previous_gray = gray
+        return faces
+
+    #==============================================================
+    # recognize one frame and draw the results on it (the frame is changed in place)
+    # 识别一帧并在其上绘制结果 (直接修改这一帧)
+    # can be used as process_frame of stream_reina.StreamPipeline
+    # 可以作为stream_reina.StreamPipeline的process_frame
+    # @parameter:
+    # - frame:  BGR frame | ndarray
+    #           BGR帧 | ndarray
+    # @return:
+    # - frame:  the annotated frame
+    #           绘制后的帧
+    def annotate(self, frame: numpy.ndarray) -> numpy.ndarray:
+        facekit_reina.draw_recognition(frame, self.process(frame))
+        return frame
+
+    def _detect(self, frame, gray):
+        self.detections += 1
+        self.frames_since_detection = 0
+
+        faces = facekit_reina.locate_and_recognize(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), self.known_matcher,
+                                                   self.config)
+        self.tracks = []
+        for face in faces:
+            face['confidence'] = 1.0
+            self.tracks.append((face, _box_points(gray, face['box'])))
+        return faces
+
+    # move every box by the median flow of its points (and scale it by their spread)
+    # returns the faces and the lowest confidence of them
+    # 按特征点的光流中位数移动每个框 (并按特征点的分布缩放)
+    # 返回人脸和其中最低的置信度
+    def _track(self, gray):
+        if len(self.tracks) == 0:
+            return [], 1.0
+
+        height, width = gray.shape[:2]
+        faces = []
+        tracks = []
+        min_confidence = 1.0
+        for face, points in self.tracks:
+            if points is None or len(points) < min_track_points:
+                min_confidence = 0.0
+                continue
+            next_points, status, _ = cv2.calcOpticalFlowPyrLK(self.previous_gray, gray, points, None, **flow_params)
+            is_good = status.reshape(-1) == 1
+            confidence = float(is_good.mean()) * face['confidence']
+            min_confidence = min(min_confidence, confidence)
+            if is_good.sum() < min_track_points:
+                continue
+
+            old_points = points.reshape(-1, 2)[is_good]
+            new_points = next_points.reshape(-1, 2)[is_good]
+            dx, dy = numpy.median(new_points - old_points, axis=0)
+            old_spread = numpy.median(numpy.linalg.norm(old_points - old_points.mean(axis=0), axis=1))
+            new_spread = numpy.median(numpy.linalg.norm(new_points - new_points.mean(axis=0), axis=1))
+            scale = new_spread / old_spread if old_spread > 0 else 1.0
+
+            xmin, xmax, ymin, ymax = face['box']
+            center_x = (xmin + xmax) / 2 + dx
+            center_y = (ymin + ymax) / 2 + dy
+            half_width = (xmax - xmin) * scale / 2
+            half_height = (ymax - ymin) * scale / 2
+
+            moved = dict(face)
+            moved['box'] = [int(round(max(0, center_x - half_width))), int(round(min(width - 1, center_x + half_width))),
+                            int(round(max(0, center_y - half_height))), int(round(min(height - 1, center_y + half_height)))]
+            moved['confidence'] = confidence
+            faces.append(moved)
+            tracks.append((moved, new_points.reshape(-1, 1, 2)))
+
+        self.tracks = tracks
+        return faces, min_confidence
+
+
+# feature points inside a box, None if there is none
+# 框内的特征点, 如果没有则为None
+def _box_points(gray, box):
+    xmin, xmax, ymin, ymax = box
+    mask = numpy.zeros(gray.shape[:2], dtype=numpy.uint8)
+    mask[max(0, ymin):max(0, ymax), max(0, xmin):max(0, xmax)] = 255
+    return cv2.goodFeaturesToTrack(gray, mask=mask, **feature_params)
+
+
+###------------------视频模块 video module------------------###
+
+#==============================================================
+# recognize a video with FaceTracker and write the annotated video
+# 使用FaceTracker识别一个视频并写入带标注的视频
+# @parameter:
+# - video_source:           video filename, camera index or url (anything cv2.VideoCapture accepts)
+#                           视频文件名, 摄像头序号或url (cv2.VideoCapture接受的任何东西)
+# - output_filename:        annotated video filename, None to only recognize
+#                           带标注的视频文件名, None则只识别
+# - known_encoding_dict:    known encoding dictionary, EncodingStore or FaceMatcher
+#                           已知的编码字典, EncodingStore或FaceMatcher
+# - detect_interval:        full detection every detect_interval frames
+#                           每detect_interval帧完整检测一次
+# - max_frames:             stop after this number of frames, None for the whole video
+#                           处理这么多帧后停止, None则处理整个视频
+# - codec:                  fourcc of the output video
+#                           输出视频的fourcc
+# - config:                 detection config, see facekit_reina.detection_config (None for the default one)
+#                           检测配置, 见facekit_reina.detection_config (None则使用默认配置)
+# @return:
+# - stats:  {'frames': int, 'detections': int, 'seconds': float}
+def process_a_video(video_source, output_filename, known_encoding_dict, detect_interval=default_detect_interval,
+                    max_frames=None, codec='MJPG', config=None):
+    video_capture = cv2.VideoCapture(video_source)
+    fps = video_capture.get(cv2.CAP_PROP_FPS) or 20.0
+    frame_size = (int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+    video_writer = None
+    if output_filename is not None:
+        video_writer = cv2.VideoWriter(output_filename, cv2.VideoWriter_fourcc(*codec), fps, frame_size)
+
+    tracker = FaceTracker(known_encoding_dict, detect_interval, config=config)
+    start_time = time.perf_counter()
+    try:
+        while max_frames is None or tracker.frames < max_frames:
+            ret, frame = video_capture.read()
+            if not ret:
+                break
+            tracker.annotate(frame)
+            if video_writer is not None:
+                video_writer.write(frame)
+    finally:
+        video_capture.release()
+        if video_writer is not None:
+            video_writer.release()
+
+    elapsed = time.perf_counter() - start_time
+    print("Complete! {} frames, {} detections in {:.2f}s".format(tracker.frames, tracker.detections, elapsed))
+    return {'frames': tracker.frames, 'detections': tracker.detections, 'seconds': elapsed}
+
+
+###------------------并行视频文件模块 parallel video file module------------------###
+
+#==============================================================
+# split frames [0, frame_count) into consecutive ranges of chunk_frames frames
+# 将帧[0, frame_count)分成连续的chunk_frames帧的范围
+# @parameter:
+# - frame_count:    number of frames
+#                   帧数
+# - chunk_frames:   frames per range
+#                   每个范围的帧数
+# @return:
+# - ranges: [(start, end)], end excluded
+#           [(开始, 结束)], 不包括结束帧
+def split_frame_ranges(frame_count: int, chunk_frames: int = default_chunk_frames) -> list:
+    chunk_frames = max(1, chunk_frames)
+    return [(start, min(start + chunk_frames, frame_count)) for start in range(0, frame_count, chunk_frames)]
+
+
+# the gallery, detect interval and detection config of one worker process, loaded once by the pool initializer
+# 一个工作进程的人脸库, 检测间隔与检测配置, 由进程池的初始化函数加载一次
+_worker_matcher = None
+_worker_detect_interval = None
+_worker_config = None
+
+# pool initializer: memory-map the binary gallery store once per worker
+# 进程池初始化函数: 每个工作进程只内存映射一次二进制人脸库
+def _init_video_worker(store_path, tolerance, use_index, detect_interval, config):
+    global _worker_matcher, _worker_detect_interval, _worker_config
+    _worker_matcher = facekit_reina.get_matcher(gallery_reina.EncodingStore(store_path), tolerance, use_index)
+    _worker_detect_interval = detect_interval
+    _worker_config = config
+
+# a capture of the video positioned at frame start
+# seeking is checked, a backend that can not seek exactly reads from the beginning instead
+# 定位到第start帧的视频捕获
+# 会检查定位结果, 不能精确定位的后端改为从头读取
+def _open_at(video_file, start):
+    video_capture = cv2.VideoCapture(video_file)
+    if start == 0:
+        return video_capture
+    video_capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+    if int(video_capture.get(cv2.CAP_PROP_POS_FRAMES)) == start:
+        return video_capture
+    video_capture.release()
+    video_capture = cv2.VideoCapture(video_file)
+    for _ in range(start):
+        if not video_capture.grab():
+            break
+    return video_capture
+
+# task of one worker: recognize the frames [start, end) with its own capture and tracker
+# returns (records, detections, error), one record per frame read
+# the annotated frames go to part_filename, which the parent joins in order
+# 一个工作进程的任务: 用自己的视频捕获与跟踪器识别帧[start, end)
+# 返回 (记录, 检测次数, 错误), 每读到一帧一条记录
+# 绘制后的帧写入part_filename, 由父进程按顺序拼接
+def _process_video_chunk(task: tuple) -> tuple:
+    video_file, start, end, fps, part_filename, codec, frame_size = task
+    records = []
+    tracker = FaceTracker(_worker_matcher, _worker_detect_interval, config=_worker_config)
+    video_capture = None
+    video_writer = None
+    try:
+        video_capture = _open_at(video_file, start)
+        if part_filename is not None:
+            video_writer = cv2.VideoWriter(part_filename, cv2.VideoWriter_fourcc(*codec), fps, frame_size)
+        frame_index = start
+        while end is None or frame_index < end:
+            ret, frame = video_capture.read()
+            if not ret:
+                break
+            faces = tracker.process(frame)
+            records.append({'frame': frame_index, 'time': frame_index / fps, 'faces': faces})
+            if video_writer is not None:
+                facekit_reina.draw_recognition(frame, faces)
+                video_writer.write(frame)
+            frame_index += 1
+        return records, tracker.detections, None
+    except Exception as error:
+        return records, tracker.detections, repr(error)
+    finally:
+        if video_capture is not None:
+            video_capture.release()
+        if video_writer is not None:
+            video_writer.release()
+
+
+#==============================================================
+# recognize a recorded video file in parallel
+# the file is split into frame ranges, every worker process seeks with its own cv2.VideoCapture and runs its own
+# FaceTracker (every chunk starts with a full detection), so the wall time is about duration / workers;
+# the per-frame results are merged in frame order into one JSONL timeline, one line per frame:
+# {"frame": int, "time": seconds, "faces": [same as FaceTracker.process]}
+# 并行识别一个录制好的视频文件
+# 文件被分成帧范围, 每个工作进程用自己的cv2.VideoCapture定位并运行自己的FaceTracker (每块都从一次完整检测开始),
+# 因此耗时约为 时长 / 工作进程数; 每帧的结果按帧顺序合并为一个JSONL时间线, 每帧一行:
+# {"frame": int, "time": 秒, "faces": [与FaceTracker.process相同]}
+# @parameter:
+# - video_file:         video filename (e.g. 'src/video/footage.mp4')
+#                       视频文件名 (例: 'src/video/footage.mp4')
+# - timeline_file:      JSONL timeline filename
+#                       JSONL时间线文件名
+# - known_path:         path which stores known images | str (e.g. 'src/known/')
+#                       已知人脸图片文件的路径 | str (例: 'src/known/')
+# - output_filename:    annotated video filename, None to write no video
+#                       带标注的视频文件名, None则不写视频
+# - workers:            number of worker processes (None for the number of cpus), 1 to run in this process
+#                       工作进程数 (None则为cpu数), 1则在本进程中运行
+# - chunk_frames:       frames per chunk
+#                       每块的帧数
+# - detect_interval:    full detection every detect_interval frames (1 to detect on every frame)
+#                       每detect_interval帧完整检测一次 (1则每帧都检测)
+# - codec:              fourcc of the output video
+#                       输出视频的fourcc
+# - config:             detection config, see facekit_reina.detection_config (None for the default one)
+#                       检测配置, 见facekit_reina.detection_config (None则使用默认配置)
+# @return:
+# - stats:  {'frames': int, 'detections': int, 'chunks': int, 'failed_chunks': int, 'seconds': float,
+#            'join': 'copy', 'transcode' or None, 'join_seconds': float}
+#           'seconds' is the parallel stage, joining the annotated video is timed apart in 'join_seconds'
+#           'seconds'为并行阶段的耗时, 拼接带标注视频的耗时单独记在'join_seconds'中
+def process_a_video_file(video_file, timeline_file, known_path, output_filename=None, workers=None,
+                         chunk_frames=default_chunk_frames, detect_interval=default_detect_interval, codec='MJPG',
+                         config=None) -> dict:
+    if not os.path.exists(video_file):
+        raise FileNotFoundError(video_file)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # the gallery is updated once here, every worker memory-maps the saved store
+    # 人脸库在这里更新一次, 每个工作进程内存映射保存好的人脸库
+    facekit_reina.update_encoding_store(known_path)
+
+    video_capture = cv2.VideoCapture(video_file)
+    fps = video_capture.get(cv2.CAP_PROP_FPS) or 20.0
+    frame_count = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    frame_size = (int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    video_capture.release()
+
+    # without a frame count the file can not be split, it is one chunk read to the end
+    # 没有帧数时无法分块, 整个文件作为一块读到结尾
+    ranges = split_frame_ranges(frame_count, chunk_frames) if frame_count > 0 else [(0, None)]
+
+    # the annotated chunks are written to a temporary directory next to the output, then joined in order
+    # 绘制后的各块写到输出旁边的临时目录, 然后按顺序拼接
+    part_path = None
+    if output_filename is not None:
+        part_path = tempfile.mkdtemp(prefix='.parts_', dir=os.path.dirname(os.path.abspath(output_filename)))
+    tasks = []
+    for chunk, (start, end) in enumerate(ranges):
+        part_filename = os.path.join(part_path, 'part{:0>6d}.avi'.format(chunk)) if part_path is not None else None
+        tasks.append((video_file, start, end, fps, part_filename, codec, frame_size))
+
+    timeline_path = os.path.dirname(timeline_file)
+    if timeline_path != '' and not os.path.exists(timeline_path):
+        os.makedirs(timeline_path)
+
+    stats = {'frames': 0, 'detections': 0, 'chunks': len(tasks), 'failed_chunks': 0, 'seconds': 0.0,
+             'join': None, 'join_seconds': 0.0}
+    written_parts = []
+    initargs = (facekit_reina.json_path, facekit_reina.fault_tolerance, facekit_reina.use_ann_index,
+                detect_interval, config)
+    start_time = time.perf_counter()
+    pool = None
+    try:
+        if workers <= 1:
+            _init_video_worker(*initargs)
+            results = map(_process_video_chunk, tasks)
+        else:
+            # forked workers share the models loaded once by the parent, imap keeps the order of the chunks
+            # fork出的工作进程共享父进程加载一次的模型, imap保持块的顺序
+            if multiprocessing.get_start_method() == 'fork':
+                facekit_reina.warm_up(config)
+            pool = multiprocessing.Pool(min(workers, len(tasks)), initializer=_init_video_worker,
+                                        initargs=initargs)
+            results = pool.imap(_process_video_chunk, tasks)
+
+        with open(timeline_file, 'w', encoding='utf-8') as timeline:
+            for task, (records, detections, error) in zip(tasks, results):
+                for record in records:
+                    timeline.write(facekit_reina.result_json(record) + '\n')
+                stats['frames'] += len(records)
+                stats['detections'] += detections
+                if len(records) != 0 and task[4] is not None:
+                    written_parts.append(task[4])
+                if error is not None:
+                    stats['failed_chunks'] += 1
+                    print("failed at frames {}-{}: {}".format(task[1], task[2], error))
+                print("{} / {} frames".format(stats['frames'], frame_count if frame_count > 0 else '?'))
+
+        stats['seconds'] = time.perf_counter() - start_time
+
+        if output_filename is not None:
+            join_start = time.perf_counter()
+            stats['join'] = _join_parts(written_parts, output_filename, fps, frame_size, codec)
+            stats['join_seconds'] = time.perf_counter() - join_start
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if part_path is not None:
+            shutil.rmtree(part_path, ignore_errors=True)
+
+    print("Complete! {} frames, {} detections in {:.2f}s ({:.1f} frames/s) with {} worker(s)".format(
+        stats['frames'], stats['detections'], stats['seconds'],
+        stats['frames'] / stats['seconds'] if stats['seconds'] > 0 else 0.0, max(workers, 1)))
+    if stats['join'] is not None:
+        print("video joined by {} in {:.2f}s".format(stats['join'], stats['join_seconds']))
+    return stats
+
+
+# join the annotated chunk videos in order into one video, returns how: 'copy' or 'transcode'
+# ffmpeg (if installed) concatenates the parts without re-encoding, otherwise every frame is decoded and encoded
+# again in this process, a single core pass over the whole video
+# 将绘制后的各块视频按顺序拼接为一个视频, 返回拼接方式: 'copy'或'transcode'
+# ffmpeg(如果已安装)不重新编码而直接拼接各块, 否则在本进程中解码并重新编码每一帧, 即单核处理整个视频一遍
+def _join_parts(part_filenames, output_filename, fps, frame_size, codec):
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is not None and len(part_filenames) != 0:
+        list_filename = os.path.join(os.path.dirname(part_filenames[0]), 'parts.txt')
+        with open(list_filename, 'w', encoding='utf-8') as list_file:
+            for part_filename in part_filenames:
+                list_file.write("file '{}'\n".format(os.path.abspath(part_filename).replace("'", "'\\''")))
+        completed = subprocess.run([ffmpeg, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                                    '-i', list_filename, '-c', 'copy', output_filename])
+        if completed.returncode == 0:
+            return 'copy'
+        print("ffmpeg could not join the parts, they are encoded again")
+
+    video_writer = cv2.VideoWriter(output_filename, cv2.VideoWriter_fourcc(*codec), fps, frame_size)
+    try:
+        for part_filename in part_filenames:
+            video_capture = cv2.VideoCapture(part_filename)
+            while True:
+                ret, frame = video_capture.read()
+                if not ret:
+                    break
+                video_writer.write(frame)
+            video_capture.release()
+    finally:
+        video_writer.release()
+    return 'transcode'
@@ -0,0 +1,267 @@
+'''
+@author Reina
+@desc 持续监视未知人脸文件夹, 只识别新到达的图片
+描述 :
+人脸库只加载一次, 轮询未知人脸文件夹, 只处理新的(或被替换的)图片
+已处理的图片记录在持久的台账(jsonl)中, 重启后从上次停止的地方继续
+台账在启动时与每追加ledger_compact_interval条记录后原子地重写为最新状态 (每个仍存在的文件一条), 不会无限增长
+已知人脸文件夹改变时, 在进程内原地重新加载人脸库
+- FolderWatcher类: 轮询未知人脸文件夹并识别新图片的监视器
+- watch_a_folder函数: 启动监视器直到ctrl+c
+
+description:
+watch the unknown folder and only recognize newly arriving images
+the gallery is loaded once, the unknown folder is polled and only new (or replaced) images are processed
+processed images are recorded in a persistent ledger (jsonl), a restart resumes where it stopped
+the ledger is rewritten atomically to its latest state (one record per file still present) on startup and every
+ledger_compact_interval appended records, so it does not grow without bound
+the gallery is reloaded in place when the known folder changes
+- class: FolderWatcher: watcher polling the unknown folder and recognizing the new images
+- function: watch_a_folder: run the watcher until ctrl+c
+'''
+
+#coding=utf-8
+
+import facekit_reina
+import folder_manager_reina
+
+import os
+import json
+import time
+
+
+###------------------预定义变量 predefinition------------------###
+
+# seconds between two polls of the unknown folder
+# 两次轮询未知人脸文件夹之间的秒数
+default_poll_interval = 1.0
+
+# seconds between two checks of the known folder
+# 两次检查已知人脸文件夹之间的秒数
+default_known_check_interval = 10.0
+
+# ledger filename, saved in the recognized folder by default
+# 台账文件名, 默认保存在识别结果文件夹中
+ledger_filename = 'processed.jsonl'
+
+# rewrite the ledger after this number of appended records
+# 每追加这么多条记录后重写台账
+ledger_compact_interval = 1000
+
+
+###------------------监视模块 watch module------------------###
+
+#==============================================================
+# watcher polling the unknown folder and recognizing the new images
+# an image is processed once its size and modification time are the same in two polls (it is completely written)
+# 轮询未知人脸文件夹并识别新图片的监视器
+# 一张图片的大小与修改时间在两次轮询中相同时(已经写完)才被处理
+# @parameter:
+# - unknown_path:           path which stores unknown images | str (e.g. 'src/unknown/')
+#                           待识别文件夹的路径 | str (例: 'src/unknown/')
+# - recog_file_path:        path to store recogized image file | str (e.g. 'src/recognized/')
+#                           保存识别后图片文件的路径 | str (例: 'src/recognized/')
+# - known_path:             path which stores known images | str (e.g. 'src/known/')
+#                           已知人脸图片文件的路径 | str (例: 'src/known/')
+# - ledger_file:            processed ledger with path, None for recog_file_path + ledger_filename
+#                           带路径的已处理台账文件名, None则为recog_file_path + ledger_filename
+# - poll_interval:          seconds between two polls of the unknown folder
+#                           两次轮询未知人脸文件夹之间的秒数
+# - known_check_interval:   seconds between two checks of the known folder
+#                           两次检查已知人脸文件夹之间的秒数
+# - config:                 detection config, see facekit_reina.detection_config (None for the default one)
+#                           检测配置, 见facekit_reina.detection_config (None则使用默认配置)
+class FolderWatcher:
+
+    def __init__(self, unknown_path, recog_file_path, known_path, ledger_file=None,
+                 poll_interval=default_poll_interval, known_check_interval=default_known_check_interval, config=None):
+        self.unknown_path = unknown_path
+        self.recog_file_path = recog_file_path
+        self.known_path = known_path
+        self.ledger_file = ledger_file if ledger_file is not None else recog_file_path + ledger_filename
+        self.poll_interval = poll_interval
+        self.known_check_interval = known_check_interval
+        self.config = config
+
+        if not os.path.exists(recog_file_path):
+            os.makedirs(recog_file_path)
+
+        # filename -> latest ledger record of the processed images, a ledger with older or broken lines is rewritten
+        # 已处理图片的 文件名 -> 最新的台账记录, 含有旧记录或损坏行的台账被重写
+        self.processed, line_count = self._load_ledger()
+        self.appended = 0
+        if line_count != len(self.processed):
+            self._rewrite_ledger()
+
+        # images seen in the last poll but not processed yet: filename -> [size, mtime]
+        # 上次轮询看到但尚未处理的图片: 文件名 -> [大小, 修改时间]
+        self.pending = {}
+
+        # the gallery is loaded once and only reloaded when the known folder changes
+        # 人脸库只加载一次, 只在已知人脸文件夹改变时重新加载
+        self.known_store = None
+        self.known_matcher = None
+        self.last_known_check = 0.0
+        self.reload_gallery()
+
+        # counters
+        # 计数
+        self.recognized = 0
+        self.failed = 0
+        self.reloads = 0
+
+    #==============================================================
+    # update the binary gallery store and rebuild the matcher
+    # 更新二进制人脸库并重建匹配器
+    # @return: (no return)
+    def reload_gallery(self):
+        self.known_store = facekit_reina.update_encoding_store(self.known_path)
+        self.known_matcher = facekit_reina.get_matcher(self.known_store)
+        self.last_known_check = time.monotonic()
+
+    #==============================================================
+    # reload the gallery if files in the known folder changed (only stat, no hash, no encoding when unchanged)
+    # 如果已知人脸文件夹中的文件改变则重新加载人脸库 (没有变化时只stat, 不计算哈希, 不编码)
+    # @return:
+    # - is_reloaded:    bool
+    def reload_gallery_if_changed(self) -> bool:
+        self.last_known_check = time.monotonic()
+        is_changed = folder_manager_reina.get_change(self.known_path,
+                                                     facekit_reina.json_path + facekit_reina.modate_json,
+                                                     recursive=True)[0]
+        if not is_changed:
+            return False
+
+        version = self.known_store.version
+        self.reload_gallery()
+        if self.known_store.version == version:
+            return False
+        self.reloads += 1
+        print("known gallery reloaded, {} encodings".format(len(self.known_store)))
+        return True
+
+    #==============================================================
+    # poll the unknown folder once and recognize every image that is completely written and not processed yet
+    # 轮询一次未知人脸文件夹, 识别每一张已经写完且尚未处理的图片
+    # @return:
+    # - results:    [(filename with path, number of faces, error or None)], in the order of the filenames
+    #               [(带路径的文件名, 人脸数, 错误或None)], 按文件名顺序
+    def poll_once(self) -> list:
+        if time.monotonic() - self.last_known_check >= self.known_check_interval:
+            self.reload_gallery_if_changed()
+
+        ready = []
+        pending = {}
+        present = folder_manager_reina.scan_folder(self.unknown_path)
+        for filename, state in sorted(present.items()):
+            if os.path.splitext(filename)[1] not in facekit_reina.compatible_formats:
+                continue
+            stat = [state['size'], state['mtime']]
+            record = self.processed.get(filename)
+            if record is not None and [record['size'], record['mtime']] == stat:
+                continue
+            # a file still being written changes between two polls, it waits for the next poll
+            # 仍在写入的文件在两次轮询之间会改变, 它等待下一次轮询
+            if self.pending.get(filename) == stat:
+                ready.append((filename, stat))
+            else:
+                pending[filename] = stat
+        self.pending = pending
+
+        results = []
+        with open(self.ledger_file, 'a', encoding='utf-8') as ledger:
+            for filename, stat in ready:
+                unknown_file_withpath = self.unknown_path + filename
+                try:
+                    faces = facekit_reina.recognize_an_imge(unknown_file_withpath, self.known_matcher,
+                                                            self.recog_file_path, self.config)
+                    result = (unknown_file_withpath, len(faces), None)
+                    self.recognized += 1
+                except Exception as error:
+                    result = (unknown_file_withpath, 0, repr(error))
+                    self.failed += 1
+                    print("failed to recognize " + unknown_file_withpath + ": " + result[2])
+                results.append(result)
+
+                # record the image right after it is processed, a restart never processes it again
+                # 处理后立刻记录这张图片, 重启后不会再次处理它
+                record = {'file': filename, 'size': stat[0], 'mtime': stat[1], 'faces': result[1], 'error': result[2]}
+                self.processed[filename] = record
+                ledger.write(json.dumps(record) + '\n')
+                ledger.flush()
+                self.appended += 1
+
+        # images removed from the unknown folder leave the ledger, one arriving again later is a new image
+        # 从未知人脸文件夹中删除的图片离开台账, 之后再次到达的同名图片视为新图片
+        if self.appended >= ledger_compact_interval:
+            self.processed = {filename: record for filename, record in self.processed.items() if filename in present}
+            self._rewrite_ledger()
+        return results
+
+    #==============================================================
+    # poll until ctrl+c (or max_polls)
+    # 一直轮询直到ctrl+c (或max_polls)
+    # @parameter:
+    # - max_polls:  stop after this number of polls, None to run until ctrl+c
+    #               轮询这么多次后停止, None则一直运行直到ctrl+c
+    # @return:
+    # - stats:  {'recognized': int, 'failed': int, 'reloads': int}
+    def run(self, max_polls=None) -> dict:
+        polls = 0
+        facekit_reina.warm_up(self.config)
+        print("Watching " + self.unknown_path + " ...")
+        try:
+            while max_polls is None or polls < max_polls:
+                start_time = time.monotonic()
+                for unknown_file_withpath, face_count, error in self.poll_once():
+                    if error is None:
+                        print("recognized {} ({} faces)".format(unknown_file_withpath, face_count))
+                polls += 1
+                time.sleep(max(0.0, self.poll_interval - (time.monotonic() - start_time)))
+        except KeyboardInterrupt:
+            print("Stopped.")
+        return {'recognized': self.recognized, 'failed': self.failed, 'reloads': self.reloads}
+
+    # processed images of the ledger and its number of lines,
+    # the last record of a filename wins, a broken last line (crash) is ignored
+    # 台账中已处理的图片与台账的行数, 同一文件名以最后一条记录为准, 忽略损坏的最后一行(崩溃)
+    def _load_ledger(self) -> tuple:
+        processed = {}
+        if not os.path.exists(self.ledger_file):
+            return processed, 0
+        with open(self.ledger_file, 'r', encoding='utf-8') as ledger:
+            lines = ledger.readlines()
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            processed[record['file']] = record
+        return processed, len(lines)
+
+    # rewrite the ledger atomically with the latest record of every processed image
+    # 用每张已处理图片的最新记录原子地重写台账
+    def _rewrite_ledger(self):
+        lines = ''.join(json.dumps(record) + '\n' for _, record in sorted(self.processed.items()))
+        temp_filename = self.ledger_file + '.tmp'
+        with open(temp_filename, 'w', encoding='utf-8') as temp_file:
+            temp_file.write(lines)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_filename, self.ledger_file)
+        self.appended = 0
+
+
+#==============================================================
+# watch the unknown folder until ctrl+c
+# 监视未知人脸文件夹直到ctrl+c
+# @parameter: same as FolderWatcher
+#             与FolderWatcher相同
+# @return:
+# - stats:  {'recognized': int, 'failed': int, 'reloads': int}
+def watch_a_folder(unknown_path, recog_file_path, known_path, ledger_file=None,
+                   poll_interval=default_poll_interval, known_check_interval=default_known_check_interval,
+                   config=None) -> dict:
+    watcher = FolderWatcher(unknown_path, recog_file_path, known_path, ledger_file, poll_interval,
+                            known_check_interval, config)
+    return watcher.run()